@@ -0,0 +1,504 @@
+"""
+异步服务器 - 远程控制系统（被控主机B）
+基于 asyncio 的服务器模式: 所有连接的收发都在一个事件循环中完成,
+截图、Shell 等阻塞操作交给有界线程池, 推流循环作为协程运行,
+空闲或推流中的会话都不再各自占用线程
+"""
+
+import asyncio
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+from protocol import *
+from utils import *
+from multiplex import MUX_CHUNK_SIZE, MAX_MESSAGE_SIZE
+from metrics import count_bytes_out
+from server import RemoteControlServer, ClientSession
+
+
+class AsyncMuxConnection:
+    """
+    基于 asyncio.StreamReader/StreamWriter 的多路复用连接
+
+    线路格式与 MuxConnection 相同 (长度前缀 JSON 消息 + 二进制帧 + DATA 数据块)。
+    读取只在事件循环中进行; send()/send_frame() 可以在任意线程调用,
+    因此现有的 handle_* 处理函数在线程池中运行时无需修改。
+    """
+
+    def __init__(self, reader, writer, loop):
+        """
+        Args:
+            reader: asyncio.StreamReader
+            writer: asyncio.StreamWriter
+            loop: 连接所属的事件循环
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.closed = False
+
+        self._channel_locks = {}
+
+        # 吞吐统计 (字节数含包头)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+
+        # 正在重组的附加数据: channel -> [message, buffer, received]
+        self._partials = {}
+
+        self.last_received = time.monotonic()  # 上次收到数据的时间, 用于判定对端失联
+
+    # ==================== 发送 ====================
+
+    def _channel_lock(self, channel):
+        lock = self._channel_locks.get(channel)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._channel_locks[channel] = lock
+        return lock
+
+    def _packets(self, message, payload):
+        """把消息 (及附加数据) 拆成依次写出的数据包"""
+        channel = get_message_channel(message)
+        if payload is None:
+            return channel, [encode_message(message)]
+
+        view = memoryview(payload).cast('B')
+        message['payload_size'] = len(view)
+        packets = [encode_message(message)]
+
+        for index, offset in enumerate(range(0, len(view), MUX_CHUNK_SIZE)):
+            chunk = view[offset:offset + MUX_CHUNK_SIZE]
+            header = FRAME_HEADER.pack(FRAME_MAGIC, FrameOpcode.DATA, channel,
+                                       index, 0.0, len(chunk))
+            packets.append(header + chunk)
+        return channel, packets
+
+    async def _write_packets(self, channel, packets):
+        # 同一通道的数据包连续写出; 每写一包让出一次, 其他通道可以插在中间
+        async with self._channel_lock(channel):
+            for packet in packets:
+                self.writer.write(packet)
+                self.bytes_sent += len(packet)
+                await self.writer.drain()
+            self.messages_sent += 1
+
+    async def send_async(self, message, payload=None):
+        """
+        发送消息 (在事件循环中调用)
+
+        Args:
+            message: 消息字典
+            payload: 附加的二进制数据
+
+        Returns:
+            bool: 是否发送成功
+        """
+        return await self._send_packets(*self._packets(message, payload))
+
+    async def _send_packets(self, channel, packets):
+        try:
+            await self._write_packets(channel, packets)
+            return True
+        except Exception as e:
+            if not self.closed:
+                print(f"发送消息失败: {e}")
+            return False
+
+    async def send_frame_async(self, opcode, channel, seq, payload, timestamp=None, trace=None):
+        """
+        发送二进制帧 (在事件循环中调用)
+
+        Returns:
+            bool: 是否发送成功
+        """
+        try:
+            buffers = frame_buffers(opcode, channel, seq, bytes(payload), timestamp, trace)
+            self.writer.writelines(buffers)
+            self.bytes_sent += sum(len(buffer) for buffer in buffers)
+            self.messages_sent += 1
+            await self.writer.drain()
+            return True
+        except Exception as e:
+            if not self.closed:
+                print(f"发送帧失败: {e}")
+            return False
+
+    def _in_loop(self):
+        """当前是否运行在连接所属的事件循环中"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _run(self, coro):
+        """在其他线程中执行发送协程并等待结果 (写缓冲区排空后才返回, 形成背压)"""
+        if self._in_loop():
+            # 已在事件循环中: 不能阻塞等待, 交给循环稍后写出
+            self.loop.create_task(coro)
+            return True
+
+        if self.closed:
+            coro.close()
+            return False
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def send(self, message, payload=None):
+        """
+        发送消息 (可在任意线程调用, 与 MuxConnection.send 接口相同)
+
+        Returns:
+            bool: 是否发送成功
+        """
+        channel, packets = self._packets(message, payload)
+        count_bytes_out(sum(len(packet) for packet in packets))
+        return self._run(self._send_packets(channel, packets))
+
+    def send_frame(self, opcode, channel, seq, payload, timestamp=None, trace=None):
+        """
+        发送二进制帧 (可在任意线程调用)
+
+        Returns:
+            bool: 是否发送成功
+        """
+        return self._run(self.send_frame_async(opcode, channel, seq, payload, timestamp, trace))
+
+    # ==================== 接收 ====================
+
+    async def read_message(self):
+        """
+        读取下一条完整消息
+
+        Returns:
+            dict: 消息字典 (带附加数据时含 'payload'); 连接断开返回 None
+        """
+        try:
+            while True:
+                prefix = await self.reader.readexactly(4)
+                self.last_received = time.monotonic()
+
+                if prefix[0] == FRAME_MAGIC:
+                    message = await self._read_frame(prefix)
+                else:
+                    message = await self._read_json(prefix)
+
+                if message is not None:
+                    self.messages_received += 1
+                    return message
+
+        except asyncio.IncompleteReadError:
+            return None
+        except Exception as e:
+            if not self.closed:
+                print(f"接收消息失败: {e}")
+            return None
+
+    async def _read_json(self, prefix):
+        length = struct.unpack('>I', prefix)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise ConnectionError(f"异常的消息长度: {length} 字节")
+
+        message = decode_message(await self.reader.readexactly(length))
+        self.bytes_received += 4 + length
+        message['wire_size'] = 4 + length  # 线路上的字节数 (含附加数据块), 供统计使用
+
+        size = message.pop('payload_size', None)
+        if size is None:
+            return message
+        if size == 0:
+            message['payload'] = bytearray()
+            return message
+
+        self._partials[get_message_channel(message)] = [message, bytearray(size), 0]
+        return None
+
+    async def _read_frame(self, prefix):
+        rest = await self.reader.readexactly(FRAME_HEADER_SIZE - len(prefix))
+        _, opcode, stream_id, seq, timestamp, length = FRAME_HEADER.unpack(prefix + rest)
+        data = await self.reader.readexactly(length)
+        self.bytes_received += FRAME_HEADER_SIZE + length
+
+        if opcode == FrameOpcode.DATA:
+            partial = self._partials.get(stream_id)
+            if partial is None or partial[2] + length > len(partial[1]):
+                print(f"[警告] 通道 {stream_id} 收到无主的数据块, 已丢弃 {length} 字节")
+                return None
+
+            message, buffer, received = partial
+            buffer[received:received + length] = data
+            partial[2] = received + length
+            message['wire_size'] += FRAME_HEADER_SIZE + length
+            if partial[2] < len(buffer):
+                return None
+
+            del self._partials[stream_id]
+            message['payload'] = buffer
+            return message
+
+        msg_type = FRAME_OPCODE_TYPES.get(opcode)
+        if msg_type is None:
+            print(f"[警告] 未知的帧操作码: {opcode}, 已丢弃 {length} 字节")
+            return None
+
+        return {
+            'type': msg_type,
+            'channel': stream_id,
+            'data': {
+                'stream_id': stream_id,
+                'seq': seq,
+                'timestamp': timestamp,
+                'size': length
+            },
+            'payload': data,
+            'wire_size': FRAME_HEADER_SIZE + length
+        }
+
+    def close(self):
+        """关闭连接 (可在任意线程调用)"""
+        self.closed = True
+        try:
+            if self.loop.is_running() and not self._in_loop():
+                self.loop.call_soon_threadsafe(self.writer.close)
+            else:
+                self.writer.close()
+        except Exception:
+            pass
+
+    def abort(self):
+        """立即断开连接, 丢弃未发出的数据 (对端失联时使用, close 会等缓冲区发完)"""
+        self.closed = True
+        try:
+            if self.loop.is_running() and not self._in_loop():
+                self.loop.call_soon_threadsafe(self.writer.transport.abort)
+            else:
+                self.writer.transport.abort()
+        except Exception:
+            pass
+
+
+class AsyncSession(ClientSession):
+    """
+    异步模式下的单个控制会话
+
+    复用 ClientSession 的全部 handle_* 逻辑; 推流循环改为事件循环中的协程。
+    """
+
+    def __init__(self, engine, conn, client_address):
+        """
+        Args:
+            engine: 所属的 AsyncRemoteControlServer
+            conn: AsyncMuxConnection
+            client_address: 客户端地址
+        """
+        super().__init__(engine, conn, client_address)
+        self.engine = engine
+
+    def start_frame_pump(self, opcode, channel, next_frame, is_active, on_end=None, rate=None, trace=False,
+                         stats=None, source=None):
+        """推流循环作为协程运行, 返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(
+            self._frame_pump(opcode, channel, next_frame, is_active, on_end, rate, trace, stats, source),
+            self.engine.loop
+        )
+
+    def wait_frame_pump(self, pump, timeout):
+        if pump is None or pump.done():
+            return
+        try:
+            pump.result(timeout)
+        except Exception:
+            pass
+
+    async def _frame_pump(self, opcode, channel, next_frame, is_active, on_end, rate, trace, stats, source):
+        loop = asyncio.get_running_loop()
+        arrived = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(arrived.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        if source is not None:
+            source.listen(wake)
+        seq = 0
+        try:
+            while is_active():
+                if source is None:
+                    # 没有可等待的队列 (如光标): 取一次, 没有变化时稍后再取
+                    success, result = await loop.run_in_executor(self.engine.loop_executor, next_frame, 0)
+                    if not success:
+                        await asyncio.sleep(STREAM_POLL_INTERVAL)
+                        continue
+                else:
+                    # 等到队列里有可取的帧 (新帧到达时被唤醒), 只有取帧/打包放到线程池
+                    arrived.clear()
+                    wait = source.ready_in()
+                    if wait != 0.0:
+                        try:
+                            await asyncio.wait_for(arrived.wait(), 1.0 if wait is None else wait)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    success, result = await loop.run_in_executor(self.engine.loop_executor, next_frame, 0)
+                    if not success:
+                        continue
+
+                # 连接中断、等待客户端恢复会话期间丢弃帧 (采集保持运行)
+                if self.conn.closed:
+                    continue
+
+                capture_time, data, times = result
+                seq += 1
+                send_start = time.monotonic()
+                if not await self.conn.send_frame_async(opcode, channel, seq, data, capture_time,
+                                                        times if trace else None):
+                    if self.resume_token:
+                        continue  # 连接刚中断, 会话会被保留
+                    print(f"  {Colors.RED}✗ 发送帧数据失败, 停止推流{Colors.RESET}")
+                    break
+                self.report_frame_sent(rate, len(data), time.monotonic() - send_start, stats)
+
+        except Exception as e:
+            print(f"  {Colors.RED}✗ 推流失败: {e}{Colors.RESET}")
+
+        finally:
+            if source is not None:
+                source.unlisten(wake)
+            if on_end:
+                await loop.run_in_executor(self.engine.loop_executor, on_end)
+
+
+class AsyncRemoteControlServer(RemoteControlServer):
+    """基于 asyncio 的远程控制服务器"""
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, workers=ASYNC_EXECUTOR_WORKERS):
+        """
+        Args:
+            host: 服务器监听地址
+            port: 服务器监听端口
+            workers: 执行阻塞操作的线程池大小
+        """
+        super().__init__(host, port)
+        self.workers = workers
+        self.loop_executor = None
+        self.loop = None
+        self._server = None
+
+    def start(self):
+        """启动服务器 (阻塞直到服务器关闭)"""
+        self.print_banner()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print(f"\n{Colors. YELLOW}接收到中断信号, 正在关闭服务器...{Colors.RESET}")
+        except Exception as e:
+            print(f"{Colors.RED}✗ 服务器启动失败: {e}{Colors.RESET}")
+        finally:
+            self.stop()
+
+    async def serve(self):
+        """在当前事件循环中监听并处理连接"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='remote-worker')
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=MAX_CONNECTIONS
+        )
+        self.is_running = True
+
+        self.print_server_info()
+        print(f"  运行模式: {Colors.BOLD}asyncio (线程池 {self.workers} 个线程){Colors.RESET}\n")
+
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # stop() 关闭了监听
+
+    def stop(self):
+        """停止服务器"""
+        if self._server and self.loop and self.loop.is_running():
+            # 事件循环结束后 start() 会再次调用 stop(), 届时再关闭线程池
+            self.loop.call_soon_threadsafe(self._server.close)
+        elif self.loop_executor:
+            self.loop_executor.shutdown(wait=False)
+        super().stop()
+
+    async def run_blocking(self, func, *args):
+        """在线程池中执行阻塞函数"""
+        return await self.loop.run_in_executor(self.loop_executor, func, *args)
+
+    async def handle_connection(self, reader, writer):
+        """
+        处理一个客户端连接 (协程)
+
+        Args:
+            reader: asyncio.StreamReader
+            writer: asyncio.StreamWriter
+        """
+        client_address = writer.get_extra_info('peername') or ('?', 0)
+        print(f"\n{Colors. BLUE}► 收到连接请求: {client_address[0]}:{client_address[1]}{Colors.RESET}")
+
+        conn = AsyncMuxConnection(reader, writer, self.loop)
+        session = AsyncSession(self, conn, client_address)
+        heartbeat_task = None
+        with self._sessions_lock:
+            self.sessions.add(session)
+
+        try:
+            # 等待身份验证
+            message = await conn.read_message()
+            if not await self.run_blocking(session.check_auth_message, message):
+                print(f"{Colors.RED}✗ 身份验证失败, 断开连接: {client_address[0]}{Colors.RESET}")
+                return
+
+            # 凭令牌恢复了原会话: 由原会话接管本连接
+            if session.resumed:
+                with self._sessions_lock:
+                    self.sessions.discard(session)
+                session = session.resumed
+            session.on_authenticated()
+            heartbeat_task = asyncio.create_task(session.heartbeat.run_async())
+
+            # 消息处理循环: 同一会话的请求按顺序处理, 处理期间不占用事件循环
+            while self.is_running and session.is_authenticated:
+                message = await conn.read_message()
+
+                if message is None:
+                    if session.conn is conn:
+                        session.print_disconnected()
+                    break
+
+                await self.run_blocking(session.dispatch_message, message)
+
+        except Exception as e:
+            print(f"{Colors.RED}✗ 处理客户端时发生错误: {e}{Colors.RESET}")
+
+        finally:
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
+            try:
+                kept = await self.run_blocking(session.detach, conn)
+            except asyncio.CancelledError:
+                kept = session.detach(conn)  # 事件循环正在关闭, 直接释放
+            if not kept and session.is_controlled:
+                session.is_controlled = False
+                session.display_controlled_status(False)
+            conn.close()
+            print(f"{Colors. CYAN}► 连接已关闭: {client_address[0]}{Colors.RESET}")
+            session.print_stats(conn)
+
+
+def main():
+    """主函数"""
+    server = AsyncRemoteControlServer()
+    server.start()
+
+
+if __name__ == '__main__':
+    main()
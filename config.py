@@ -12,6 +12,7 @@ SERVER_PORT = 9999       # 服务器监听端口
 CLIENT_PORT = 9999
 BUFFER_SIZE = 4096       # 数据接收缓冲区大小
 MAX_CONNECTIONS = 5      # 最大连接数
+BLOCKING_HANDLER_WORKERS = 8  # 执行阻塞请求 (录音/拍照/Shell/文件等) 的线程数, 所有会话共享
 
 # ==================== 安全配置 ====================
 # 默认密码（强烈建议修改）
@@ -198,8 +199,122 @@ CONNECTION_TIMEOUT = 60
 # 视频流启动超时（秒）- 摄像头初始化可能需要较长时间
 VIDEO_START_TIMEOUT = 60
 
-# 心跳检测间隔（秒）
-HEARTBEAT_INTERVAL = 60
+# 心跳间隔（秒）- 双方按此间隔互发心跳并测量往返时延
+HEARTBEAT_INTERVAL = 5
+
+# 心跳超时（秒）- 连接上超过此时间没有收到任何数据即判定对端失联并断开
+HEARTBEAT_TIMEOUT = 15
+
+# 会话保留时间（秒）- 连接意外中断后, 客户端在此时间内凭恢复令牌重连即可接管原会话
+# (Shell工作目录、屏幕流/视频流等保持运行), 超时后释放会话资源
+RESUME_GRACE_PERIOD = 30
+
+# ==================== 异步服务器配置 ====================
+# 执行阻塞操作 (截图、Shell、文件读写等) 的线程池大小, 与连接数无关
+ASYNC_EXECUTOR_WORKERS = 16
+
+# 推流协程在没有队列可等待时 (如光标) 的轮询间隔（秒）; 画面帧到达时直接唤醒推流协程, 不轮询
+STREAM_POLL_INTERVAL = 1.0 / 60
+
+# ==================== 流水线配置 ====================
+# 屏幕流与摄像头流都按 "采集 → 编码 → 发送" 三段流水线运行 (见 stream_pipeline),
+# 段间只保留最新的一帧 (新帧覆盖未取走的旧帧), 上游不等下游, 下游总是拿到最新的画面
+
+# 摄像头帧缓冲区个数 - 预分配后轮流原地读入, 不为每帧分配新数组;
+# 同时在用的最多有: 正在读入、最新一帧 (预览)、待编码、正在编码各一个
+VIDEO_FRAME_BUFFERS = 4
+
+# ==================== 屏幕流配置 ====================
+# 差量模式下每个观看者的帧队列长度 - 同一屏幕只采集编码一次, 分发到各观看者,
+# 整帧模式每个观看者只保留最新的一帧; 差量帧不能丢弃, 队列满时合并最旧的两帧
+# (慢的观看者只会跳帧, 不影响其他人)
+SCREEN_QUEUE_SIZE = 3
+
+# 分块差量编码的块边长（像素）- 只有变化的块会被重新编码发送
+SCREEN_TILE_SIZE = 64
+
+# 分块差量编码的关键帧间隔（秒）- 定期发送完整画面, 修正可能的累积误差
+SCREEN_KEYFRAME_INTERVAL = 10
+
+# 观看者的块缓存与服务器不一致 (缓存未命中) 时, 重新请求关键帧的最短间隔（秒）
+SCREEN_RESYNC_INTERVAL = 1.0
+
+# 滚动检测 - 大量块变化时检测画面区域的整体平移 (滚动文档/终端),
+# 发送 "复制矩形" 指令和新露出的部分, 而不是重新编码所有变化的块
+SCREEN_SCROLL_DETECT = True
+
+# 判定为滚动所需的最少匹配行 (列) 数
+SCREEN_SCROLL_MIN_LINES = 16
+
+# 块缓存 - 观看者缓存收到过的块, 重复出现的区域 (任务栏、重新打开的窗口等) 只发送内容哈希
+# 客户端默认请求的缓存容量（块数）, 0 为不使用
+SCREEN_TILE_CACHE_SIZE = 1024
+
+# 服务器允许的最大缓存容量（块数）
+SCREEN_TILE_CACHE_MAX = 4096
+
+# 每个会话最多同时运行的屏幕流数 - 同时查看多个显示器时每个显示器一路, 各用一个通道
+SCREEN_MAX_STREAMS = 4
+
+# 观看者默认请求的屏幕编码格式 (在开始消息中协商):
+#   'jpeg' - 有损, 适合照片/视频
+#   'png'  - 调色板 PNG (zlib), 超过调色板颜色数的块量化到 256 色
+#   'webp' - WebP 无损 (需要 Pillow 支持 WebP)
+#   'auto' - 逐块判断: 颜色少的块 (文字、纯色界面) 用无损调色板 PNG, 其余用 JPEG
+SCREEN_CODEC = 'auto'
+
+# 光标的最高发送频率（次/秒）- 光标单独发送, 观看者画在画面上, 不随画面帧率
+SCREEN_CURSOR_RATE = 60
+
+# ==================== 图像编码配置 ====================
+# JPEG 编码后端: 'auto' 为启动后基准测试选最快的, 也可指定 'turbojpeg' / 'cv2' / 'pil'
+IMAGE_ENCODER = 'auto'
+
+# 并行编码的线程数 - 大画面 (4K、多显示器) 分成多块同时编码, 0 为按 CPU 核数自动选择 (最多 8), 1 为不并行
+IMAGE_ENCODE_WORKERS = 0
+
+# 并行编码使用的池: 'thread' (cv2/PIL 编码时释放 GIL) 或 'process' (多进程, 需复制像素数据)
+IMAGE_ENCODE_POOL = 'thread'
+
+# 一次编码的总像素数达到此值才并行 (小区域直接编码更快)
+IMAGE_PARALLEL_MIN_PIXELS = 640 * 480
+
+# 颜色数不超过此值的区域可以无损地用调色板 PNG 编码 ('auto' 编码据此判断文字/纯色块)
+IMAGE_PALETTE_MAX_COLORS = 256
+
+# PNG 的 zlib 压缩级别 (1 最快, 9 最小)
+IMAGE_PNG_COMPRESS_LEVEL = 6
+
+# WebP 无损编码的速度档位 (0 最快, 6 最小)
+IMAGE_WEBP_METHOD = 0
+
+# ==================== 自适应码率配置 ====================
+# 是否默认对屏幕流/视频流启用自适应码率 (客户端可在开始消息中关闭)
+RATE_CONTROL_ENABLED = True
+
+# 评估间隔（秒）
+RATE_CONTROL_INTERVAL = 1.0
+
+# 调整范围 - 由运维设定, 自适应控制不会超出
+RATE_MIN_QUALITY = 30
+RATE_MAX_QUALITY = 90
+RATE_MIN_FPS = 2
+RATE_MAX_FPS = 30
+RATE_MIN_SCALE = 0.5  # 最小分辨率缩放比例
+
+# 每级调整的幅度
+RATE_QUALITY_STEP = 10
+RATE_SCALE_STEP = 0.25
+
+# 发送阻塞时间占比高于此值视为拥塞, 低于 RATE_SEND_BUSY_LOW 视为有余量
+RATE_SEND_BUSY_HIGH = 0.5
+RATE_SEND_BUSY_LOW = 0.2
+
+# 往返时延超过 最小值 x 2 + 此值（秒）视为拥塞 (数据在发送队列中排队)
+RATE_RTT_SLACK = 0.05
+
+# 连续多少个评估周期畅通后升一级
+RATE_INCREASE_AFTER = 3
 
 # ==================== 日志配置 ====================
 # 是否启用日志
@@ -208,6 +323,25 @@ ENABLE_LOGGING = True
 # 日志文件路径
 LOG_FILE = os. path.join(os.path. dirname(__file__), 'server.log')
 
+# 性能统计输出文件 (METRICS 请求带 dump 或服务器关闭时写入)
+METRICS_FILE = os.path.join(os.path.dirname(__file__), 'logs', 'metrics.json')
+
+# 计算耗时分位数时, 每个处理函数保留的最近调用次数
+METRICS_SAMPLE_SIZE = 1000
+
+# 观看者是否默认请求帧时延追踪 (截屏/编码/排队/网络/解码/绘制各阶段耗时, 见 frame_trace)
+LATENCY_TRACE_ENABLED = True
+
+# 时延追踪保留的最近帧数 (用于分位数与导出 CSV)
+LATENCY_TRACE_SAMPLES = 1000
+
+# 时延直方图的区间上限 (毫秒), 最后一个区间为 "以上"
+LATENCY_HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# 时延追踪导出的 CSV 文件
+LATENCY_TRACE_FILE = os.path.join(os.path.dirname(__file__), 'logs', 'latency.csv')
+LATENCY_HISTOGRAM_FILE = os.path.join(os.path.dirname(__file__), 'logs', 'latency_histogram.csv')
+
 # ==================== 显示配置 ====================
 # 服务器状态显示颜色（ANSI转义码）
 class Colors:
@@ -0,0 +1,232 @@
+"""
+消息分发表 - 远程控制系统
+消息类型 -> 处理函数的注册表, 处理函数用 @message_handler 声明自己处理的
+消息类型以及从消息 data 中取出的参数 (参数名、类型与默认值);
+参数在调用处理函数之前按声明的类型检查/转换, 不符合的请求不会交给处理函数。
+声明为 blocking 的处理函数交给 HandlerPool 在后台线程中执行
+"""
+
+import collections
+import contextvars
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 参数声明为 PAYLOAD 时, 传入消息附加的二进制数据而不是 data 中的字段
+PAYLOAD = object()
+
+# 消息类型 -> MessageHandler
+HANDLERS = {}
+
+
+class MessageHandler:
+    """一个已注册的处理函数"""
+
+    def __init__(self, msg_type, name, args, log=True, blocking=False):
+        """
+        Args:
+            msg_type: 处理的消息类型
+            name: 处理函数 (方法) 名, 分发时按名称查找, 子类可以覆盖
+            args: 参数表 {参数名: (类型, 默认值) 或 PAYLOAD}, 按声明顺序
+            log: 收到请求时是否打印日志 (高频消息如鼠标事件应关闭)
+            blocking: 是否会长时间阻塞 (设备/子进程/磁盘), 是则放到后台线程执行
+        """
+        self.msg_type = msg_type
+        self.name = name
+        self.args = args
+        self.log = log
+        self.blocking = blocking
+
+    def build_arguments(self, message):
+        """
+        按参数表从消息中取出调用参数: 缺省或为 null 的参数取默认值, 其余按声明的类型转换
+
+        Args:
+            message: 请求消息
+
+        Returns:
+            dict: 关键字参数
+
+        Raises:
+            ValueError: 参数类型不符且无法转换
+        """
+        data = message.get('data') or {}
+        if not isinstance(data, dict):
+            raise ValueError("消息数据格式无效")
+        kwargs = {}
+        for arg, spec in self.args.items():
+            if spec is PAYLOAD:
+                kwargs[arg] = message.get('payload')
+                continue
+            kind, default = spec
+            value = data.get(arg)
+            if value is None:
+                kwargs[arg] = default
+                continue
+            try:
+                kwargs[arg] = convert_argument(kind, value)
+            except ValueError:
+                raise ValueError(f"{arg} 应为 {kind.__name__}, 收到 {value!r:.40}") from None
+        return kwargs
+
+
+def convert_argument(kind, value):
+    """
+    把参数值转换为声明的类型
+
+    数字可以来自数字字符串, int 只接受整数值, float 只接受有限值;
+    bool 接受 true/false 与 0/1; object 表示不检查
+
+    Args:
+        kind: 声明的类型 (int / float / bool / str / dict / list / object)
+        value: 消息中的值 (不为 None)
+
+    Returns:
+        转换后的值
+
+    Raises:
+        ValueError: 无法转换
+    """
+    if kind is object:
+        return value
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+    elif kind in (int, float):
+        if isinstance(value, str):
+            try:
+                value = int(value) if kind is int else float(value)
+            except ValueError:
+                pass
+        if isinstance(value, int) and not isinstance(value, bool):
+            if kind is int:
+                return value
+            try:
+                value = float(value)
+            except OverflowError:
+                pass
+        if isinstance(value, float) and math.isfinite(value):
+            if kind is float:
+                return value
+            if value.is_integer():
+                return int(value)
+    elif kind is list:
+        if isinstance(value, (list, tuple)):
+            return list(value)
+    elif isinstance(value, kind):
+        return value
+    raise ValueError(f"无法转换为 {kind.__name__}: {value!r:.40}")
+
+
+def message_handler(msg_type, log=True, blocking=False, **args):
+    """
+    注册处理函数的装饰器
+
+    用法:
+        @message_handler(MessageType.VIDEO_START, width=(int, 640), height=(int, 480), fps=(int, 30))
+        def handle_video_start(self, width, height, fps): ...
+
+    Args:
+        msg_type: 处理的消息类型
+        log: 收到请求时是否打印日志
+        blocking: 是否放到后台线程执行 (响应完成后异步发回)
+        **args: 参数表, 参数名即 data 中的字段名, 值为 (类型, 缺省或为 null 时的默认值)
+                或 PAYLOAD; 类型见 convert_argument
+    """
+    for arg, spec in args.items():
+        if spec is not PAYLOAD and not (isinstance(spec, tuple) and len(spec) == 2 and isinstance(spec[0], type)):
+            raise TypeError(f"参数 {arg} 应声明为 (类型, 默认值) 或 PAYLOAD")
+
+    def decorator(func):
+        if msg_type in HANDLERS:
+            raise ValueError(f"消息类型 {msg_type} 已注册处理函数 {HANDLERS[msg_type].name}")
+        HANDLERS[msg_type] = MessageHandler(msg_type, func.__name__, args, log, blocking)
+        return func
+    return decorator
+
+
+def get_handler(msg_type):
+    """
+    查找消息类型对应的处理函数
+
+    Args:
+        msg_type: 消息类型
+
+    Returns:
+        MessageHandler: 未注册返回 None
+    """
+    return HANDLERS.get(msg_type)
+
+
+class HandlerPool:
+    """
+    执行阻塞处理函数的有界线程池
+
+    任务按 key (会话 + 通道) 排队: 同一 key 的任务按提交顺序逐个执行
+    (如同一会话的 Shell 命令、摄像头开/关), 不同 key 之间并行。
+    任务在提交时的上下文 (如正在响应的请求) 中执行。
+    """
+
+    def __init__(self, max_workers):
+        """
+        Args:
+            max_workers: 线程数上限
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='handler')
+        self._lanes = {}  # key -> 等待执行的任务队列 (正在执行的 key 才在表中)
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, /, *args, **kwargs):
+        """
+        提交任务
+
+        Args:
+            key: 排队键, 同一 key 的任务串行执行
+            func: 任务函数
+        """
+        task = (contextvars.copy_context(), func, args, kwargs)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append(task)
+                return
+            self._lanes[key] = collections.deque([task])
+        self.executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                lane = self._lanes[key]
+                if not lane:
+                    del self._lanes[key]
+                    return
+                context, func, args, kwargs = lane.popleft()
+            try:
+                context.run(func, *args, **kwargs)
+            except Exception as e:
+                print(f"后台处理失败: {e}")
+
+    def discard(self, owner):
+        """
+        丢弃某个会话尚未开始执行的任务 (key 的第一项为会话对象)
+
+        Args:
+            owner: 会话对象
+
+        Returns:
+            int: 丢弃的任务数
+        """
+        count = 0
+        with self._lock:
+            for key, lane in self._lanes.items():
+                if key[0] is owner:
+                    count += len(lane)
+                    lane.clear()
+        return count
+
+    def shutdown(self):
+        """停止接受新任务 (不等待正在执行的任务)"""
+        self.executor.shutdown(wait=False)
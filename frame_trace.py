@@ -0,0 +1,166 @@
+"""
+帧时延追踪 - 远程控制系统
+统计屏幕/摄像头每一帧在流水线各阶段的耗时:
+    grab     截屏 / 读取摄像头 (服务器)
+    encode   编码 (服务器)
+    queue    编码完成到开始发送: 订阅者队列、打包 (服务器)
+    network  发送到接收: socket 缓冲区与链路
+    wait     接收到开始解码: 客户端通道队列
+    decode   解码、拼合画面 (客户端)
+    paint    绘制到窗口 (客户端)
+    total    以上之和, 即从开始截屏到画面显示
+
+观看者在开始消息中请求 trace 后, 服务器随帧附带截屏耗时、编码耗时与发送时间
+(见 protocol.FRAME_TRACE), 接收线程记下接收时间; 观看者解码、绘制后调用
+LatencyTracer.record()。结果汇总为直方图与分位数, 可画在画面上或导出为 CSV。
+
+双方时钟不同步, 网络阶段按 "接收时间 - 发送时间" 减去其历史最小值 (时钟差 + 最短传输时间)
+估计, 再加上最小往返时延的一半 (有心跳测量时), 即相对于最快一帧多出的排队时间。
+"""
+
+import bisect
+import collections
+import csv
+import os
+import threading
+
+from config import LATENCY_TRACE_SAMPLES, LATENCY_HISTOGRAM_BUCKETS, LATENCY_TRACE_FILE, LATENCY_HISTOGRAM_FILE
+from metrics import percentile
+
+# 各阶段 (按流水线顺序), 最后为总时延
+STAGES = ('grab', 'encode', 'queue', 'network', 'wait', 'decode', 'paint', 'total')
+
+
+class LatencyTracer:
+    """一路屏幕流/视频流的时延统计 (线程安全: 观看者线程记录, 界面线程读取与导出)"""
+
+    def __init__(self, sample_size=LATENCY_TRACE_SAMPLES, buckets=LATENCY_HISTOGRAM_BUCKETS):
+        """
+        Args:
+            sample_size: 保留最近多少帧 (分位数与导出 CSV)
+            buckets: 直方图的区间上限 (毫秒)
+        """
+        self.buckets = tuple(buckets)
+        self.frames = collections.deque(maxlen=sample_size)
+        self.histograms = {stage: [0] * (len(self.buckets) + 1) for stage in STAGES}
+        self.count = 0
+        self._clock_offset = None  # min(接收时间 - 发送时间)
+        self._lock = threading.Lock()
+
+    def record(self, message, decode_start, decoded, painted, min_rtt=None):
+        """
+        记录一帧
+
+        Args:
+            message: 带追踪字段的帧消息 (data 中有 grab / encode / sent_at / received_at)
+            decode_start: 开始解码的时间 (time.time())
+            decoded: 解码完成的时间
+            painted: 绘制完成的时间
+            min_rtt: 最小往返时延(秒), 用于估计最短传输时间; None 表示未知
+
+        Returns:
+            dict: 各阶段耗时 (毫秒); 消息不带追踪字段时返回 None
+        """
+        data = message.get('data') or {}
+        if 'sent_at' not in data:
+            return None
+
+        transit = data['received_at'] - data['sent_at']
+        with self._lock:
+            if self._clock_offset is None or transit < self._clock_offset:
+                self._clock_offset = transit
+            network = transit - self._clock_offset + (min_rtt or 0.0) / 2
+
+            stages = {
+                'grab': data['grab'],
+                'encode': data['encode'],
+                'queue': data['sent_at'] - data['timestamp'] - data['grab'] - data['encode'],
+                'network': network,
+                'wait': decode_start - data['received_at'],
+                'decode': decoded - decode_start,
+                'paint': painted - decoded
+            }
+            stages = {stage: max(value, 0.0) * 1000 for stage, value in stages.items()}
+            stages['total'] = sum(stages.values())
+
+            for stage, value in stages.items():
+                self.histograms[stage][bisect.bisect_left(self.buckets, value)] += 1
+            self.frames.append((data.get('seq', 0), data['timestamp'], stages))
+            self.count += 1
+        return stages
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {阶段: {'p50_ms', 'p95_ms', 'max_ms'}} (最近 sample_size 帧)
+        """
+        with self._lock:
+            frames = [stages for _, _, stages in self.frames]
+        result = {}
+        for stage in STAGES:
+            values = sorted(stages[stage] for stages in frames)
+            result[stage] = {
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'max_ms': values[-1] if values else 0.0
+            }
+        return result
+
+    def overlay_lines(self):
+        """
+        Returns:
+            list: 画在画面上的文字, 每个阶段一行 (p50 / p95)
+        """
+        if not self.count:
+            return []
+        lines = [f"latency ({len(self.frames)} frames)   p50 / p95 ms"]
+        for stage, values in self.snapshot().items():
+            lines.append(f"{stage:<8}{values['p50_ms']:7.1f} {values['p95_ms']:7.1f}")
+        return lines
+
+    def export_csv(self, filepath=LATENCY_TRACE_FILE):
+        """
+        把最近各帧的阶段耗时写入 CSV (每帧一行)
+
+        Returns:
+            tuple: (success, filepath 或 错误信息)
+        """
+        with self._lock:
+            frames = list(self.frames)
+        rows = [[seq, f"{timestamp:.6f}"] + [f"{stages[stage]:.3f}" for stage in STAGES]
+                for seq, timestamp, stages in frames]
+        return _write_csv(filepath, ['seq', 'capture_time'] + [f"{stage}_ms" for stage in STAGES], rows)
+
+    def export_histogram_csv(self, filepath=LATENCY_HISTOGRAM_FILE):
+        """
+        把各阶段的时延直方图写入 CSV (每个区间一行, 每个阶段一列, 统计全部帧)
+
+        Returns:
+            tuple: (success, filepath 或 错误信息)
+        """
+        with self._lock:
+            histograms = {stage: list(counts) for stage, counts in self.histograms.items()}
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        rows = [[label] + [histograms[stage][index] for stage in STAGES] for index, label in enumerate(labels)]
+        return _write_csv(filepath, ['bucket_ms'] + list(STAGES), rows)
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self.frames.clear()
+            for counts in self.histograms.values():
+                counts[:] = [0] * len(counts)
+            self.count = 0
+            self._clock_offset = None
+
+
+def _write_csv(filepath, header, rows):
+    try:
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        with open(filepath, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return True, filepath
+    except Exception as e:
+        return False, f"写入 CSV 失败: {e}"
@@ -0,0 +1,234 @@
+"""
+心跳模块 - 远程控制系统
+连接双方按 HEARTBEAT_INTERVAL 互发心跳, 对端立即回复 HEARTBEAT_ACK 并带回心跳的发送时间,
+据此持续估算往返时延 (RTT, 供推流质量控制等使用);
+连接上超过 HEARTBEAT_TIMEOUT 收不到任何数据即判定对端失联, 立即断开连接,
+会话随之结束并停止推流
+"""
+
+import asyncio
+import threading
+import time
+
+from config import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT
+from protocol import MessageType, create_heartbeat_message, create_heartbeat_ack_message, replying_to
+
+# 平滑往返时延的更新系数 (与 TCP 计算 SRTT/RTTVAR 的系数相同)
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+
+class RttEstimator:
+    """往返时延估算: 平滑值 (srtt)、抖动 (rttvar)、最近一次与最小值"""
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.last = None
+        self.min = None
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def update(self, sample):
+        """
+        加入一次测量值
+
+        Args:
+            sample: 往返时延(秒)
+        """
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = sample
+                self.rttvar = sample / 2
+            else:
+                self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - sample)
+                self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * sample
+            self.last = sample
+            self.min = sample if self.min is None else min(self.min, sample)
+            self.samples += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 估算结果 (单位为毫秒, 尚无测量值时为 None)
+        """
+        def ms(value):
+            return None if value is None else value * 1000
+
+        with self._lock:
+            return {
+                'rtt_ms': ms(self.srtt),
+                'rtt_var_ms': ms(self.rttvar) if self.samples else None,
+                'last_rtt_ms': ms(self.last),
+                'min_rtt_ms': ms(self.min),
+                'samples': self.samples
+            }
+
+
+class Heartbeat:
+    """
+    一条连接的心跳
+
+    发送: start() 启动后台线程 (线程模式) 或 await run_async() (asyncio 模式),
+          每 interval 秒检查一次对端是否失联, 然后发出一次心跳。
+    接收: 收到对端的 HEARTBEAT 调用 acknowledge() 回复,
+          收到 HEARTBEAT_ACK 调用 on_ack() 更新往返时延;
+          handle_message() 对两者做了判断, 可直接放在接收循环中使用。
+    """
+
+    def __init__(self, conn, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT):
+        """
+        Args:
+            conn: 多路复用连接 (MuxConnection / AsyncMuxConnection)
+            interval: 心跳间隔(秒)
+            timeout: 超过此时间收不到任何数据即判定对端失联(秒)
+        """
+        self.conn = conn
+        self.interval = interval
+        self.timeout = timeout
+        self.estimator = RttEstimator()
+        self.seq = 0
+        self.acked = 0
+        self.expired = False
+        self._listeners = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def rtt(self):
+        """平滑往返时延(秒), 尚无测量值时为 None"""
+        return self.estimator.srtt
+
+    def add_listener(self, callback):
+        """
+        注册往返时延更新的回调
+
+        Args:
+            callback: callback(srtt, sample), 单位为秒, 在接收线程中调用
+        """
+        self._listeners.append(callback)
+
+    # ==================== 接收 ====================
+
+    def handle_message(self, message):
+        """
+        处理心跳相关的消息
+
+        Args:
+            message: 收到的消息
+
+        Returns:
+            bool: 是否为心跳消息 (是则已处理, 无需再分发)
+        """
+        msg_type = message.get('type')
+        if msg_type not in (MessageType.HEARTBEAT, MessageType.HEARTBEAT_ACK):
+            return False
+
+        data = message.get('data') or {}
+        if msg_type == MessageType.HEARTBEAT:
+            with replying_to(message):
+                self.acknowledge(data.get('seq', 0), data.get('sent_at', 0.0))
+        else:
+            self.on_ack(data.get('seq', 0), data.get('sent_at'))
+        return True
+
+    def acknowledge(self, seq, sent_at):
+        """
+        回复对端的心跳 (原样带回序号与发送时间)
+
+        Args:
+            seq: 心跳序号
+            sent_at: 心跳中的发送时间
+        """
+        self.conn.send(create_heartbeat_ack_message(seq, sent_at))
+
+    def on_ack(self, seq, sent_at):
+        """
+        收到心跳应答, 更新往返时延
+
+        Args:
+            seq: 心跳序号
+            sent_at: 本端发出心跳时的单调时钟
+        """
+        if sent_at is None:
+            return
+        sample = time.monotonic() - sent_at
+        if sample < 0:
+            return
+
+        self.acked += 1
+        self.estimator.update(sample)
+        for callback in self._listeners:
+            try:
+                callback(self.estimator.srtt, sample)
+            except Exception as e:
+                print(f"往返时延回调失败: {e}")
+
+    # ==================== 发送 ====================
+
+    def _next_ping(self):
+        self.seq += 1
+        return create_heartbeat_message(self.seq, time.monotonic())
+
+    def silence(self):
+        """
+        Returns:
+            float: 距上次从连接上收到数据的秒数
+        """
+        return time.monotonic() - self.conn.last_received
+
+    def check_expired(self):
+        """
+        检查对端是否失联, 失联则立即断开连接 (阻塞中的收发随之返回)
+
+        Returns:
+            bool: 是否已失联
+        """
+        if not self.expired and self.silence() >= self.timeout:
+            self.expired = True
+            print(f"[心跳] {self.silence():.1f}秒未收到对端数据, 判定连接已失效")
+            self.conn.abort()
+        return self.expired
+
+    def start(self):
+        """启动心跳线程 (线程模式)"""
+        # 发送阻塞 (对端不再接收, 发送缓冲区已满) 超过超时时间也按失联处理,
+        # 心跳线程不会卡在一次发送上
+        sock = getattr(self.conn, 'sock', None)
+        if sock is not None:
+            sock.settimeout(self.timeout)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.conn.closed or self.check_expired():
+                break
+            self.conn.send(self._next_ping())
+
+    async def run_async(self):
+        """心跳协程 (asyncio 模式), 连接关闭或被取消时结束"""
+        while not self.conn.closed:
+            await asyncio.sleep(self.interval)
+            if self.conn.closed or self.check_expired():
+                break
+            try:
+                await asyncio.wait_for(self.conn.send_async(self._next_ping()), self.timeout)
+            except asyncio.TimeoutError:
+                pass  # 发送一直无法完成, 交给下一轮的失联检查
+
+    def stop(self):
+        """停止心跳线程"""
+        self._stop_event.set()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: 往返时延估算结果及心跳收发计数
+        """
+        stats = self.estimator.snapshot()
+        stats['heartbeats_sent'] = self.seq
+        stats['heartbeats_acked'] = self.acked
+        return stats
@@ -0,0 +1,394 @@
+"""
+图像编码模块 - 远程控制系统
+屏幕流、截图、摄像头共用的 JPEG 编码: 直接接受 NumPy 像素数组
+(mss 截图的 BGRA 原始数据、OpenCV 的 BGR 帧或 RGB 数组), 不先转换为 RGB 副本;
+在可用的后端 (TurboJPEG、OpenCV、PIL) 中运行一次小型基准测试, 选用本机最快的。
+屏幕流还可以使用无损格式 (调色板 PNG、WebP 无损), 或逐块选择 (encode_image)。
+大画面可拆成多块在线程池 (或进程池) 中并行编码 (encode_image_many)
+"""
+
+import io
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from config import (IMAGE_ENCODER, IMAGE_ENCODE_WORKERS, IMAGE_ENCODE_POOL, IMAGE_PARALLEL_MIN_PIXELS,
+                    IMAGE_PALETTE_MAX_COLORS, IMAGE_PNG_COMPRESS_LEVEL, IMAGE_WEBP_METHOD)
+
+# 像素格式 (每个像素的通道顺序)
+PIXEL_BGRA = 'BGRA'  # mss 截图的原始数据
+PIXEL_BGR = 'BGR'    # OpenCV 帧
+PIXEL_RGB = 'RGB'    # PIL / 一般的 RGB 数组
+
+# 编码格式
+CODEC_JPEG = 'jpeg'  # 有损
+CODEC_PNG = 'png'    # 调色板 PNG (颜色多时量化到 256 色)
+CODEC_WEBP = 'webp'  # WebP 无损
+CODEC_AUTO = 'auto'  # 颜色少的区域用调色板 PNG (无损), 其余用 JPEG
+
+# PIL 的 raw 解码模式 (在 C 代码中完成通道转换)
+_RAW_MODES = {PIXEL_BGRA: 'BGRX', PIXEL_BGR: 'BGR', PIXEL_RGB: 'RGB'}
+
+
+class TurboJpegBackend:
+    """libjpeg-turbo (PyTurboJPEG), 直接编码 BGRA/BGR/RGB"""
+
+    name = 'turbojpeg'
+
+    def __init__(self):
+        from turbojpeg import TurboJPEG, TJPF_BGRA, TJPF_BGR, TJPF_RGB
+        self._jpeg = TurboJPEG()
+        self._formats = {PIXEL_BGRA: TJPF_BGRA, PIXEL_BGR: TJPF_BGR, PIXEL_RGB: TJPF_RGB}
+
+    def encode(self, pixels, quality, pixel_format):
+        return self._jpeg.encode(np.ascontiguousarray(pixels), quality=quality,
+                                 pixel_format=self._formats[pixel_format])
+
+
+class OpenCVBackend:
+    """OpenCV (cv2.imencode), 需要 BGR 输入"""
+
+    name = 'cv2'
+
+    def __init__(self):
+        import cv2
+        self._cv2 = cv2
+        self._conversions = {PIXEL_BGRA: cv2.COLOR_BGRA2BGR, PIXEL_RGB: cv2.COLOR_RGB2BGR}
+
+    def encode(self, pixels, quality, pixel_format):
+        cv2 = self._cv2
+        if pixel_format != PIXEL_BGR:
+            pixels = cv2.cvtColor(pixels, self._conversions[pixel_format])
+        success, buffer = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not success:
+            raise Exception("JPEG编码失败")
+        return buffer.tobytes()
+
+
+class PILBackend:
+    """PIL (不使用 optimize, 它要多扫描一遍数据, 只换来很小的体积收益)"""
+
+    name = 'pil'
+
+    def __init__(self):
+        import PIL.Image  # noqa: F401 (检查是否安装)
+
+    def encode(self, pixels, quality, pixel_format):
+        bio = io.BytesIO()
+        pil_image(pixels, pixel_format).save(bio, format='JPEG', quality=int(quality))
+        return bio.getvalue()
+
+
+# 候选后端, 按优先顺序 (基准测试结果相近时靠前的优先)
+BACKENDS = [TurboJpegBackend, OpenCVBackend, PILBackend]
+
+_encoder = None
+_benchmark = {}
+_encoder_lock = threading.Lock()
+
+# 并行编码池 (首次使用时创建)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pil_image(pixels, pixel_format):
+    """
+    像素数组转为 PIL RGB 图像 (通道转换在 PIL 的 C 代码中完成)
+
+    Args:
+        pixels: (h, w, 3 或 4) uint8 数组
+        pixel_format: 通道顺序
+
+    Returns:
+        PIL.Image.Image
+    """
+    from PIL import Image
+    pixels = np.ascontiguousarray(pixels)
+    height, width = pixels.shape[:2]
+    return Image.frombuffer('RGB', (width, height), pixels, 'raw', _RAW_MODES[pixel_format], 0, 1)
+
+
+def _benchmark_frame():
+    """基准测试用的画面: 平滑渐变加上若干块高对比度内容, 接近一般的桌面"""
+    height, width = 360, 640
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    frame[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    frame[..., 2] = 128
+    frame[..., 3] = 255
+    rng = np.random.default_rng(0)
+    for y in range(0, height, 60):
+        frame[y:y + 16, 40:600, :3] = rng.integers(0, 255, (16, 560, 3), dtype=np.uint8)
+    return frame
+
+
+def select_encoder(name=IMAGE_ENCODER):
+    """
+    选择编码后端
+
+    Args:
+        name: 'auto' 为基准测试后选最快的; 否则为后端名称 (turbojpeg / cv2 / pil),
+              该后端不可用时退回基准测试
+
+    Returns:
+        编码后端对象
+    """
+    available = []
+    for backend in BACKENDS:
+        try:
+            available.append(backend())
+        except Exception:
+            continue  # 未安装
+    if not available:
+        raise Exception("没有可用的 JPEG 编码器: 请安装 opencv-python 或 Pillow")
+
+    for backend in available:
+        if backend.name == name:
+            return backend
+
+    frame = _benchmark_frame()
+    best, best_time = None, None
+    for backend in available:
+        try:
+            backend.encode(frame, 70, PIXEL_BGRA)  # 预热
+            elapsed = min(_time_encode(backend, frame) for _ in range(3))
+        except Exception:
+            continue
+        _benchmark[backend.name] = elapsed * 1000
+        if best is None or elapsed < best_time * 0.9:
+            best, best_time = backend, elapsed
+    if best is None:
+        raise Exception("所有 JPEG 编码器都无法工作")
+    return best
+
+
+def _time_encode(backend, frame):
+    start = time.perf_counter()
+    backend.encode(frame, 70, PIXEL_BGRA)
+    return time.perf_counter() - start
+
+
+def get_encoder():
+    """
+    Returns:
+        本机选定的编码后端 (首次调用时选择)
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = select_encoder()
+                print(f"[图像编码] 使用 {_encoder.name} 编码 JPEG")
+    return _encoder
+
+
+def encode_jpeg(pixels, quality=85, pixel_format=PIXEL_RGB):
+    """
+    把像素数组编码为 JPEG
+
+    Args:
+        pixels: (h, w, 3 或 4) uint8 数组, 可以是大数组的切片 (不要求连续)
+        quality: JPEG质量 (1-100)
+        pixel_format: 通道顺序 (PIXEL_BGRA / PIXEL_BGR / PIXEL_RGB)
+
+    Returns:
+        bytes: JPEG 数据
+    """
+    return get_encoder().encode(pixels, quality, pixel_format)
+
+
+def _packed_colors(pixels):
+    """每个像素的颜色打包为一个 uint32 (通道顺序与输入相同, 忽略 alpha)"""
+    channels = pixels[..., :3].astype(np.uint32)
+    return (channels[..., 0] << 16) | (channels[..., 1] << 8) | channels[..., 2]
+
+
+def count_colors(pixels):
+    """
+    Args:
+        pixels: (h, w, 3 或 4) uint8 数组
+
+    Returns:
+        int: 不同颜色的数量
+    """
+    return len(np.unique(_packed_colors(pixels)))
+
+
+def encode_png(pixels, pixel_format=PIXEL_RGB):
+    """
+    编码为调色板 PNG: 颜色不超过 IMAGE_PALETTE_MAX_COLORS 时使用精确的调色板 (无损),
+    否则量化到 256 色
+
+    Args:
+        pixels: 像素数组
+        pixel_format: 通道顺序
+
+    Returns:
+        bytes: PNG 数据
+    """
+    from PIL import Image
+    height, width = pixels.shape[:2]
+    colors, indices = np.unique(_packed_colors(pixels), return_inverse=True)
+    if len(colors) <= IMAGE_PALETTE_MAX_COLORS:
+        first, second, third = (colors >> 16) & 0xFF, (colors >> 8) & 0xFF, colors & 0xFF
+        red, blue = (third, first) if pixel_format != PIXEL_RGB else (first, third)
+        palette = np.stack([red, second, blue], axis=1).astype(np.uint8)
+        image = Image.frombuffer('P', (width, height), indices.astype(np.uint8).tobytes(), 'raw', 'P', 0, 1)
+        image.putpalette(palette.tobytes())
+    else:
+        image = pil_image(pixels, pixel_format).quantize(256, method=Image.Quantize.FASTOCTREE)
+    bio = io.BytesIO()
+    image.save(bio, format='PNG', compress_level=IMAGE_PNG_COMPRESS_LEVEL)
+    return bio.getvalue()
+
+
+def encode_webp(pixels, pixel_format=PIXEL_RGB):
+    """
+    编码为 WebP 无损
+
+    Args:
+        pixels: 像素数组
+        pixel_format: 通道顺序
+
+    Returns:
+        bytes: WebP 数据
+    """
+    bio = io.BytesIO()
+    pil_image(pixels, pixel_format).save(bio, format='WEBP', lossless=True, method=IMAGE_WEBP_METHOD)
+    return bio.getvalue()
+
+
+def available_codecs():
+    """
+    Returns:
+        list: 本机支持的编码格式 (WebP 需要 Pillow 编译时带有 libwebp)
+    """
+    codecs = [CODEC_JPEG, CODEC_PNG, CODEC_AUTO]
+    try:
+        from PIL import features
+        if features.check('webp'):
+            codecs.insert(2, CODEC_WEBP)
+    except Exception:
+        pass
+    return codecs
+
+
+def negotiate_codec(codec):
+    """
+    观看者请求的编码格式换为本机支持的格式 (WebP 不可用时改用无损的调色板 PNG, 未知格式用 JPEG)
+
+    Args:
+        codec: 请求的编码格式
+
+    Returns:
+        str: 实际使用的编码格式
+    """
+    supported = available_codecs()
+    if codec in supported:
+        return codec
+    return CODEC_PNG if codec == CODEC_WEBP else CODEC_JPEG
+
+
+def encode_image(pixels, codec=CODEC_JPEG, quality=85, pixel_format=PIXEL_RGB):
+    """
+    按编码格式编码像素数组
+
+    Args:
+        pixels: 像素数组
+        codec: 编码格式 (CODEC_JPEG / CODEC_PNG / CODEC_WEBP / CODEC_AUTO)
+        quality: JPEG质量 (无损格式忽略)
+        pixel_format: 通道顺序
+
+    Returns:
+        bytes: 图像数据 (接收端按数据本身识别格式)
+    """
+    if codec == CODEC_AUTO:
+        codec = CODEC_PNG if count_colors(pixels) <= IMAGE_PALETTE_MAX_COLORS else CODEC_JPEG
+    if codec == CODEC_PNG:
+        return encode_png(pixels, pixel_format)
+    if codec == CODEC_WEBP:
+        return encode_webp(pixels, pixel_format)
+    return encode_jpeg(pixels, quality, pixel_format)
+
+
+def encode_workers():
+    """
+    Returns:
+        int: 并行编码的线程 (进程) 数
+    """
+    if IMAGE_ENCODE_WORKERS > 0:
+        return IMAGE_ENCODE_WORKERS
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def get_encode_pool():
+    """
+    Returns:
+        并行编码池; 只有一个工作线程时返回 None (直接在调用线程中编码)
+    """
+    global _pool
+    workers = encode_workers()
+    if workers <= 1:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if IMAGE_ENCODE_POOL == 'process':
+                    _pool = ProcessPoolExecutor(max_workers=workers)
+                else:
+                    _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jpeg')
+    return _pool
+
+
+def encode_image_many(regions, codecs=CODEC_JPEG, quality=85, pixel_format=PIXEL_RGB):
+    """
+    把多块像素分别编码, 总量够大时并行
+
+    Args:
+        regions: 像素数组的列表 (可以是同一帧的不同切片)
+        codecs: 编码格式, 或与 regions 等长的列表 (每块各自的格式)
+        quality: JPEG质量
+        pixel_format: 通道顺序
+
+    Returns:
+        list: 与 regions 顺序相同的图像数据
+    """
+    if isinstance(codecs, str):
+        codecs = itertools.repeat(codecs)
+    pool = get_encode_pool()
+    pixels = sum(region.shape[0] * region.shape[1] for region in regions)
+    if pool is None or len(regions) < 2 or pixels < IMAGE_PARALLEL_MIN_PIXELS:
+        return [encode_image(region, codec, quality, pixel_format) for region, codec in zip(regions, codecs)]
+    return list(pool.map(encode_image, regions, codecs, itertools.repeat(quality), itertools.repeat(pixel_format)))
+
+
+def bgra_view(sct_img):
+    """
+    mss 截图的原始 BGRA 数据 (不复制)
+
+    Args:
+        sct_img: mss 的 ScreenShot 对象
+
+    Returns:
+        ndarray: (h, w, 4) uint8 数组
+    """
+    width, height = sct_img.size
+    return np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(height, width, 4)
+
+
+def get_encoder_info():
+    """
+    Returns:
+        dict: 选定的后端及各后端的基准测试耗时(毫秒)
+    """
+    return {
+        'backend': _encoder.name if _encoder is not None else None,
+        'benchmark_ms': dict(_benchmark),
+        'workers': encode_workers(),
+        'pool': IMAGE_ENCODE_POOL,
+        'codecs': available_codecs()
+    }
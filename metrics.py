@@ -0,0 +1,189 @@
+"""
+性能统计模块 - 远程控制系统
+按处理函数统计调用次数、错误次数、耗时分位数 (p50/p95/p99) 以及收发字节数
+"""
+
+import collections
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+
+from config import METRICS_SAMPLE_SIZE
+
+# 当前正在统计的调用 (由 MetricsRegistry.track 设置), 发送函数据此累计响应字节数
+_current_call = contextvars.ContextVar('current_call', default=None)
+
+
+def count_bytes_out(nbytes):
+    """
+    把发送的字节数计入当前正在处理的请求 (没有正在处理的请求时忽略)
+
+    Args:
+        nbytes: 发送的字节数
+    """
+    call = _current_call.get()
+    if call is not None:
+        call[0] += nbytes
+
+
+def percentile(sorted_values, pct):
+    """
+    计算分位数 (最近秩法)
+
+    Args:
+        sorted_values: 已排序的数值列表
+        pct: 百分位 (0-100)
+
+    Returns:
+        float: 分位数; 列表为空返回 0.0
+    """
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class HandlerMetrics:
+    """单个处理函数的统计数据"""
+
+    def __init__(self, sample_size=METRICS_SAMPLE_SIZE):
+        """
+        Args:
+            sample_size: 保留最近多少次调用的耗时用于计算分位数
+        """
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.samples = collections.deque(maxlen=sample_size)
+
+    def record(self, elapsed, bytes_in, bytes_out, error=False):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.samples.append(elapsed)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 统计摘要 (耗时单位为毫秒)
+        """
+        samples = sorted(self.samples)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': self.total_time / self.calls * 1000 if self.calls else 0.0,
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'max_ms': self.max_time * 1000,
+            'total_s': self.total_time,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out
+        }
+
+
+class MetricsRegistry:
+    """按处理函数名汇总的统计表 (线程安全, 可被多个会话共享)"""
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, name, elapsed, bytes_in=0, bytes_out=0, error=False):
+        """
+        记录一次调用
+
+        Args:
+            name: 处理函数名
+            elapsed: 耗时(秒)
+            bytes_in: 请求字节数
+            bytes_out: 响应字节数
+            error: 是否出错
+        """
+        with self._lock:
+            metrics = self._handlers.get(name)
+            if metrics is None:
+                metrics = HandlerMetrics()
+                self._handlers[name] = metrics
+            metrics.record(elapsed, bytes_in, bytes_out, error)
+
+    def track(self, name, func, /, *args, bytes_in=0, **kwargs):
+        """
+        调用 func 并记录其耗时与期间发送的字节数
+
+        Args:
+            name: 处理函数名
+            func: 要调用的函数
+            bytes_in: 请求字节数
+
+        Returns:
+            func 的返回值
+        """
+        call = [0]
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_call.reset(token)
+            self.record(name, elapsed, bytes_in, call[0], error)
+
+    def snapshot(self):
+        """
+        获取全部统计 (按总耗时从高到低排列)
+
+        Returns:
+            dict: {'uptime': 秒, 'handlers': {处理函数名: 统计摘要}}
+        """
+        with self._lock:
+            handlers = {name: m.snapshot() for name, m in self._handlers.items()}
+        ordered = dict(sorted(handlers.items(), key=lambda item: item[1]['total_s'], reverse=True))
+        return {
+            'uptime': time.time() - self.started_at,
+            'handlers': ordered
+        }
+
+    def dump(self, filepath, extra=None):
+        """
+        把统计写入 JSON 文件
+
+        Args:
+            filepath: 输出文件路径
+            extra: 附加写入的字段 (如会话统计)
+
+        Returns:
+            tuple: (success, filepath 或 错误信息)
+        """
+        data = self.snapshot()
+        data['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        if extra:
+            data.update(extra)
+        try:
+            os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            return True, filepath
+        except Exception as e:
+            return False, f"写入统计文件失败: {e}"
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._handlers.clear()
+            self.started_at = time.time()
@@ -0,0 +1,445 @@
+"""
+多路复用连接 - 远程控制系统
+在一条 TCP 连接上划分多个逻辑通道 (控制/屏幕/摄像头/Shell/文件/键盘/音频/鼠标),
+各通道的消息与数据块交错传输, 接收端按通道分发到各自的队列;
+带 'reply_to' 的响应按请求ID交给对应的 Future, 多个请求可以同时在途
+"""
+
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeout
+import queue
+import socket
+import struct
+import threading
+import time
+
+from protocol import *
+from metrics import count_bytes_out
+
+# 消息附加的大块数据 (文件/截图/录音) 按此大小切分为 DATA 帧,
+# 每块单独占用写锁, 其他通道的消息可以插在块与块之间发送
+MUX_CHUNK_SIZE = 64 * 1024
+
+# 普通消息长度上限 (与 receive_message 一致)
+MAX_MESSAGE_SIZE = 10 * 1024 * 1024
+
+
+class MuxConnection:
+    """
+    多路复用连接
+
+    发送: 每个数据包 (一条 JSON 消息 / 一个帧 / 一个数据块) 在写锁内整体写出,
+          不会被其他线程打断; 同一通道的消息另持有通道锁, 保证
+          "消息头 + 全部数据块" 在该通道内连续、有序。
+    接收: read_message() 读出下一条完整消息 (附加数据已重组到 message['payload']);
+          也可调用 start_reader() 启动后台线程按通道分发, 再由 receive(channel) 取出。
+    请求: request() 发出请求并返回 Future, 后台线程收到 'reply_to' 与之相同的
+          响应时完成它; call() 是 "发送并等待响应" 的简写。
+    心跳: 设置 heartbeat 后, 后台线程收到的心跳/心跳应答交给它处理, 不进入通道队列。
+    """
+
+    def __init__(self, sock):
+        """
+        Args:
+            sock: 已连接的 socket 对象
+        """
+        self.sock = sock
+        self.closed = False
+
+        self._write_lock = threading.Lock()
+        self._channel_locks = {}
+        self._queues = {}
+        self._guard = threading.Lock()  # 保护 _channel_locks / _queues 的创建
+
+        # 正在重组的附加数据: channel -> [message, buffer, received]
+        self._partials = {}
+        self._reader = None
+        self.heartbeat = None  # Heartbeat 对象 (由使用方设置)
+        self.last_received = time.monotonic()  # 上次收到数据的时间, 用于判定对端失联
+
+        # 吞吐统计 (字节数含包头)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+
+        # 等待响应的请求: 消息ID -> Future
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    # ==================== 发送 ====================
+
+    def _channel_lock(self, channel):
+        with self._guard:
+            lock = self._channel_locks.get(channel)
+            if lock is None:
+                lock = threading.Lock()
+                self._channel_locks[channel] = lock
+            return lock
+
+    def send(self, message, payload=None):
+        """
+        发送消息 (可附带二进制数据)
+
+        Args:
+            message: 消息字典 (通道取自 'channel' 字段或消息类型)
+            payload: 附加的二进制数据, 切分为 DATA 帧随消息发送
+
+        Returns:
+            bool: 是否发送成功
+        """
+        channel = get_message_channel(message)
+
+        try:
+            if payload is None:
+                encoded = encode_message(message)
+                with self._channel_lock(channel):
+                    with self._write_lock:
+                        self.sock.sendall(encoded)
+                        self.bytes_sent += len(encoded)
+                        self.messages_sent += 1
+                count_bytes_out(len(encoded))
+                return True
+
+            view = memoryview(payload).cast('B')
+            message['payload_size'] = len(view)
+            encoded = encode_message(message)
+
+            with self._channel_lock(channel):
+                with self._write_lock:
+                    self.sock.sendall(encoded)
+                    self.bytes_sent += len(encoded)
+                    self.messages_sent += 1
+                sent = len(encoded)
+
+                for index, offset in enumerate(range(0, len(view), MUX_CHUNK_SIZE)):
+                    chunk = view[offset:offset + MUX_CHUNK_SIZE]
+                    header = FRAME_HEADER.pack(FRAME_MAGIC, FrameOpcode.DATA, channel,
+                                               index, 0.0, len(chunk))
+                    with self._write_lock:
+                        send_buffers(self.sock, [header, chunk])
+                        self.bytes_sent += len(header) + len(chunk)
+                    sent += len(header) + len(chunk)
+            count_bytes_out(sent)
+            return True
+
+        except Exception as e:
+            print(f"发送消息失败: {e}")
+            return False
+
+    def send_frame(self, opcode, channel, seq, payload, timestamp=None, trace=None):
+        """
+        发送二进制帧 (帧头 + 数据作为一个数据包写出)
+
+        Args:
+            opcode: 帧操作码 (FrameOpcode)
+            channel: 通道ID
+            seq: 帧序号
+            payload: 帧数据
+            timestamp: 采集时间, 默认为当前时间
+            trace: None, 或 (截屏耗时, 编码耗时), 附加时延追踪字段 (见 protocol.frame_buffers)
+
+        Returns:
+            bool: 是否发送成功
+        """
+        with self._write_lock:
+            if not send_frame(self.sock, opcode, channel, seq, payload, timestamp, trace):
+                return False
+            self.bytes_sent += FRAME_HEADER_SIZE + len(payload) + (FRAME_TRACE.size if trace is not None else 0)
+            self.messages_sent += 1
+            return True
+
+    # ==================== 请求/响应 ====================
+
+    def request(self, message, payload=None):
+        """
+        发送请求, 不等待响应 (需先调用 start_reader)
+
+        Args:
+            message: 请求消息 (由 create_message 创建, 带 'id')
+            payload: 附加的二进制数据
+
+        Returns:
+            Future: 以响应消息完成; 发送失败或连接断开时以 ConnectionError 完成
+        """
+        future = Future()
+        request_id = message.get('id')
+
+        # 先登记再发送, 避免响应先于登记到达
+        with self._pending_lock:
+            if self.closed:
+                future.set_exception(ConnectionError("连接已断开"))
+                return future
+            self._pending[request_id] = future
+
+        if not self.send(message, payload):
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError("发送请求失败"))
+        return future
+
+    @staticmethod
+    def wait(future, timeout=None):
+        """
+        等待请求的响应
+
+        Args:
+            future: request() 返回的 Future
+            timeout: 超时时间(秒), None 表示一直等待
+
+        Returns:
+            dict: 响应消息; 超时、失败或连接断开返回 None (超时的请求被取消, 迟到的响应直接丢弃)
+        """
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            return None
+        except (CancelledError, ConnectionError):
+            return None
+
+    def call(self, message, timeout=None, payload=None):
+        """
+        发送请求并等待其响应
+
+        Args:
+            message: 请求消息
+            timeout: 超时时间(秒), None 表示一直等待
+            payload: 附加的二进制数据
+
+        Returns:
+            dict: 响应消息; 超时、失败或连接断开返回 None
+        """
+        return self.wait(self.request(message, payload), timeout)
+
+    def _resolve(self, message):
+        """把响应交给等待它的 Future; 不是在途请求的响应则返回 False"""
+        request_id = message.get('reply_to')
+        if request_id is None:
+            return False
+
+        with self._pending_lock:
+            future = self._pending.pop(request_id, None)
+        if future is None:
+            return False
+
+        if future.set_running_or_notify_cancel():
+            future.set_result(message)
+        return True
+
+    def _fail_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError("连接已断开"))
+
+    # ==================== 接收 ====================
+
+    def read_message(self):
+        """
+        读取下一条完整消息 (只能由一个线程调用)
+
+        Returns:
+            dict: 消息字典 (带附加数据时含 'payload'); 连接断开返回 None
+        """
+        try:
+            while True:
+                prefix = recv_exact(self.sock, 4)
+                if not prefix:
+                    return None
+                prefix = bytes(prefix)  # 后续接收会复用同一缓冲区
+                self.last_received = time.monotonic()
+
+                if prefix[0] == FRAME_MAGIC:
+                    message = self._read_frame(prefix)
+                else:
+                    message = self._read_json(prefix)
+
+                if message is not None:
+                    self.messages_received += 1
+                    return message
+
+        except Exception as e:
+            if not self.closed:
+                print(f"接收消息失败: {e}")
+            return None
+
+    def _recv_payload(self, length):
+        """接收数据到一块新分配的缓冲区 (交给其他线程使用, 不能复用)"""
+        buffer = bytearray(length)
+        if length and not recv_into_exact(self.sock, memoryview(buffer)):
+            raise ConnectionError("连接已断开")
+        return buffer
+
+    def _read_json(self, prefix):
+        """读取普通消息; 带附加数据的消息要等数据块收齐后才返回"""
+        length = struct.unpack('>I', prefix)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise ConnectionError(f"异常的消息长度: {length} 字节")
+
+        body = recv_exact(self.sock, length)
+        if body is None:
+            raise ConnectionError("连接已断开")
+        self.bytes_received += 4 + length
+        message = decode_message(body)
+        message['wire_size'] = 4 + length  # 线路上的字节数 (含附加数据块), 供统计使用
+
+        size = message.pop('payload_size', None)
+        if size is None:
+            return message
+        if size == 0:
+            message['payload'] = bytearray()
+            return message
+
+        self._partials[get_message_channel(message)] = [message, bytearray(size), 0]
+        return None
+
+    def _read_frame(self, prefix):
+        """读取二进制帧; DATA 块直接写入对应消息的重组缓冲区"""
+        rest = recv_exact(self.sock, FRAME_HEADER_SIZE - len(prefix))
+        if not rest:
+            raise ConnectionError("连接已断开")
+        _, opcode, stream_id, seq, timestamp, length = FRAME_HEADER.unpack(prefix + bytes(rest))
+        self.bytes_received += FRAME_HEADER_SIZE + length
+
+        if opcode == FrameOpcode.DATA:
+            partial = self._partials.get(stream_id)
+            if partial is None or partial[2] + length > len(partial[1]):
+                print(f"[警告] 通道 {stream_id} 收到无主的数据块, 已丢弃 {length} 字节")
+                self._recv_payload(length)
+                return None
+
+            message, buffer, received = partial
+            if not recv_into_exact(self.sock, memoryview(buffer)[received:received + length]):
+                raise ConnectionError("连接已断开")
+
+            partial[2] = received + length
+            message['wire_size'] += FRAME_HEADER_SIZE + length
+            if partial[2] < len(buffer):
+                return None
+
+            del self._partials[stream_id]
+            message['payload'] = buffer
+            return message
+
+        payload = self._recv_payload(length)
+        opcode, payload, trace = split_frame_trace(opcode, payload)
+        msg_type = FRAME_OPCODE_TYPES.get(opcode)
+        if msg_type is None:
+            print(f"[警告] 未知的帧操作码: {opcode}, 已丢弃 {length} 字节")
+            return None
+
+        data = {
+            'stream_id': stream_id,
+            'seq': seq,
+            'timestamp': timestamp,
+            'size': length
+        }
+        if trace:
+            data.update(trace)
+        return {
+            'type': msg_type,
+            'channel': stream_id,
+            'data': data,
+            'payload': payload,
+            'wire_size': FRAME_HEADER_SIZE + length
+        }
+
+    # ==================== 按通道分发 ====================
+
+    def _queue(self, channel):
+        with self._guard:
+            q = self._queues.get(channel)
+            if q is None:
+                q = queue.Queue()
+                self._queues[channel] = q
+                if self.closed:
+                    q.put(None)
+            return q
+
+    def start_reader(self):
+        """启动后台接收线程, 按通道把消息分发到各自队列"""
+        # 后台线程一直阻塞读取, 超时由 receive() 控制
+        self.sock.settimeout(None)
+        self._reader = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader.start()
+
+    def _reader_loop(self):
+        while not self.closed:
+            message = self.read_message()
+            if message is None:
+                break
+            if self._resolve(message):
+                continue
+            if self.heartbeat is not None and self.heartbeat.handle_message(message):
+                continue
+            self._queue(get_message_channel(message)).put(message)
+
+        # 连接断开: 唤醒所有等待中的接收者
+        with self._pending_lock:
+            self.closed = True
+        self._fail_pending()
+        with self._guard:
+            for q in self._queues.values():
+                q.put(None)
+
+    def receive(self, channel, timeout=None):
+        """
+        从指定通道接收下一条消息 (需先调用 start_reader)
+
+        Args:
+            channel: 通道ID
+            timeout: 超时时间(秒), None 表示一直等待
+
+        Returns:
+            dict: 消息字典; 超时或连接断开返回 None
+        """
+        q = self._queue(channel)
+        try:
+            message = q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if message is None:
+            q.put(None)  # 断开标记留给后续的接收者
+        return message
+
+    def clear(self, channel):
+        """
+        丢弃指定通道中尚未取出的消息 (如停止视频流后残留的帧)
+
+        Args:
+            channel: 通道ID
+
+        Returns:
+            int: 丢弃的消息数
+        """
+        q = self._queue(channel)
+        count = 0
+        while True:
+            try:
+                message = q.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                q.put(None)
+                break
+            count += 1
+        return count
+
+    def close(self):
+        """关闭连接 (后台接收线程随之退出)"""
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    def abort(self):
+        """立即断开连接 (对端失联时使用; shutdown 会让阻塞中的收发立即返回, 与 close 相同)"""
+        self.close()
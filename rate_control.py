@@ -0,0 +1,213 @@
+"""
+自适应码率控制 - 远程控制系统
+推流过程中根据发送阻塞时间、帧队列丢帧和往返时延判断链路是否拥塞,
+在运维设定的范围内动态调整 JPEG 质量、帧率和分辨率:
+拥塞时依次降低质量、帧率、分辨率 (每次一级); 持续畅通时按相反顺序逐级恢复,
+链路有余量 (如局域网) 时质量可升到上限
+"""
+
+import threading
+import time
+
+from config import (RATE_CONTROL_INTERVAL, RATE_MIN_QUALITY, RATE_MAX_QUALITY, RATE_MIN_FPS, RATE_MAX_FPS,
+                    RATE_MIN_SCALE, RATE_QUALITY_STEP, RATE_SCALE_STEP, RATE_SEND_BUSY_HIGH, RATE_SEND_BUSY_LOW,
+                    RATE_RTT_SLACK, RATE_INCREASE_AFTER)
+
+
+class RateController:
+    """
+    一路推流的码率控制器 (闭环)
+
+    推流循环每发出一帧调用 on_frame_sent(); 每隔 interval 秒评估一次,
+    参数有变化时调用 stream.set_rate(quality, fps, scale) 生效。
+    stream 还需提供 frames_dropped 属性 (帧队列满而丢弃/合并的帧数)。
+    """
+
+    def __init__(self, stream, quality, fps, min_quality=RATE_MIN_QUALITY, max_quality=RATE_MAX_QUALITY,
+                 min_fps=RATE_MIN_FPS, max_fps=RATE_MAX_FPS, min_scale=RATE_MIN_SCALE,
+                 interval=RATE_CONTROL_INTERVAL):
+        """
+        Args:
+            stream: 屏幕流 / 视频流
+            quality: 初始 JPEG 质量
+            fps: 初始帧率
+            min_quality, max_quality: JPEG 质量范围
+            min_fps, max_fps: 帧率范围
+            min_scale: 最小分辨率缩放比例 (最大为 1.0, 即原始分辨率)
+            interval: 评估间隔(秒)
+        """
+        self.stream = stream
+        self.min_quality = min_quality
+        self.max_quality = max(max_quality, min_quality)
+        self.min_fps = min_fps
+        self.max_fps = max(max_fps, min_fps)
+        self.min_scale = min_scale
+        self.interval = interval
+
+        self.quality = min(max(int(quality), self.min_quality), self.max_quality)
+        self.fps = min(max(int(fps), self.min_fps), self.max_fps)
+        self.scale = 1.0
+
+        self.decreases = 0
+        self.increases = 0
+        self.last_reason = None
+        self._clear_intervals = 0
+        self._epoch = 0  # 观看者修改参数 (reset) 的次数, 用于发现过期的调整
+        self._lock = threading.Lock()
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._send_time = 0.0
+        self._bytes = 0
+        self._frames = 0
+        self._dropped = self.stream.frames_dropped
+
+    # ==================== 测量 ====================
+
+    def on_frame_sent(self, size, send_time, rtt=None, min_rtt=None):
+        """
+        推流循环发出一帧后调用
+
+        Args:
+            size: 帧数据字节数
+            send_time: 本次发送耗时(秒), 发送缓冲区满时会阻塞, 反映链路是否跟得上
+            rtt: 当前平滑往返时延(秒), 未知时为 None
+            min_rtt: 最小往返时延(秒), 作为链路空闲时的基准
+        """
+        with self._lock:
+            self._send_time += send_time
+            self._bytes += size
+            self._frames += 1
+
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.interval:
+                return
+            busy = self._send_time / elapsed
+            dropped = self.stream.frames_dropped - self._dropped
+            throughput = self._bytes / elapsed
+            self._reset_window(now)
+            settings = self._evaluate(busy, dropped, rtt, min_rtt, throughput)
+
+        if settings:
+            self._apply(settings)
+
+    def reset(self, quality, fps):
+        """
+        观看者修改了质量/帧率: 以新值 (限制在设定范围内) 为起点继续调整
+
+        Args:
+            quality: JPEG 质量
+            fps: 帧率
+
+        Returns:
+            tuple: 实际使用的 (quality, fps)
+        """
+        with self._lock:
+            self.quality = min(max(int(quality), self.min_quality), self.max_quality)
+            self.fps = min(max(int(fps), self.min_fps), self.max_fps)
+            self._clear_intervals = 0
+            self._epoch += 1
+            self._reset_window(time.monotonic())
+            return self.quality, self.fps
+
+    # ==================== 调整 ====================
+
+    def _evaluate(self, busy, dropped, rtt, min_rtt, throughput):
+        """
+        根据一个评估周期的测量值决定降级、升级或保持 (调用方持有 _lock)
+
+        Returns:
+            tuple: 需要生效的参数 (见 _settings); 保持不变时返回 None
+        """
+        reason = None
+        if busy > RATE_SEND_BUSY_HIGH:
+            reason = f"发送阻塞 {busy * 100:.0f}%"
+        elif dropped > 0:
+            reason = f"队列丢帧 {dropped}"
+        elif rtt is not None and min_rtt is not None and rtt > min_rtt * 2 + RATE_RTT_SLACK:
+            reason = f"往返时延 {rtt * 1000:.0f}ms"
+
+        if reason:
+            self._clear_intervals = 0
+            if self._decrease():
+                self.decreases += 1
+                self.last_reason = reason
+                return self._settings()
+            return None
+
+        if busy < RATE_SEND_BUSY_LOW:
+            self._clear_intervals += 1
+            if self._clear_intervals >= RATE_INCREASE_AFTER:
+                self._clear_intervals = 0
+                if self._increase():
+                    self.increases += 1
+                    self.last_reason = f"链路畅通 ({throughput / 1024:.0f} KB/s)"
+                    return self._settings()
+        return None
+
+    def _decrease(self):
+        """降一级: 先降质量, 再降帧率, 最后降分辨率"""
+        if self.quality > self.min_quality:
+            self.quality = max(self.quality - RATE_QUALITY_STEP, self.min_quality)
+        elif self.fps > self.min_fps:
+            self.fps = max(int(self.fps * 0.7), self.min_fps)
+        elif self.scale > self.min_scale:
+            self.scale = max(round(self.scale - RATE_SCALE_STEP, 2), self.min_scale)
+        else:
+            return False
+        return True
+
+    def _increase(self):
+        """升一级: 按降级的相反顺序恢复, 先恢复分辨率, 再恢复帧率, 最后提高质量"""
+        if self.scale < 1.0:
+            self.scale = min(round(self.scale + RATE_SCALE_STEP, 2), 1.0)
+        elif self.fps < self.max_fps:
+            self.fps = min(self.fps + max(1, self.fps // 4), self.max_fps)
+        elif self.quality < self.max_quality:
+            self.quality = min(self.quality + RATE_QUALITY_STEP // 2, self.max_quality)
+        else:
+            return False
+        return True
+
+    def _settings(self):
+        """当前参数 (epoch, quality, fps, scale) (调用方持有 _lock)"""
+        return self._epoch, self.quality, self.fps, self.scale
+
+    def _apply(self, settings):
+        """
+        调用 stream.set_rate 使参数生效
+
+        在 _lock 之外调用: 屏幕流修改参数时持有自己的锁调用 reset(), set_rate 也要取该锁。
+        生效期间观看者修改了参数 (reset) 时改用修改后的参数重新生效, 旧的调整不会覆盖它。
+
+        Args:
+            settings: _settings() 的返回值
+        """
+        while True:
+            epoch, quality, fps, scale = settings
+            try:
+                self.stream.set_rate(quality, fps, scale)
+            except Exception as e:
+                print(f"调整推流参数失败: {e}")
+                return
+            with self._lock:
+                if self._epoch == epoch:
+                    return
+                settings = self._settings()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: 当前参数与调整次数
+        """
+        with self._lock:
+            return {
+                'quality': self.quality,
+                'fps': self.fps,
+                'scale': self.scale,
+                'decreases': self.decreases,
+                'increases': self.increases,
+                'last_reason': self.last_reason
+            }
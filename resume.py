@@ -0,0 +1,179 @@
+"""
+会话恢复 - 远程控制系统
+身份验证成功后服务器为会话签发恢复令牌; 连接意外中断时会话连同其
+Shell工作目录、屏幕/视频流一起保留 RESUME_GRACE_PERIOD 秒,
+客户端在此期间凭令牌重连即可接管原会话, 不必重新启动各项功能
+(客户端的重连见 reconnect, 命令行与图形客户端共用)
+"""
+
+import secrets
+import socket
+import threading
+import time
+
+from config import RESUME_GRACE_PERIOD, CONNECTION_TIMEOUT
+from protocol import MessageType, create_auth_message
+from multiplex import MuxConnection
+
+# 恢复令牌的随机字节数
+RESUME_TOKEN_BYTES = 24
+
+
+class ResumeRegistry:
+    """
+    可恢复会话登记表 (线程安全)
+
+    令牌 -> 会话: 已验证的会话 (无论连接是否还在) 都登记在此;
+    连接中断后 park() 开始计时, 期间 claim() 可接管, 超时则调用会话的 expire() 释放资源。
+    令牌只能使用一次, 每次接管都会换发新令牌。
+    """
+
+    def __init__(self, grace=RESUME_GRACE_PERIOD):
+        """
+        Args:
+            grace: 会话保留时间(秒)
+        """
+        self.grace = grace
+        # 会话的接管与保留判断都在这把锁内完成, 避免新连接接管时旧连接把会话保留/释放
+        self.lock = threading.RLock()
+        self._sessions = {}  # 令牌 -> 会话
+        self._timers = {}  # 令牌 -> 保留计时器 (只有连接已中断的会话才有)
+
+    def issue(self, session):
+        """
+        为会话签发新的恢复令牌 (旧令牌作废)
+
+        Args:
+            session: 会话对象
+
+        Returns:
+            str: 恢复令牌
+        """
+        with self.lock:
+            self.revoke(session)
+            token = secrets.token_urlsafe(RESUME_TOKEN_BYTES)
+            self._sessions[token] = session
+            session.resume_token = token
+            return token
+
+    def revoke(self, session):
+        """
+        作废会话的恢复令牌 (会话不再可恢复)
+
+        Args:
+            session: 会话对象
+        """
+        with self.lock:
+            token = getattr(session, 'resume_token', None)
+            if token is None:
+                return
+            if self._sessions.get(token) is session:
+                del self._sessions[token]
+            timer = self._timers.pop(token, None)
+            if timer:
+                timer.cancel()
+            session.resume_token = None
+
+    def park(self, session):
+        """
+        保留连接已中断的会话, 超过保留时间仍未被接管则释放
+
+        Args:
+            session: 会话对象
+
+        Returns:
+            bool: 是否已保留 (会话没有有效令牌时返回 False)
+        """
+        with self.lock:
+            token = getattr(session, 'resume_token', None)
+            if token is None or self._sessions.get(token) is not session:
+                return False
+            timer = threading.Timer(self.grace, self._expire, args=(token,))
+            timer.daemon = True
+            self._timers[token] = timer
+            timer.start()
+            return True
+
+    def claim(self, token, conn):
+        """
+        用令牌接管会话: 会话改用新连接 (旧连接如仍在则断开) 并换发令牌
+
+        Args:
+            token: 客户端出示的恢复令牌
+            conn: 新连接
+
+        Returns:
+            会话对象; 令牌无效或已过期返回 None
+        """
+        with self.lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            session.attach(conn)
+            self.issue(session)
+            return session
+
+    def _expire(self, token):
+        with self.lock:
+            if token not in self._timers:
+                return  # 已被接管
+            session = self._sessions.get(token)
+            self.revoke(session)
+        session.expire()
+
+    def parked_count(self):
+        """
+        Returns:
+            int: 正在等待恢复的会话数
+        """
+        with self.lock:
+            return len(self._timers)
+
+    def close(self):
+        """释放全部等待恢复的会话 (服务器关闭时调用)"""
+        with self.lock:
+            sessions = [self._sessions[token] for token in self._timers]
+            for session in sessions:
+                self.revoke(session)
+        for session in sessions:
+            session.expire()
+
+
+def reconnect(host, port, password_hash, resume_token, grace=RESUME_GRACE_PERIOD):
+    """
+    客户端: 连接中断后重新连接并出示恢复令牌
+
+    服务器保留会话期间凭令牌接管原会话 (屏幕流/视频流等保持原样);
+    会话已过期时用同一密码建立新会话。连不上服务器时每秒重试, 直到超过保留时间。
+
+    Args:
+        host: 服务器地址
+        port: 服务器端口
+        password_hash: 登录时使用的密码哈希
+        resume_token: 服务器签发的恢复令牌 (可为 None, 此时只能建立新会话)
+        grace: 最长重试时间(秒)
+
+    Returns:
+        tuple: (success, (sock, conn, response)) 或 (success, error_message);
+               conn 已启动接收线程, response['data']['resumed'] 表示是否恢复了原会话
+    """
+    deadline = time.time() + grace
+    while True:
+        try:
+            sock = socket.create_connection((host, port), CONNECTION_TIMEOUT)
+            conn = MuxConnection(sock)
+            conn.start_reader()
+
+            response = conn.call(create_auth_message(password_hash, resume_token), CONNECTION_TIMEOUT)
+            if response is None or response['type'] != MessageType.AUTH_RESPONSE:
+                conn.close()
+                raise Exception("服务器无响应")
+            if not response['data']['success']:
+                conn.close()
+                return False, f"恢复会话失败: {response['data'].get('message', '')}"
+            return True, (sock, conn, response)
+
+        except Exception as e:
+            if time.time() >= deadline:
+                return False, f"无法重新连接到服务器: {e}"
+            time.sleep(1)
@@ -0,0 +1,707 @@
+"""
+屏幕分块差量编码 - 远程控制系统
+把屏幕划分为固定大小的块, 与上一帧比较找出变化的块, 只编码、发送变化的部分;
+定期发送完整的关键帧。画面区域整体平移 (滚动) 时发送 "复制矩形" 指令,
+接收端在本地复制, 只需再发送新露出的部分。接收端用 ScreenCompositor 把块拼回完整画面。
+双方可协商一个块缓存 (TileCache, LRU): 观看者已缓存的块只发送其内容哈希。
+
+SCREEN_TILES 帧数据格式 (大端):
+    头部: 宽 H, 高 H, 记录数 H, 标志 B
+    每条记录: 类型 B, x H, y H, 宽 H, 高 H, 之后
+        RECT_JPEG: 长度 I, 图像数据 (JPEG / PNG / WebP, 由协商的编码决定, 接收端按数据识别)
+        RECT_COPY: 源 x H, 源 y H (把画面上的源矩形复制到 (x, y))
+        RECT_CACHED: 内容哈希 8s (块缓存中的 JPEG 块)
+记录按顺序应用; 关键帧 (标志含 TILES_KEYFRAME) 的记录合起来覆盖整个画面
+(大画面分成若干水平条带, 各自独立编码, 可以并行)。
+编码为 'auto' 时逐块判断: 颜色少的块 (文字、纯色界面) 用无损调色板 PNG,
+其余用 JPEG, 同一行中相邻的同类块合并为一个矩形。
+标志含 TILES_CACHE_RESET 时接收端先清空块缓存。
+
+块缓存: 双方各有一个容量相同的 LRU 缓存, 以 JPEG 数据的哈希为键, 按记录顺序
+    收到 / 发出 RECT_JPEG 时放入, RECT_CACHED 时取出 (都移到最近使用),
+    操作序列相同, 淘汰结果也相同, 发送端据此知道接收端缓存了哪些块。
+    接收端缓存中找不到 RECT_CACHED 的块 (双方缓存不一致) 时, ScreenCompositor 停止绘制,
+    观看者发送 SCREEN_KEYFRAME, 服务器重置块缓存并发送关键帧, 期间观看者保留最近的画面。
+
+光标不画进画面, 而是单独以 SCREEN_CURSOR 帧按输入频率发送 (光标移动不引起重新编码),
+由观看者画在最近的画面上。帧数据格式 (大端): x h, y h (画面坐标), 形状 B, 标志 B
+"""
+
+import collections
+import hashlib
+import struct
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import (SCREEN_TILE_SIZE, SCREEN_KEYFRAME_INTERVAL, SCREEN_SCROLL_DETECT, SCREEN_SCROLL_MIN_LINES,
+                    IMAGE_PALETTE_MAX_COLORS, SCREEN_RESYNC_INTERVAL)
+from protocol import MessageType, decode_image
+from image_encoder import (encode_image_many, encode_workers, count_colors, PIXEL_RGB,
+                           CODEC_JPEG, CODEC_PNG, CODEC_AUTO)
+
+TILES_HEADER = struct.Struct('>HHHB')
+RECT_HEADER = struct.Struct('>BHHHH')
+JPEG_RECT = struct.Struct('>I')
+COPY_RECT = struct.Struct('>HH')
+CURSOR_FORMAT = struct.Struct('>hhBB')
+
+# 块内容哈希的字节数
+TILE_DIGEST_SIZE = 8
+
+# 标志位
+TILES_KEYFRAME = 0x01
+TILES_CACHE_RESET = 0x02
+
+# 记录类型
+RECT_JPEG = 0
+RECT_COPY = 1
+RECT_CACHED = 2
+
+# 复制矩形: 作为块的数据部分, 表示从画面上的 (src_x, src_y) 复制
+CopyFrom = collections.namedtuple('CopyFrom', ['src_x', 'src_y'])
+
+# 缓存引用: 作为块的数据部分 (仅出现在解析结果中), 表示块缓存中的一块
+CachedTile = collections.namedtuple('CachedTile', ['digest'])
+
+# 滚动检测只在变化的块数达到此值时进行 (零星变化直接编码更划算)
+SCROLL_MIN_TILES = 4
+
+# 光标形状
+CURSOR_ARROW = 0
+CURSOR_IBEAM = 1
+CURSOR_HAND = 2
+CURSOR_WAIT = 3
+CURSOR_CROSS = 4
+CURSOR_SIZE = 5
+
+# 光标标志位
+CURSOR_VISIBLE = 0x01
+
+# 光标: 画面坐标 (x, y), 形状, 是否显示 (不在画面范围内或被隐藏时为 False)
+Cursor = collections.namedtuple('Cursor', ['x', 'y', 'shape', 'visible'])
+
+# 箭头光标的轮廓 (相对于热点, 像素)
+_ARROW_OUTLINE = [(0, 0), (0, 16), (4, 12), (7, 18), (9, 17), (6, 11), (11, 11)]
+
+
+def tile_digest(data):
+    """
+    Args:
+        data: JPEG 数据
+
+    Returns:
+        bytes: 块缓存使用的内容哈希
+    """
+    return hashlib.blake2b(data, digest_size=TILE_DIGEST_SIZE).digest()
+
+
+class TileCache:
+    """
+    块缓存 (LRU, 按条目数限制容量)
+
+    发送端只记录哈希 (值为 None), 接收端保存解码后的块。
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: 最多缓存的块数
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self._entries = collections.OrderedDict()
+
+    def __contains__(self, digest):
+        return digest in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, digest):
+        """
+        取出缓存的块并移到最近使用
+
+        Returns:
+            缓存的值; 不存在时抛出 KeyError
+        """
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return self._entries[digest]
+
+    def put(self, digest, value=None):
+        """放入 (或更新) 一块, 超出容量时淘汰最久未使用的块"""
+        self._entries[digest] = value
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class TileFrame:
+    """
+    一帧编码结果: 若干个 (x, y, w, h, data) 块, 按顺序应用到画面上;
+    data 为 JPEG 数据, 或 CopyFrom (从画面上的另一位置复制同样大小的矩形)
+
+    同一对象会交给多个观看者, 创建后不再修改; 打包结果只计算一次。
+    """
+
+    def __init__(self, width, height, tiles, keyframe=False):
+        """
+        Args:
+            width: 画面宽度
+            height: 画面高度
+            tiles: [(x, y, w, h, jpeg_bytes 或 CopyFrom), ...]
+            keyframe: 是否为关键帧 (各块合起来覆盖整个画面)
+        """
+        self.width = width
+        self.height = height
+        self.tiles = tiles
+        self.keyframe = keyframe
+        self._packed = None
+
+    def merge(self, later):
+        """
+        合并为一帧 (观看者跳过中间帧时使用, 保证跳帧后画面仍然完整)
+
+        Args:
+            later: 紧随其后的一帧
+
+        Returns:
+            TileFrame: 效果等同于依次贴上两帧的新帧
+        """
+        if later.keyframe or (later.width, later.height) != (self.width, self.height):
+            return later
+        if self.has_copies() or later.has_copies():
+            # 复制指令读取的是当时的画面, 不能去掉被覆盖的块, 只能按顺序拼接
+            return TileFrame(self.width, self.height, self.tiles + later.tiles, self.keyframe)
+        tiles = {tile[:4]: tile for tile in self.tiles}
+        for tile in later.tiles:
+            tiles.pop(tile[:4], None)  # 重新插入, 保持 "后贴的在后" 的顺序
+            tiles[tile[:4]] = tile
+        return TileFrame(self.width, self.height, list(tiles.values()), self.keyframe)
+
+    def has_copies(self):
+        return any(isinstance(tile[4], CopyFrom) for tile in self.tiles)
+
+    def pack(self, cache=None, reset_cache=False):
+        """
+        打包为 SCREEN_TILES 帧数据
+
+        Args:
+            cache: 该观看者的块缓存 (发送端记录); 为 None 时不使用缓存
+            reset_cache: 是否清空块缓存 (接收端收到后同样清空)
+
+        Returns:
+            bytes: SCREEN_TILES 帧数据
+        """
+        if cache is None:
+            # 不使用缓存时各观看者的数据相同, 只打包一次
+            if self._packed is None:
+                self._packed = self._pack(None, 0)
+            return self._packed
+
+        flags = 0
+        if reset_cache:
+            cache.clear()
+            flags |= TILES_CACHE_RESET
+        return self._pack(cache, flags)
+
+    def _pack(self, cache, flags):
+        if self.keyframe:
+            flags |= TILES_KEYFRAME
+        parts = [TILES_HEADER.pack(self.width, self.height, len(self.tiles), flags)]
+        for x, y, w, h, data in self.tiles:
+            if isinstance(data, CopyFrom):
+                parts.append(RECT_HEADER.pack(RECT_COPY, x, y, w, h))
+                parts.append(COPY_RECT.pack(data.src_x, data.src_y))
+                continue
+
+            if cache is not None:
+                digest = tile_digest(data)
+                if digest in cache:
+                    cache.get(digest)
+                    parts.append(RECT_HEADER.pack(RECT_CACHED, x, y, w, h))
+                    parts.append(digest)
+                    continue
+                cache.put(digest)
+            parts.append(RECT_HEADER.pack(RECT_JPEG, x, y, w, h))
+            parts.append(JPEG_RECT.pack(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    @property
+    def size(self):
+        return sum(len(tile[4]) for tile in self.tiles if not isinstance(tile[4], CopyFrom))
+
+
+def unpack_tiles(payload):
+    """
+    解析 SCREEN_TILES 帧数据
+
+    Args:
+        payload: 帧数据
+
+    Returns:
+        tuple: (TileFrame, 标志); JPEG 数据为 payload 上的 memoryview (不复制)
+    """
+    view = memoryview(payload)
+    width, height, count, flags = TILES_HEADER.unpack_from(view, 0)
+    offset = TILES_HEADER.size
+    tiles = []
+    for _ in range(count):
+        kind, x, y, w, h = RECT_HEADER.unpack_from(view, offset)
+        offset += RECT_HEADER.size
+        if kind == RECT_COPY:
+            tiles.append((x, y, w, h, CopyFrom(*COPY_RECT.unpack_from(view, offset))))
+            offset += COPY_RECT.size
+        elif kind == RECT_CACHED:
+            tiles.append((x, y, w, h, CachedTile(bytes(view[offset:offset + TILE_DIGEST_SIZE]))))
+            offset += TILE_DIGEST_SIZE
+        else:
+            length, = JPEG_RECT.unpack_from(view, offset)
+            offset += JPEG_RECT.size
+            tiles.append((x, y, w, h, view[offset:offset + length]))
+            offset += length
+    return TileFrame(width, height, tiles, bool(flags & TILES_KEYFRAME)), flags
+
+
+def pack_cursor(cursor):
+    """
+    Args:
+        cursor: Cursor
+
+    Returns:
+        bytes: SCREEN_CURSOR 帧数据
+    """
+    x = min(max(int(cursor.x), -32768), 32767)
+    y = min(max(int(cursor.y), -32768), 32767)
+    return CURSOR_FORMAT.pack(x, y, cursor.shape, CURSOR_VISIBLE if cursor.visible else 0)
+
+
+def unpack_cursor(payload):
+    """
+    Args:
+        payload: SCREEN_CURSOR 帧数据
+
+    Returns:
+        Cursor
+    """
+    x, y, shape, flags = CURSOR_FORMAT.unpack_from(payload, 0)
+    return Cursor(x, y, shape, bool(flags & CURSOR_VISIBLE))
+
+
+def draw_cursor(image, cursor, scale=1.0):
+    """
+    把光标画在画面上 (不修改原画面)
+
+    Args:
+        image: PIL.Image.Image
+        cursor: Cursor, None 表示没有光标信息
+        scale: 画面相对于光标坐标的缩放比例 (观看者缩小显示时)
+
+    Returns:
+        PIL.Image.Image: 画有光标的副本; 光标不显示时返回原画面
+    """
+    if cursor is None or not cursor.visible:
+        return image
+    x, y = cursor.x * scale, cursor.y * scale
+    if not (0 <= x < image.width and 0 <= y < image.height):
+        return image
+
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    if cursor.shape == CURSOR_IBEAM:
+        draw.line([(x, y - 8), (x, y + 8)], fill='black', width=3)
+        draw.line([(x, y - 8), (x, y + 8)], fill='white', width=1)
+        for end in (y - 8, y + 8):
+            draw.line([(x - 3, end), (x + 3, end)], fill='white', width=1)
+    elif cursor.shape in (CURSOR_CROSS, CURSOR_SIZE):
+        for line in ([(x - 8, y), (x + 8, y)], [(x, y - 8), (x, y + 8)]):
+            draw.line(line, fill='black', width=3)
+            draw.line(line, fill='white', width=1)
+    elif cursor.shape == CURSOR_WAIT:
+        draw.ellipse([x - 7, y - 7, x + 7, y + 7], outline='black', width=3)
+        draw.ellipse([x - 7, y - 7, x + 7, y + 7], outline='white', width=1)
+    else:
+        draw.polygon([(x + dx, y + dy) for dx, dy in _ARROW_OUTLINE], fill='white', outline='black')
+    return image
+
+
+def changed_tiles(frame, previous, tile_size):
+    """
+    找出与上一帧相比有变化的块 (向量化比较)
+
+    先按行比较定位有变化的块行, 只在这些块行内再按列归约,
+    画面基本静止时开销接近一次整帧比较。
+
+    Args:
+        frame: 当前帧 (h, w, 通道数)
+        previous: 上一帧 (形状相同)
+        tile_size: 块边长
+
+    Returns:
+        ndarray: (块行数, 块列数) 的布尔数组
+    """
+    height, width, channels = frame.shape
+    diff = frame.reshape(height, -1) != previous.reshape(height, -1)
+
+    bands = np.logical_or.reduceat(diff.any(axis=1), np.arange(0, height, tile_size))
+    columns = np.arange(0, width * channels, tile_size * channels)
+    changed = np.zeros((len(bands), len(columns)), dtype=bool)
+    for band in np.flatnonzero(bands):
+        rows = diff[band * tile_size:(band + 1) * tile_size]
+        changed[band] = np.logical_or.reduceat(rows.any(axis=0), columns)
+    return changed
+
+
+def _line_hashes(lines, window):
+    """
+    每行 (二维数组的第一维) 连同其后 window - 1 行像素的哈希值
+
+    单独一行常有重复 (文字行之间的空白、纹理), 连续多行合起来才足以确定位置。
+    """
+    single = [hash(line.tobytes()) for line in lines]
+    return [hash(tuple(single[i:i + window])) for i in range(len(single) - window + 1)]
+
+
+def _find_shift(current, previous, min_lines, window):
+    """
+    在两组行哈希中找出最多行遵循的平移量
+
+    只用上一帧中唯一的行投票 (空白行等重复行无法确定位置)。
+
+    Args:
+        current: 当前帧的行哈希
+        previous: 上一帧的行哈希
+        min_lines: 最少匹配行数
+        window: 行哈希所含的行数
+
+    Returns:
+        tuple: (平移量, 第一条匹配行, 最后一条匹配行) (当前帧中的行号); 没有找到返回 None
+    """
+    counts = collections.Counter(previous)
+    positions = {value: i for i, value in enumerate(previous) if counts[value] == 1}
+
+    votes = collections.Counter()
+    for i, value in enumerate(current):
+        j = positions.get(value)
+        if j is not None and j != i:
+            votes[i - j] += 1
+    if not votes:
+        return None
+    shift, matches = votes.most_common(1)[0]
+    if matches < min_lines:
+        return None
+
+    lines = [i for i in range(max(shift, 0), min(len(current), len(previous) + shift))
+             if current[i] == previous[i - shift]]
+    return shift, lines[0], lines[-1] + window - 1
+
+
+def detect_scroll(frame, previous, changed, tile_size, min_lines=SCREEN_SCROLL_MIN_LINES):
+    """
+    检测变化区域内的整体平移 (滚动)
+
+    在变化块的外接矩形内对每行 (及每列) 像素求哈希, 找出最多行遵循的平移量,
+    匹配的行所覆盖的范围即为复制矩形。
+
+    Args:
+        frame: 当前帧 (h, w, 3)
+        previous: 上一帧
+        changed: changed_tiles() 的结果
+        tile_size: 块边长
+        min_lines: 最少匹配行 (列) 数
+
+    Returns:
+        tuple: (x, y, w, h, CopyFrom) 复制矩形; 没有检测到平移返回 None
+    """
+    height, width = frame.shape[:2]
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    top, bottom = int(rows[0]) * tile_size, min(int(rows[-1] + 1) * tile_size, height)
+    left, right = int(cols[0]) * tile_size, min(int(cols[-1] + 1) * tile_size, width)
+    area, before = frame[top:bottom, left:right], previous[top:bottom, left:right]
+
+    # 垂直滚动: 比较各行
+    window = max(1, min_lines // 2)
+    found = _find_shift(_line_hashes(area, window), _line_hashes(before, window), min_lines, window)
+    if found:
+        shift, first, last = found
+        return (left, top + first, right - left, last - first + 1,
+                CopyFrom(left, top + first - shift))
+
+    # 水平滚动: 比较各列
+    found = _find_shift(_line_hashes(area.transpose(1, 0, 2).copy(), window),
+                        _line_hashes(before.transpose(1, 0, 2).copy(), window), min_lines, window)
+    if found:
+        shift, first, last = found
+        return (left + first, top, last - first + 1, bottom - top,
+                CopyFrom(left + first - shift, top))
+    return None
+
+
+class TileEncoder:
+    """
+    分块差量编码器 (每个屏幕采集器一个, 不可多线程同时使用)
+
+    每帧与上一帧逐块比较, 同一行中相邻的变化块合并为一个矩形编码;
+    变化的块较多时检测滚动, 先发送复制矩形, 再对复制后仍不同的块编码;
+    画面没有变化时不产生数据。首帧、尺寸变化、每隔 keyframe_interval 秒
+    以及调用 request_keyframe() 之后发送关键帧 (按编码线程数分成水平条带;
+    'auto' 编码时按块行和块类别划分)。
+    一帧中的各个矩形相互独立, 在编码池中并行编码 (见 image_encoder.encode_image_many)。
+    """
+
+    def __init__(self, quality=70, tile_size=SCREEN_TILE_SIZE, keyframe_interval=SCREEN_KEYFRAME_INTERVAL,
+                 scroll_detect=SCREEN_SCROLL_DETECT, pixel_format=PIXEL_RGB, codec=CODEC_JPEG):
+        """
+        Args:
+            quality: JPEG质量
+            tile_size: 块边长(像素)
+            keyframe_interval: 关键帧间隔(秒)
+            scroll_detect: 是否检测滚动
+            pixel_format: 输入帧的通道顺序 (如 mss 截图的 PIXEL_BGRA)
+            codec: 编码格式 (image_encoder.CODEC_*)
+        """
+        self.quality = quality
+        self.codec = codec
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.scroll_detect = scroll_detect
+        self.pixel_format = pixel_format
+        self.scrolls = 0
+        self.previous = None
+        self.last_keyframe = 0.0
+        self._keyframe_requested = True
+
+    def request_keyframe(self):
+        """下一帧发送关键帧 (如有新的观看者加入)"""
+        self._keyframe_requested = True
+
+    def encode(self, frame, timestamp):
+        """
+        编码一帧
+
+        Args:
+            frame: 像素 (h, w, 通道数) uint8 数组, 通道顺序为 pixel_format
+            timestamp: 采集时间(秒)
+
+        Returns:
+            TileFrame: 编码结果; 画面没有变化时返回 None
+        """
+        height, width = frame.shape[:2]
+        keyframe = (self._keyframe_requested
+                    or self.previous is None
+                    or self.previous.shape != frame.shape
+                    or timestamp - self.last_keyframe >= self.keyframe_interval)
+
+        if keyframe:
+            self._keyframe_requested = False
+            self.last_keyframe = timestamp
+            self.previous = frame
+            if self.codec == CODEC_AUTO:
+                rows, cols = -(-height // self.tile_size), -(-width // self.tile_size)
+                rects, codecs = self._runs(frame, np.ones((rows, cols), dtype=bool))
+            else:
+                rects, codecs = self._bands(width, height), self.codec
+            return TileFrame(width, height, self._encode_rects(frame, rects, codecs), True)
+
+        previous = self.previous
+        changed = changed_tiles(frame, previous, self.tile_size)
+        self.previous = frame
+        if not changed.any():
+            return None
+
+        tiles = []
+        if self.scroll_detect and np.count_nonzero(changed) >= SCROLL_MIN_TILES:
+            copy = detect_scroll(frame, previous, changed, self.tile_size)
+            if copy is not None:
+                # 在上一帧上模拟复制, 与当前帧比较剩下的变化 (新露出的部分等)
+                x, y, w, h, source = copy
+                predicted = previous.copy()
+                predicted[y:y + h, x:x + w] = previous[source.src_y:source.src_y + h,
+                                                       source.src_x:source.src_x + w]
+                remaining = changed_tiles(frame, predicted, self.tile_size)
+                if np.count_nonzero(remaining) < np.count_nonzero(changed):
+                    tiles.append(copy)
+                    changed = remaining
+                    self.scrolls += 1
+
+        rects, codecs = self._runs(frame, changed)
+        tiles.extend(self._encode_rects(frame, rects, codecs))
+        return TileFrame(width, height, tiles)
+
+    def _runs(self, frame, changed):
+        """
+        把每行中相邻的变化块合并为矩形; 'auto' 编码时只合并同类的块
+
+        Args:
+            frame: 像素数组
+            changed: (块行数, 块列数) bool 数组
+
+        Returns:
+            tuple: ([(x, y, w, h), ...], 编码格式或与矩形等长的编码格式列表)
+        """
+        height, width = frame.shape[:2]
+        size = self.tile_size
+        auto = self.codec == CODEC_AUTO
+        rects, codecs = [], []
+        for row in np.flatnonzero(changed.any(axis=1)).tolist():
+            cols = changed[row].tolist()
+            y = row * size
+            h = min(y + size, height) - y
+            if auto:
+                kinds = [cols[col] and self._tile_codec(frame[y:y + h, col * size:(col + 1) * size])
+                         for col in range(len(cols))]
+            else:
+                kinds = cols
+            col = 0
+            while col < len(cols):
+                if not cols[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < len(cols) and cols[col] and kinds[col] == kinds[start]:
+                    col += 1
+                x = start * size
+                rects.append((x, y, min(col * size, width) - x, h))
+                codecs.append(kinds[start])
+        return rects, (codecs if auto else self.codec)
+
+    @staticmethod
+    def _tile_codec(tile):
+        """'auto' 编码时一块的格式: 颜色少 (文字、纯色界面) 用无损调色板 PNG, 否则 JPEG"""
+        return CODEC_PNG if count_colors(tile) <= IMAGE_PALETTE_MAX_COLORS else CODEC_JPEG
+
+    def _bands(self, width, height):
+        """关键帧的水平条带: 每个编码线程一条, 高度为块边长的整数倍"""
+        size = self.tile_size
+        band = -(-height // encode_workers())
+        band = max(size, -(-band // size) * size)
+        return [(0, y, width, min(band, height - y)) for y in range(0, height, band)]
+
+    def _encode_rects(self, frame, rects, codecs):
+        """
+        编码帧中的若干矩形
+
+        Args:
+            frame: 像素数组
+            rects: [(x, y, w, h), ...]
+            codecs: 编码格式, 或与 rects 等长的列表
+
+        Returns:
+            list: [(x, y, w, h, image_bytes), ...]
+        """
+        regions = [frame[y:y + h, x:x + w] for x, y, w, h in rects]
+        encoded = encode_image_many(regions, codecs, self.quality, self.pixel_format)
+        return [rect + (data,) for rect, data in zip(rects, encoded)]
+
+
+def _decode_tile(data):
+    """解码一块图像 (调色板 PNG 等转为 RGB, 贴图和缓存都不必再转换)"""
+    image = decode_image(data)
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+class ScreenCompositor:
+    """接收端: 把屏幕帧 (完整 JPEG 或分块差量) 合成为完整画面"""
+
+    def __init__(self, cache_size=0):
+        """
+        Args:
+            cache_size: 块缓存容量, 与服务器在 SCREEN_START 响应中确认的值相同 (0 为不使用)
+        """
+        self.canvas = None  # PIL.Image (RGB)
+        self.cache = TileCache(cache_size) if cache_size else None
+        self.cursor = None  # 最近的光标 (Cursor), 由观看者用 draw_cursor 画在画面上
+        self.desynced = False  # 块缓存与服务器不一致, 等待关键帧 (见 resync_due)
+        self._resync_time = None  # 上次请求关键帧的时间 (time.monotonic())
+
+    def apply(self, message):
+        """
+        把一条屏幕帧消息贴到画面上
+
+        Args:
+            message: SCREEN_FRAME / SCREEN_TILES / SCREEN_CURSOR 消息 (带 'payload')
+
+        Returns:
+            PIL.Image.Image: 当前完整画面 (不含光标); 还没有收到关键帧, 或块缓存不一致
+                             (desynced, 等待关键帧) 时返回 None
+        """
+        payload = message.get('payload')
+        if not payload:
+            return self.canvas
+
+        if message['type'] == MessageType.SCREEN_CURSOR:
+            self.cursor = unpack_cursor(payload)
+            return self.canvas
+
+        if message['type'] == MessageType.SCREEN_FRAME:
+            self.canvas = decode_image(payload).convert('RGB')
+            return self.canvas
+
+        frame, flags = unpack_tiles(payload)
+        if flags & TILES_CACHE_RESET and self.cache is not None:
+            self.cache.clear()
+        # 缓存必须按记录顺序更新 (与发送端一致), 即使还在等待关键帧
+        if not frame.keyframe and (self.desynced or self.canvas is None
+                                   or self.canvas.size != (frame.width, frame.height)):
+            self._update_cache(frame)
+            return None  # 中途加入或块缓存不一致, 等待关键帧
+        if frame.keyframe:
+            self.canvas = Image.new('RGB', (frame.width, frame.height))
+
+        for x, y, w, h, data in frame.tiles:
+            if isinstance(data, CopyFrom):
+                region = self.canvas.crop((data.src_x, data.src_y, data.src_x + w, data.src_y + h))
+                self.canvas.paste(region, (x, y))
+            elif isinstance(data, CachedTile):
+                image = self._cached(data.digest)
+                if image is None:
+                    return None
+                self.canvas.paste(image, (x, y))
+            else:
+                image = _decode_tile(data)
+                if self.cache is not None:
+                    self.cache.put(tile_digest(data), image)
+                self.canvas.paste(image, (x, y))
+        if frame.keyframe and self.desynced:
+            self.desynced = False
+            self._resync_time = None
+        return self.canvas
+
+    def resync_due(self):
+        """
+        块缓存不一致时是否该请求关键帧 (发送 SCREEN_KEYFRAME), 每 SCREEN_RESYNC_INTERVAL 秒最多一次
+
+        Returns:
+            bool: 返回 True 时调用方应发送请求
+        """
+        if not self.desynced:
+            return False
+        now = time.monotonic()
+        if self._resync_time is not None and now - self._resync_time < SCREEN_RESYNC_INTERVAL:
+            return False
+        self._resync_time = now
+        return True
+
+    def _cached(self, digest):
+        """取出缓存的块; 缓存中没有 (双方缓存不一致) 时标记 desynced 并返回 None"""
+        if self.cache is None or digest not in self.cache:
+            self.desynced = True
+            return None
+        return self.cache.get(digest)
+
+    def _update_cache(self, frame):
+        """只更新块缓存, 不绘制"""
+        if self.cache is None:
+            return
+        for x, y, w, h, data in frame.tiles:
+            if isinstance(data, CachedTile):
+                self._cached(data.digest)
+            elif not isinstance(data, CopyFrom):
+                self.cache.put(tile_digest(data), _decode_tile(data))
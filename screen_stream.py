@@ -1,91 +1,707 @@
 """
-屏幕流模块 - 使用 mss 捕获屏幕并提供 JPEG 字节帧
+屏幕流模块 - 使用 mss 捕获屏幕并提供编码后的字节帧 (编码见 image_encoder)
+
+同一 (显示器, 区域, 质量, 缩放比例, 编码格式) 的屏幕流共享一个采集器 (ScreenCaptureHub):
+每帧只截取、编码一次, 同一份数据分发给所有订阅者;
+每个订阅者只保留最新的一帧 (差量模式为有界队列), 慢的观看者不会拖慢其他人。
+差量模式 (delta) 下只编码、发送变化的块, 滚动时发送复制矩形 (见 screen_codec),
+跳过的帧合并到后一帧。
+观看者报告显示区域大小 (set_viewport) 后按其缩小分辨率再编码, 不传输观看者用不到的像素;
+自适应码率 (rate_control) 通过 set_rate() 调整帧率, 或改为订阅另一质量/分辨率的采集器;
+每个显示器有各自的采集器 (按各自订阅者的帧率截屏), 观看者可以同时查看多个显示器,
+也可以用 set_monitor() 在不重启屏幕流的情况下切换显示器, 用 update() 修改区域、缩放比例、
+帧率和质量 (如只查看放大的局部区域)。
+编码格式按屏幕流选择: JPEG, 调色板 PNG, WebP 无损, 或逐块选择无损/JPEG 的 'auto' (文字清晰)。
+截屏不含光标; 光标位置与形状由 get_timed_cursor() 单独按输入频率提供, 观看者画在画面上。
+截屏、编码、发送是流水线的三段 (stream_pipeline), 各在自己的线程中, 段间只交接最新的一帧
 """
+import contextlib
+import sys
 import threading
 import time
-import queue
-import io
 import mss
 from PIL import Image
 import numpy as np
 
+from config import SCREEN_QUEUE_SIZE, SCREEN_CURSOR_RATE
+from screen_codec import (TileEncoder, TileCache, Cursor, pack_cursor, CURSOR_ARROW, CURSOR_IBEAM,
+                          CURSOR_HAND, CURSOR_WAIT, CURSOR_CROSS, CURSOR_SIZE)
+from image_encoder import encode_image, bgra_view, PIXEL_BGRA, PIXEL_RGB, CODEC_JPEG
+from stream_pipeline import CapturePipeline, HandoffQueue, LatestFrame, StageStats, MERGE_OLDEST
+
+# 正在运行的采集器: (monitor, region, quality, delta, scale, codec) -> ScreenCaptureHub
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def _region_key(region):
+    """region 字典转为可哈希的键"""
+    if region is None:
+        return None
+    return tuple(sorted((k, int(v)) for k, v in region.items()))
+
+
+def capture_key(monitor, region, quality, delta, scale, codec=CODEC_JPEG):
+    """采集器表的键: 这些参数都相同的屏幕流共享同一份采集与编码"""
+    return (monitor, _region_key(region), quality, delta, scale, codec)
+
+
+def capture_area(monitors, monitor=1, region=None):
+    """
+    采集区域在虚拟桌面上的位置
+
+    Args:
+        monitors: mss 的 monitors 列表
+        monitor: 显示器编号 (不存在时使用主显示器)
+        region: None 或 dict {left, top, width, height} (相对于显示器)
+
+    Returns:
+        dict: {left, top, width, height}, 可直接传给 sct.grab()
+    """
+    info = monitors[monitor] if 0 <= monitor < len(monitors) else monitors[1]
+    if region is None:
+        return {key: info[key] for key in ('left', 'top', 'width', 'height')}
+    return {
+        'left': info['left'] + int(region.get('left', 0)),
+        'top': info['top'] + int(region.get('top', 0)),
+        'width': int(region.get('width', info['width'])),
+        'height': int(region.get('height', info['height']))
+    }
+
+
+def clip_region(region, width, height):
+    """
+    把区域限制在显示器范围内
+
+    Args:
+        region: dict {left, top, width, height} (相对于显示器, 缺少宽高表示到显示器边缘)
+        width, height: 显示器大小
+
+    Returns:
+        dict: 限制后的区域; 区域为空时返回 None
+    """
+    left = min(max(int(region.get('left', 0)), 0), width)
+    top = min(max(int(region.get('top', 0)), 0), height)
+    region_width = min(int(region.get('width', width - left)), width - left)
+    region_height = min(int(region.get('height', height - top)), height - top)
+    if region_width <= 0 or region_height <= 0:
+        return None
+    return {'left': left, 'top': top, 'width': region_width, 'height': region_height}
+
+
+class WindowsCursorReader:
+    """Windows: GetCursorInfo, 能取得光标形状 (与系统标准光标比较) 和是否隐藏"""
+
+    # 标准光标 ID -> 形状
+    _STANDARD = {32512: CURSOR_ARROW, 32513: CURSOR_IBEAM, 32514: CURSOR_WAIT, 32515: CURSOR_CROSS,
+                 32642: CURSOR_SIZE, 32643: CURSOR_SIZE, 32644: CURSOR_SIZE, 32645: CURSOR_SIZE,
+                 32646: CURSOR_SIZE, 32649: CURSOR_HAND, 32650: CURSOR_WAIT}
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class CursorInfo(ctypes.Structure):
+            _fields_ = [('cbSize', wintypes.DWORD), ('flags', wintypes.DWORD),
+                        ('hCursor', wintypes.HANDLE), ('ptScreenPos', wintypes.POINT)]
+
+        self._ctypes = ctypes
+        self._info = CursorInfo(cbSize=ctypes.sizeof(CursorInfo))
+        self._user32 = ctypes.windll.user32
+        self._user32.LoadCursorW.argtypes = [wintypes.HINSTANCE, wintypes.LPVOID]
+        self._user32.LoadCursorW.restype = wintypes.HANDLE
+        self._shapes = {self._user32.LoadCursorW(None, cursor_id): shape
+                        for cursor_id, shape in self._STANDARD.items()}
+
+    def read(self):
+        info = self._info
+        if not self._user32.GetCursorInfo(self._ctypes.byref(info)):
+            return None
+        shape = self._shapes.get(info.hCursor, CURSOR_ARROW)
+        return info.ptScreenPos.x, info.ptScreenPos.y, shape, bool(info.flags & 1)
+
+
+class PyAutoGuiCursorReader:
+    """其他系统: pyautogui, 只有位置 (形状按箭头)"""
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def read(self):
+        x, y = self._pyautogui.position()
+        return x, y, CURSOR_ARROW, True
+
+
+_cursor_reader = None
+_cursor_reader_lock = threading.Lock()
+
+
+def read_cursor():
+    """
+    读取光标
+
+    Returns:
+        tuple: (x, y, 形状, 是否显示), 坐标为虚拟桌面坐标; 无法读取时返回 None
+    """
+    global _cursor_reader
+    if _cursor_reader is None:
+        with _cursor_reader_lock:
+            if _cursor_reader is None:
+                readers = [WindowsCursorReader] if sys.platform == 'win32' else []
+                readers.append(PyAutoGuiCursorReader)
+                for reader in readers:
+                    try:
+                        _cursor_reader = reader()
+                        break
+                    except Exception:
+                        continue
+                else:
+                    _cursor_reader = False  # 都不可用, 不再尝试
+    if not _cursor_reader:
+        return None
+    try:
+        return _cursor_reader.read()
+    except Exception:
+        return None
+
+
+def list_monitors():
+    """
+    枚举显示器
+
+    Returns:
+        list: 每个显示器一项 {index, left, top, width, height, primary};
+              index 0 为所有显示器合成的虚拟桌面, 1 为主显示器
+    """
+    with mss.mss() as sct:
+        monitors = sct.monitors
+    return [{
+        'index': index,
+        'left': info['left'],
+        'top': info['top'],
+        'width': info['width'],
+        'height': info['height'],
+        'primary': index == 1
+    } for index, info in enumerate(monitors)]
+
+
+class ScreenCaptureHub:
+    """
+    共享的屏幕采集器
+
+    按订阅者中最高的帧率截屏, 在流水线的编码段编码 (见 stream_pipeline), 把同一份编码数据
+    放入每个订阅者的发送队列; 截屏与编码在不同线程中, 编码慢时截屏照常进行, 只编码最新的画面。
+    第一个订阅者加入时启动, 最后一个离开时停止 (停止后不再复用, 由 open_capture 新建)。
+    订阅/退订都经过 open_capture / close_capture, 在采集器表的锁内进行。
+    """
+
+    def __init__(self, key, monitor=1, region=None, quality=70, delta=False, scale=1.0, codec=CODEC_JPEG):
+        """
+        Args:
+            key: 在采集器表中的键
+            monitor: 显示器编号 (mss 的 monitors 下标, 1 为主显示器)
+            region: None 或 dict {left, top, width, height} (相对于显示器)
+            quality: JPEG质量
+            delta: 是否使用分块差量编码 (分发 TileFrame 而不是整帧图像数据)
+            scale: 分辨率缩放比例 (1.0 为原始分辨率)
+            codec: 编码格式 (image_encoder.CODEC_*)
+        """
+        self.key = key
+        self.monitor = monitor
+        self.region = region
+        self.quality = quality
+        self.scale = scale
+        self.codec = codec
+        self.pixel_format = PIXEL_RGB if scale != 1.0 else PIXEL_BGRA
+        self.encoder = TileEncoder(quality, pixel_format=self.pixel_format, codec=codec) if delta else None
+        self.subscribers = []
+        self.frames_captured = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self.pipeline = CapturePipeline(self._open_source, self._encode, self._deliver, self._frame_interval,
+                                        name=f'screen{monitor}')
+
+    def subscribe(self, subscriber):
+        """加入订阅者 (第一个订阅者加入时启动流水线)"""
+        with self._lock:
+            self.subscribers.append(subscriber)
+            if self.encoder:
+                self.encoder.request_keyframe()  # 新的观看者需要从关键帧开始
+            if self._started:
+                return
+            self._started = True
+        self.pipeline.start()
+
+    def unsubscribe(self, subscriber):
+        """
+        移除订阅者
+
+        Returns:
+            bool: 是否已没有订阅者 (流水线随之停止)
+        """
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers:
+                self.pipeline.stop()
+            return not self.subscribers
+
+    def request_keyframe(self):
+        """下一帧发送关键帧 (差量模式)"""
+        if self.encoder:
+            self.encoder.request_keyframe()
+
+    def _frame_interval(self):
+        with self._lock:
+            fps = max((s.fps for s in self.subscribers), default=1)
+        return 1.0 / max(1, fps)
+
+    @contextlib.contextmanager
+    def _open_source(self):
+        """采集段: mss 实例在采集线程中创建"""
+        with mss.mss() as sct:
+            area = capture_area(sct.monitors, self.monitor, self.region)
+            yield lambda: self._grab(sct, area)
+
+    def _grab(self, sct, area):
+        """截屏 (需要时缩放), 返回像素数组"""
+        sct_img = sct.grab(area)
+        if self.scale == 1.0:
+            # 不缩放: 直接使用 BGRA 原始数据 (不复制、不转换)
+            return bgra_view(sct_img)
+        # 缩放: PIL 直接读取 BGRA 原始数据, 缩放结果为 RGB
+        width, height = sct_img.size
+        img = Image.frombuffer('RGB', sct_img.size, sct_img.raw, 'raw', 'BGRX', 0, 1)
+        img = img.resize((max(1, int(width * self.scale)), max(1, int(height * self.scale))), Image.BILINEAR)
+        return np.asarray(img)
+
+    def _encode(self, pixels):
+        """编码段: 差量模式只编码变化的块, 画面没有变化时返回 None (不分发)"""
+        self.frames_captured += 1
+        if self.encoder:
+            return self.encoder.encode(pixels, time.time())
+        return encode_image(pixels, self.codec, self.quality, self.pixel_format)
+
+    def _deliver(self, frame):
+        """交给发送段: 放入每个订阅者的发送队列"""
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(frame, self.key)
+
+
+def capture_bounds(monitor=1, region=None):
+    """
+    采集区域的位置与原始大小
+
+    Args:
+        monitor: 显示器编号
+        region: None 或 dict {left, top, width, height}
+
+    Returns:
+        dict: {left, top, width, height}; 无法获取时返回 None
+    """
+    try:
+        with mss.mss() as sct:
+            return capture_area(sct.monitors, monitor, region)
+    except Exception:
+        return None
+
+
+def open_capture(subscriber, monitor=1, region=None, quality=70, delta=False, scale=1.0, codec=CODEC_JPEG):
+    """
+    订阅 (monitor, region, quality, delta, scale, codec) 对应的共享采集器, 不存在则创建并启动
+
+    Args:
+        subscriber: 订阅者, 需有 fps 属性和 push(frame, key) 方法
+
+    Returns:
+        tuple: (采集器, 是否与其他订阅者共享)
+    """
+    key = capture_key(monitor, region, quality, delta, scale, codec)
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is None:
+            hub = ScreenCaptureHub(key, monitor, region, quality, delta, scale, codec)
+            _hubs[key] = hub
+        shared = bool(hub.subscribers)
+        hub.subscribe(subscriber)
+        return hub, shared
+
+
+def close_capture(subscriber, hub):
+    """
+    退订采集器, 没有订阅者时停止采集并从表中移除
+
+    Args:
+        subscriber: 订阅者
+        hub: open_capture 返回的采集器
+    """
+    with _hubs_lock:
+        if hub.unsubscribe(subscriber) and _hubs.get(hub.key) is hub:
+            del _hubs[hub.key]
+
+
+def get_hub_stats():
+    """
+    Returns:
+        list: 每个运行中的采集器一项 {key, subscribers, frames_captured, scrolls}
+    """
+    with _hubs_lock:
+        hubs = list(_hubs.values())
+    return [{
+        'key': hub.key,
+        'subscribers': len(hub.subscribers),
+        'frames_captured': hub.frames_captured,
+        'scrolls': hub.encoder.scrolls if hub.encoder else 0,
+        'pipeline': hub.pipeline.get_stats()
+    } for hub in hubs]
+
+
+def _merge_frames(older, newer):
+    """发送队列满时合并最旧的两个差量帧 (采集时间与各段耗时取较新的一帧)"""
+    return newer[0], older[1].merge(newer[1]), newer[2]
+
+
 class ScreenStream:
-    def __init__(self, region=None, fps=10, quality=70):
+    """一个观看者的屏幕流: 订阅共享采集器, 从自己的队列中取帧"""
+
+    def __init__(self, region=None, fps=10, quality=70, monitor=1, delta=False, cache_size=0,
+                 viewport=None, queue_size=SCREEN_QUEUE_SIZE, codec=CODEC_JPEG):
         """region: None 或 dict {left, top, width, height}
         fps: 采样帧率
         quality: JPEG质量
+        monitor: 显示器编号 (1 为主显示器, 0 为所有显示器合成的虚拟桌面)
+        delta: 是否使用分块差量编码 (帧数据为 SCREEN_TILES 格式)
+        cache_size: 块缓存容量 (块数, 仅差量模式, 0 为不使用), 须与观看者的缓存容量相同
+        viewport: None 或 (宽, 高), 观看者显示区域的大小, 画面按比例缩小到不超过此大小
+        queue_size: 差量模式的发送队列长度, 满了合并最旧的两帧 (整帧模式只保留最新的一帧)
+        codec: 编码格式 (image_encoder.CODEC_*), 由服务器按本机支持的格式协商
         """
         self.region = region
         self.fps = fps
         self.quality = quality
+        self.monitor = monitor
+        self.delta = delta
+        self.codec = codec
+        self.viewport = tuple(viewport) if viewport else None
+        self.monitor_bounds = None  # 显示器在虚拟桌面上的位置与大小 {left, top, width, height}
+        self.bounds = None  # 采集区域在虚拟桌面上的位置与大小, 启动时获取
+        self.source_size = None  # 采集区域的原始大小
+        self.max_scale = 1.0  # 观看者要求的最大缩放比例
+        self.rate_scale = 1.0  # 自适应码率要求的缩放比例
+        self.scale = 1.0  # 实际的分辨率缩放比例 (显示区域 x 观看者要求 x 自适应码率)
+        self.rate = None  # 自适应码率控制器 (RateController), 由推流方设置
+        # 观看者块缓存的镜像: 每个观看者一份, 记录对方已缓存的块
+        self.cache = TileCache(cache_size) if delta and cache_size else None
+        self._reset_cache = False
         self.is_streaming = False
-        self.frame_queue = queue.Queue(maxsize=10)
-        self.thread = None
+        # 发送队列 (流水线的发送段从这里取帧): 整帧只保留最新的一帧, 差量帧不能丢弃, 只能合并
+        self.send_stats = StageStats('send')
+        if delta:
+            # 差量帧按本流的帧率发送 (共享的采集器按最快的观看者的帧率采集)
+            self.frames = HandoffQueue(queue_size, MERGE_OLDEST, merge=_merge_frames, stats=self.send_stats,
+                                       min_interval=lambda: 0.9 / max(1, self.fps))
+        else:
+            self.frames = LatestFrame(stats=self.send_stats)
+        self._key_lock = threading.Lock()  # 保护 _hub_key, 切换采集器时与 push 互斥
+        self._last_time = 0.0
+        self._hub_key = None
+        self._switch_lock = threading.Lock()
+        self.hub = None
+        self._last_cursor = None  # 上次发出的光标
+        self._cursor_time = 0.0
 
     def start(self):
         if self.is_streaming:
             return True, "屏幕流已在运行"
         self.is_streaming = True
-        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
-        self.thread.start()
+        self.frames.open()
+        self._locate()
+        self.scale = self._target_scale()
+        self._hub_key = capture_key(self.monitor, self.region, self.quality, self.delta, self.scale, self.codec)
+        self.hub, shared = open_capture(self, self.monitor, self.region, self.quality, self.delta, self.scale,
+                                        self.codec)
         time.sleep(0.05)
-        return True, "屏幕流启动成功"
+        return True, "屏幕流启动成功 (共享已有采集)" if shared else "屏幕流启动成功"
 
     def stop(self):
         self.is_streaming = False
-        if self.thread and self.thread.is_alive():
-            self.thread.join(timeout=1)
-        # 清理队列
-        while not self.frame_queue.empty():
-            try:
-                self.frame_queue.get_nowait()
-            except Exception:
-                break
+        hub = self.hub
+        if hub is not None:
+            close_capture(self, hub)
+            if not hub.subscribers:
+                hub.pipeline.join(timeout=1)
+            self.hub = None
+        # 唤醒等待中的取帧, 清理队列
+        self.frames.close()
         return True, "屏幕流已停止"
 
-    def _capture_loop(self):
-        frame_interval = 1.0 / max(1, self.fps)
-        with mss.mss() as sct:
-            monitor = sct.monitors[1] if self.region is None else self.region
-            while self.is_streaming:
-                start = time.time()
-                try:
-                    if self.region is None:
-                        sct_img = sct.grab(monitor)
-                    else:
-                        sct_img = sct.grab({
-                            'left': monitor['left'] + int(self.region.get('left', 0)),
-                            'top': monitor['top'] + int(self.region.get('top', 0)),
-                            'width': int(self.region.get('width', monitor['width'])),
-                            'height': int(self.region.get('height', monitor['height']))
-                        })
-
-                    # 转为 PIL Image
-                    img = Image.frombytes('RGB', sct_img.size, sct_img.rgb)
-
-                    # 压缩为 JPEG bytes
-                    bio = io.BytesIO()
-                    img.save(bio, format='JPEG', quality=self.quality, optimize=True)
-                    jpeg_bytes = bio.getvalue()
-
-                    if self.frame_queue.full():
-                        try:
-                            self.frame_queue.get_nowait()
-                        except Exception:
-                            pass
-                    self.frame_queue.put(jpeg_bytes)
-
-                except Exception as e:
-                    # 捕获并继续
-                    pass
-
-                elapsed = time.time() - start
-                to_sleep = frame_interval - elapsed
-                if to_sleep > 0:
-                    time.sleep(to_sleep)
+    @property
+    def frames_dropped(self):
+        """来不及发送而丢弃/合并的帧数 (自适应码率据此判断发送跟不上)"""
+        return self.frames.dropped
+
+    def get_pipeline_stats(self):
+        """
+        Returns:
+            dict: 流水线各段的统计 {capture, encode, send} (采集与编码由共享的采集器统计)
+        """
+        hub = self.hub
+        stats = hub.pipeline.get_stats() if hub is not None else {}
+        stats['send'] = self.send_stats.snapshot()
+        stats['send_queue'] = len(self.frames)
+        return stats
+
+    def set_rate(self, quality, fps, scale=1.0):
+        """
+        调整推流参数 (自适应码率)
+
+        帧率只影响本流; 质量或分辨率变化时改为订阅对应的采集器
+        (相同参数的观看者仍共享), 旧采集器的帧不再接收。
+
+        Args:
+            quality: JPEG质量
+            fps: 帧率
+            scale: 分辨率缩放比例
+        """
+        self.fps = fps
+        self.rate_scale = scale
+        self._resubscribe(quality)
+
+    def set_viewport(self, width, height):
+        """
+        观看者显示区域大小变化 (如窗口缩放)
+
+        Args:
+            width: 显示区域宽度
+            height: 显示区域高度
+
+        Returns:
+            float: 调整后的分辨率缩放比例
+        """
+        self.viewport = (int(width), int(height))
+        self._resubscribe(self.quality)
+        return self.scale
+
+    def set_monitor(self, monitor):
+        """
+        切换到另一个显示器 (不重启屏幕流, 观看者从新显示器的关键帧开始);
+        设置了区域时保留同一区域, 限制在新显示器的范围内
+
+        Args:
+            monitor: 显示器编号 (见 list_monitors)
+
+        Returns:
+            tuple: (success, message)
+        """
+        monitor = int(monitor)
+        if not 0 <= monitor < len(list_monitors()):
+            return False, f"显示器不存在: {monitor}"
+        with self._switch_lock:
+            if monitor == self.monitor:
+                return True, "已在查看该显示器"
+            if self.region is not None:
+                monitor_bounds = capture_bounds(monitor)
+                if monitor_bounds is None:
+                    return False, "无法获取显示器范围"
+                self.region = clip_region(self.region, monitor_bounds['width'], monitor_bounds['height'])
+            self.monitor = monitor
+            self._locate()
+            self._switch_hub(self.quality, self._target_scale())
+        return True, f"已切换到显示器 {monitor}"
+
+    def update(self, region=None, fps=None, quality=None, scale=None, codec=None):
+        """
+        修改运行中的屏幕流的参数 (不重启屏幕流, 参数一次性生效)
+
+        区域、分辨率或编码格式变化时改为订阅对应的采集器, 观看者从新画面的关键帧开始;
+        自适应码率以新的质量/帧率为起点继续调整。
+
+        Args:
+            region: 新的区域 dict {left, top, width, height} (相对于显示器),
+                    空字典表示恢复整个显示器, None 表示不变
+            fps: 帧率, None 表示不变
+            quality: JPEG质量, None 表示不变
+            scale: 最大缩放比例 (0.05-1.0), None 表示不变
+            codec: 编码格式 (已协商过的 image_encoder.CODEC_*), None 表示不变
+
+        Returns:
+            tuple: (success, message)
+        """
+        with self._switch_lock:
+            if region is not None:
+                if region:
+                    monitor_bounds = capture_bounds(self.monitor)
+                    if monitor_bounds is None:
+                        return False, "无法获取显示器范围"
+                    region = clip_region(region, monitor_bounds['width'], monitor_bounds['height'])
+                    if region is None:
+                        return False, "区域不在显示器范围内"
+                self.region = region or None
+                self._locate()
+            if scale is not None:
+                self.max_scale = min(max(float(scale), 0.05), 1.0)
+            fps = max(1, int(fps)) if fps is not None else self.fps
+            quality = min(max(int(quality), 1), 100) if quality is not None else self.quality
+            if self.rate is not None:
+                quality, fps = self.rate.reset(quality, fps)
+            self.fps = fps
+            if codec is not None:
+                self.codec = codec
+
+            scale = self._target_scale()
+            if capture_key(self.monitor, self.region, quality, self.delta, scale, self.codec) != self._hub_key:
+                self._switch_hub(quality, scale)
+        return True, "屏幕流参数已更新"
+
+    def get_region(self):
+        """
+        Returns:
+            dict: 当前采集区域 {left, top, width, height} (相对于显示器); 未启动时返回 None
+        """
+        if not self.bounds or not self.monitor_bounds:
+            return None
+        return {
+            'left': self.bounds['left'] - self.monitor_bounds['left'],
+            'top': self.bounds['top'] - self.monitor_bounds['top'],
+            'width': self.bounds['width'],
+            'height': self.bounds['height']
+        }
+
+    def to_screen(self, x, y):
+        """
+        画面坐标换算为虚拟桌面坐标 (鼠标控制用)
+
+        Args:
+            x, y: 观看者画面上的坐标 (按当前缩放比例)
+
+        Returns:
+            tuple: (x, y)
+        """
+        left, top = (self.bounds['left'], self.bounds['top']) if self.bounds else (0, 0)
+        return left + int(x / self.scale), top + int(y / self.scale)
+
+    def _locate(self):
+        """获取显示器与采集区域在虚拟桌面上的位置 (启动、切换显示器或区域时调用)"""
+        self.monitor_bounds = capture_bounds(self.monitor)
+        self.bounds = capture_bounds(self.monitor, self.region)
+        self.source_size = (self.bounds['width'], self.bounds['height']) if self.bounds else None
+
+    def _target_scale(self):
+        """显示区域、观看者要求与自适应码率共同决定的缩放比例 (保留两位小数, 便于相近的观看者共享采集器)"""
+        scale = self.rate_scale * self.max_scale
+        if self.viewport and self.source_size:
+            (view_w, view_h), (source_w, source_h) = self.viewport, self.source_size
+            scale *= min(1.0, max(view_w, 1) / source_w, max(view_h, 1) / source_h)
+        return max(round(scale, 2), 0.05)
+
+    def _resubscribe(self, quality):
+        """质量或缩放比例变化时改为订阅对应的采集器, 旧采集器的帧不再接收"""
+        with self._switch_lock:
+            scale = self._target_scale()
+            if (quality, scale) == (self.quality, self.scale):
+                return
+            self._switch_hub(quality, scale)
+
+    def _switch_hub(self, quality, scale):
+        """改为订阅当前显示器/区域/编码格式与给定质量、缩放比例的采集器 (调用方持有 _switch_lock)"""
+        self.quality, self.scale = quality, scale
+        old = self.hub
+        if not self.is_streaming or old is None:
+            return
+
+        with self._key_lock:
+            self._hub_key = capture_key(self.monitor, self.region, quality, self.delta, scale, self.codec)
+            if self.delta:
+                self.frames.clear()  # 旧采集器的差量帧, 新采集器会从关键帧开始
+        self.hub, _ = open_capture(self, self.monitor, self.region, quality, self.delta, scale, self.codec)
+        close_capture(self, old)
+
+    def request_keyframe(self):
+        """请求采集器下一帧发送关键帧 (如连接恢复后画面需要重建), 同时重置块缓存"""
+        # 中断时在途的帧可能已丢失, 双方的块缓存不再一致
+        self._reset_cache = True
+        if self.hub:
+            self.hub.request_keyframe()
+
+    def push(self, frame, key=None):
+        """
+        采集器交来新帧
+
+        按本流的帧率抽帧: 完整帧模式丢弃多余的帧;
+        差量模式不能丢帧 (后面的帧只含变化的块), 多余的帧合并到待发送的最新一帧中,
+        队列满时把最旧的两帧合并为一帧
+
+        Args:
+            frame: (采集时间, 帧数据, (截屏耗时, 编码耗时))
+            key: 来自哪个采集器; 已切换到其他采集器时忽略
+        """
+        capture_time = frame[0]
+        with self._key_lock:
+            if key is not None and key != self._hub_key:
+                return
+            if capture_time - self._last_time < 0.9 / max(1, self.fps):
+                if self.delta:
+                    self.frames.put_merged(frame)
+                return
+            self._last_time = capture_time
+            self.frames.put(frame)
+
+    def get_timed_cursor(self, timeout=1.0):
+        """
+        等待光标变化 (位置、形状或是否显示), 最多每秒 SCREEN_CURSOR_RATE 次
+
+        Args:
+            timeout: 最长等待时间(秒), 0 表示只检查一次
+
+        Returns:
+            tuple: (success, (时间戳, SCREEN_CURSOR 帧数据, None)); 光标没有变化时 success 为 False
+        """
+        interval = 1.0 / SCREEN_CURSOR_RATE
+        deadline = time.monotonic() + timeout
+        while self.is_streaming:
+            wait = self._cursor_time + interval - time.monotonic()
+            if wait > 0:
+                if time.monotonic() + wait > deadline:
+                    break
+                time.sleep(wait)
+            self._cursor_time = time.monotonic()
+
+            cursor = self._cursor_in_frame()
+            if cursor is not None and cursor != self._last_cursor:
+                self._last_cursor = cursor
+                return True, (time.time(), pack_cursor(cursor), None)
+            if time.monotonic() >= deadline:
+                break
+        return False, "光标没有变化"
+
+    def _cursor_in_frame(self):
+        """当前光标在画面上的坐标 (按区域和缩放比例换算); 无法读取时返回 None"""
+        cursor = read_cursor()
+        bounds = self.bounds
+        if cursor is None or not bounds:
+            return None
+        x, y, shape, visible = cursor
+        x, y = x - bounds['left'], y - bounds['top']
+        if not (visible and 0 <= x < bounds['width'] and 0 <= y < bounds['height']):
+            return Cursor(0, 0, CURSOR_ARROW, False)  # 不显示时位置无关, 只在显示/隐藏切换时发送
+        return Cursor(int(x * self.scale), int(y * self.scale), shape, True)
 
     def get_frame(self, timeout=1.0):
-        try:
-            return True, self.frame_queue.get(timeout=timeout)
-        except Exception:
+        success, result = self.get_timed_frame(timeout)
+        if not success:
+            return False, result
+        return True, result[1]
+
+    def get_timed_frame(self, timeout=1.0):
+        """返回 (success, (采集时间戳, 图像数据, (截屏耗时, 编码耗时))); 差量模式下为 SCREEN_TILES 帧数据"""
+        item = self.frames.get(timeout if self.is_streaming else 0)
+        if item is None:
             return False, "获取帧超时"
+        capture_time, frame, times = item
+        if self.delta:
+            reset, self._reset_cache = self._reset_cache, False
+            frame = frame.pack(self.cache, reset)
+        return True, (capture_time, frame, times)
@@ -8,14 +8,13 @@ import threading
 import os
 import sys
 import subprocess
-import io
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入截图库
 try:
     import mss
-    from PIL import Image
 except ImportError:
     print("错误: 请先安装依赖库")
     print("运行: pip install -r requirements.txt")
@@ -25,26 +24,36 @@ except ImportError:
 from config import *
 from protocol import *
 from utils import *
-from screen_stream import ScreenStream
+from screen_stream import ScreenStream, get_hub_stats, list_monitors, capture_area, read_cursor
+from image_encoder import encode_jpeg, bgra_view, get_encoder_info, negotiate_codec, PIXEL_BGRA, PIXEL_BGR
+from multiplex import MuxConnection
+from dispatch import message_handler, get_handler, PAYLOAD, HandlerPool
+from metrics import MetricsRegistry
+from heartbeat import Heartbeat
+from resume import ResumeRegistry
+from rate_control import RateController
 
 
-class RemoteControlServer:
-    """远程控制服务器类"""
+class ClientSession:
+    """
+    控制端会话
     
-    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+    每个连接对应一个会话对象, 各自持有连接、Shell工作目录、屏幕/视频流
+    和键盘监听, 多个控制端同时连接时互不干扰
+    """
+    
+    def __init__(self, server, conn, client_address):
         """
-        初始化服务器
+        初始化会话
         
         Args:
-            host: 服务器监听地址
-            port: 服务器监听端口
+            server: 所属的服务器对象
+            conn: 多路复用连接 (所有发送都经过它, 保证并发写不交错)
+            client_address: 客户端地址
         """
-        self.host = host
-        self.port = port
-        self.server_socket = None
-        self. is_running = False
-        self. client_socket = None
-        self.client_address = None
+        self.server = server
+        self.conn = conn
+        self.client_address = client_address
         self.is_authenticated = False
         self.is_controlled = False  # 是否处于受控状态
         self.shell_mode = False  # 是否处于Shell模式
@@ -52,110 +61,230 @@ class RemoteControlServer:
         self.shell_working_dir = os.path.abspath(SAFE_DIRECTORY)  # Shell当前工作目录
         self.video_stream = None  # 视频流对象
         self.video_streaming = False  # 是否正在视频流传输
-        
-        print(f"{Colors.CYAN}{Colors.BOLD}{'='*60}{Colors.RESET}")
-        print(f"{Colors.CYAN}{Colors.BOLD}{'  远程控制系统 - 服务器端 (被控主机B)':^60}{Colors.RESET}")
-        print(f"{Colors. CYAN}{Colors.BOLD}{'='*60}{Colors.RESET}")
-        print(f"{Colors.YELLOW}⚠️  注意: 本程序仅用于教育学习目的{Colors.RESET}")
-        print(f"{Colors.YELLOW}⚠️  仅在本地网络或虚拟机环境中运行{Colors.RESET}")
-        print(f"{Colors. CYAN}{'='*60}{Colors. RESET}\n")
+        self.screen_streams = {}  # 屏幕流编号 -> 屏幕流对象 (同时查看多个显示器时有多路)
+        self.keyboard_listener = None  # 键盘监听器
+        self._video_thread = None
+        self._screen_threads = {}  # 屏幕流编号 -> (画面推流, 光标推流 或 None)
+        self.connected_at = time.time()
+        self.heartbeat = Heartbeat(conn)  # 心跳与往返时延估算 (self.heartbeat.rtt)
+        self.resume_token = None  # 恢复令牌 (由 ResumeRegistry 签发)
+        self.resumed = None  # 凭令牌恢复的原会话 (由它接管本连接)
     
-    def start(self):
-        """启动服务器"""
-        try:
-            # 创建服务器套接字
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket. setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self. server_socket.listen(MAX_CONNECTIONS)
-            
-            self.is_running = True
-            
-            # 显示服务器信息
-            local_ip = get_local_ip()
-            print(f"{Colors.GREEN}✓ 服务器启动成功! {Colors.RESET}")
-            print(f"  监听地址: {Colors.BOLD}{local_ip}:{self.port}{Colors.RESET}")
-            print(f"  安全目录: {Colors.BOLD}{SAFE_DIRECTORY}{Colors.RESET}")
-            print(f"  Shell类型: {Colors.BOLD}{SHELL_TYPE}{Colors.RESET} ({CURRENT_OS})")
-            print(f"  允许命令: {Colors.BOLD}{len(ALLOWED_COMMANDS)}个{Colors.RESET}")
-            print(f"\n{Colors.CYAN}等待客户端连接...{Colors.RESET}\n")
-            
-            # 接受连接循环
-            while self.is_running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    print(f"\n{Colors. BLUE}► 收到连接请求: {client_address[0]}:{client_address[1]}{Colors.RESET}")
-                    
-                    # 启动客户端处理线程
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                    
-                except KeyboardInterrupt:
-                    print(f"\n{Colors. YELLOW}接收到中断信号, 正在关闭服务器...{Colors.RESET}")
-                    break
-                except Exception as e:
-                    print(f"{Colors.RED}✗ 接受连接失败: {e}{Colors. RESET}")
+    def run(self):
+        """处理会话: 身份验证后循环处理请求, 直到连接断开 (恢复会话时交给原会话处理)"""
+        client_address = self.client_address
         
-        except Exception as e:
-            print(f"{Colors.RED}✗ 服务器启动失败: {e}{Colors.RESET}")
+        # 等待身份验证
+        if not self.authenticate_client():
+            print(f"{Colors.RED}✗ 身份验证失败, 断开连接: {client_address[0]}{Colors.RESET}")
+            self.conn.close()
+            print(f"{Colors. CYAN}► 连接已关闭: {client_address[0]}{Colors.RESET}")
+            return
         
-        finally:
-            self.stop()
-    
-    def stop(self):
-        """停止服务器"""
-        self.is_running = False
-        if self.server_socket:
-            self.server_socket.close()
-        print(f"\n{Colors.GREEN}✓ 服务器已关闭{Colors.RESET}")
+        # 凭令牌恢复了原会话: 由原会话接管本连接
+        session = self
+        if self.resumed:
+            with self.server._sessions_lock:
+                self.server.sessions.discard(self)
+            session = self.resumed
+        session.on_authenticated()
+        session.serve()
     
-    def handle_client(self, client_socket, client_address):
-        """
-        处理客户端连接
+    def on_authenticated(self):
+        """身份验证通过 (或恢复会话) 后更新状态"""
+        with self.server._sessions_lock:
+            self.server.sessions.add(self)
         
-        Args:
-            client_socket: 客户端套接字
-            client_address: 客户端地址
-        """
-        self.client_socket = client_socket
-        self.client_address = client_address
-        self.is_authenticated = False
+        if self.is_controlled:
+            print(f"{Colors.GREEN}✓ 会话已恢复: {self.client_address[0]} "
+                  f"(Shell目录、屏幕/视频流保持不变){Colors.RESET}")
+            return
+        
+        print(f"{Colors.GREEN}✓ 身份验证成功: {self.client_address[0]}{Colors.RESET}")
+        self.is_authenticated = True
+        self.is_controlled = True
+        self.display_controlled_status(True)
+    
+    def serve(self):
+        """循环处理当前连接上的请求, 直到连接断开"""
+        conn = self.conn
+        heartbeat = self.heartbeat
+        client_address = self.client_address
         
         try:
-            # 等待身份验证
-            if not self.authenticate_client():
-                print(f"{Colors.RED}✗ 身份验证失败, 断开连接: {client_address[0]}{Colors.RESET}")
-                client_socket.close()
-                return
-            
-            print(f"{Colors.GREEN}✓ 身份验证成功: {client_address[0]}{Colors.RESET}")
-            self.is_authenticated = True
-            self.is_controlled = True
-            self.display_controlled_status(True)
+            heartbeat.start()
             
             # 消息处理循环
-            while self.is_running and self.is_authenticated:
-                message = receive_message(client_socket)
+            while self.server.is_running and self.is_authenticated:
+                message = conn.read_message()
                 
                 if message is None:
-                    print(f"{Colors. YELLOW}► 客户端断开连接: {client_address[0]}{Colors.RESET}")
+                    if self.conn is conn:
+                        self.print_disconnected()
                     break
                 
                 # 处理不同类型的消息
-                self.handle_message(message)
+                self.dispatch_message(message)
         
         except Exception as e:
             print(f"{Colors.RED}✗ 处理客户端时发生错误: {e}{Colors.RESET}")
         
         finally:
+            heartbeat.stop()
+            if not self.detach(conn) and self.is_controlled:
+                self.is_controlled = False
+                self.display_controlled_status(False)
+            conn.close()
+            print(f"{Colors. CYAN}► 连接已关闭: {client_address[0]}{Colors.RESET}")
+            self.print_stats(conn)
+    
+    def attach(self, conn):
+        """
+        改用新的连接 (客户端凭令牌恢复会话时调用); 原连接如仍在则断开
+        
+        Args:
+            conn: 新连接
+        """
+        old_conn = self.conn
+        self.conn = conn
+        self.heartbeat = Heartbeat(conn)
+        if not old_conn.closed:
+            old_conn.abort()
+        
+        # 断线期间的差量帧已丢弃, 客户端需要从关键帧重建画面
+        for stream in list(self.screen_streams.values()):
+            stream.request_keyframe()
+    
+    def detach(self, conn):
+        """
+        连接结束时调用: 会话可恢复则保留, 等待客户端重连; 否则释放资源
+        
+        Args:
+            conn: 结束的连接
+        
+        Returns:
+            bool: 会话是否继续存在 (已保留或已被新连接接管)
+        """
+        registry = self.server.resume_registry
+        with registry.lock:
+            if self.conn is not conn:
+                print(f"{Colors.CYAN}► 原连接已由恢复的会话接管: {self.client_address[0]}{Colors.RESET}")
+                return True
+            
+            with self.server._sessions_lock:
+                self.server.sessions.discard(self)
+            
+            # 客户端主动断开或服务器关闭时不保留
+            if self.is_authenticated and self.server.is_running and registry.park(self):
+                print(f"{Colors.YELLOW}► 会话保留 {registry.grace} 秒, 等待客户端恢复: "
+                      f"{self.client_address[0]}{Colors.RESET}")
+                return True
+            
+            registry.revoke(self)
+        
+        self.release()
+        return False
+    
+    def expire(self):
+        """保留期内客户端没有恢复会话: 释放资源 (由 ResumeRegistry 调用)"""
+        print(f"{Colors.YELLOW}► 会话保留超时, 已释放: {self.client_address[0]}{Colors.RESET}")
+        self.release()
+        if self.is_controlled:
             self.is_controlled = False
             self.display_controlled_status(False)
-            client_socket.close()
-            print(f"{Colors. CYAN}► 连接已关闭: {client_address[0]}{Colors.RESET}\n")
+    
+    def print_disconnected(self):
+        """显示连接断开的原因 (客户端断开 / 心跳超时)"""
+        if self.heartbeat.expired or self.heartbeat.silence() >= self.heartbeat.timeout:
+            print(f"{Colors.YELLOW}► 心跳超时, 客户端已失联: {self.client_address[0]}{Colors.RESET}")
+        else:
+            print(f"{Colors. YELLOW}► 客户端断开连接: {self.client_address[0]}{Colors.RESET}")
+    
+    def release(self):
+        """连接结束时释放会话占用的采集资源"""
+        self.is_authenticated = False
+        self.video_streaming = False
+        
+        # 尚未开始执行的后台请求不再需要
+        self.server.handler_pool.discard(self)
+        
+        streams, self.screen_streams = list(self.screen_streams.values()), {}
+        if self.video_stream:
+            streams.append(self.video_stream)
+            self.video_stream = None
+        for stream in streams:
+            try:
+                stream.stop()
+            except Exception:
+                pass
+        
+        if self.keyboard_listener:
+            self.keyboard_listener.stop()
+            self.keyboard_listener = None
+    
+    def get_stats(self, conn=None):
+        """
+        获取会话的吞吐统计
+        
+        Args:
+            conn: 统计哪条连接, 默认为当前连接
+        
+        Returns:
+            dict: 时长、收发字节数/消息数、平均速率、往返时延及各路流的流水线统计
+        """
+        conn = conn or self.conn
+        duration = max(time.time() - self.connected_at, 1e-6)
+        stats = {
+            'address': self.client_address[0],
+            'duration': duration,
+            'bytes_sent': conn.bytes_sent,
+            'bytes_received': conn.bytes_received,
+            'messages_sent': conn.messages_sent,
+            'messages_received': conn.messages_received,
+            'send_rate': conn.bytes_sent / duration,
+            'receive_rate': conn.bytes_received / duration
+        }
+        stats.update(self.heartbeat.get_stats())
+        rate = {}
+        pipeline = {}
+        streams = {(f'screen_stream{index}' if index else 'screen_stream'): stream
+                   for index, stream in list(self.screen_streams.items())}
+        streams['video_stream'] = self.video_stream
+        for name, stream in streams.items():
+            if stream is None:
+                continue
+            if stream.rate is not None:
+                rate[name] = stream.rate.get_stats()
+            if stream.is_streaming:
+                pipeline[name] = stream.get_pipeline_stats()
+        if rate:
+            stats['rate_control'] = rate
+        if pipeline:
+            stats['pipeline'] = pipeline
+        return stats
+    
+    def print_stats(self, conn=None):
+        """
+        显示会话吞吐统计
+        
+        Args:
+            conn: 统计哪条连接, 默认为当前连接
+        """
+        stats = self.get_stats(conn)
+        print(f"  会话时长: {stats['duration']:.1f}秒")
+        print(f"  发送: {format_file_size(stats['bytes_sent'])} / {stats['messages_sent']}条 "
+              f"({format_file_size(stats['send_rate'])}/s)")
+        print(f"  接收: {format_file_size(stats['bytes_received'])} / {stats['messages_received']}条 "
+              f"({format_file_size(stats['receive_rate'])}/s)")
+        if stats['rtt_ms'] is not None:
+            print(f"  往返时延: {stats['rtt_ms']:.1f}ms (抖动 {stats['rtt_var_ms']:.1f}ms, "
+                  f"最小 {stats['min_rtt_ms']:.1f}ms)")
+        for name, pipeline in stats.get('pipeline', {}).items():
+            stages = [f"{stage} {pipeline[stage]['utilization'] * 100:.0f}% "
+                      f"({pipeline[stage]['avg_ms']:.1f}ms, 丢弃 {pipeline[stage]['dropped']})"
+                      for stage in ('capture', 'encode', 'send') if stage in pipeline]
+            print(f"  {name} 流水线: {' / '.join(stages)}")
+        print()
     
     def authenticate_client(self):
         """
@@ -166,173 +295,168 @@ class RemoteControlServer:
         """
         try:
             # 接收身份验证消息
-            message = receive_message(self.client_socket)
-            
+            message = self.conn.read_message()
+            return self.check_auth_message(message)
+        
+        except Exception as e:
+            print(f"{Colors.RED}✗ 身份验证错误: {e}{Colors. RESET}")
+            return False
+    
+    def check_auth_message(self, message):
+        """
+        校验身份验证消息并发送验证结果
+        
+        Args:
+            message: 收到的第一条消息 (连接断开为 None)
+        
+        Returns:
+            bool: 验证是否成功
+        """
+        with replying_to(message or {}):
             if message is None or message['type'] != MessageType.AUTH:
                 response = create_auth_response(False, "无效的验证请求")
-                send_message(self.client_socket, response)
+                self.conn.send(response)
                 return False
             
             # 验证密码哈希
             password_hash = message['data']. get('password_hash', '')
             
             if password_hash == AUTH_PASSWORD_HASH:
-                response = create_auth_response(True, "验证成功")
-                send_message(self.client_socket, response)
+                registry = self.server.resume_registry
+                
+                # 带有效恢复令牌: 原会话接管本连接
+                resume_token = message['data'].get('resume_token')
+                if resume_token:
+                    self.resumed = registry.claim(resume_token, self.conn)
+                if self.resumed:
+                    response = create_auth_response(True, "会话已恢复", self.resumed.resume_token, resumed=True)
+                else:
+                    response = create_auth_response(True, "验证成功", registry.issue(self))
+                self.conn.send(response)
                 return True
             else:
                 response = create_auth_response(False, "密码错误")
-                send_message(self.client_socket, response)
+                self.conn.send(response)
                 return False
+    
+    def dispatch_message(self, message):
+        """
+        处理一条请求, 其间创建的响应都带上请求ID
         
-        except Exception as e:
-            print(f"{Colors.RED}✗ 身份验证错误: {e}{Colors. RESET}")
-            return False
+        Args:
+            message: 消息字典
+        """
+        with replying_to(message):
+            self.handle_message(message)
     
     def handle_message(self, message):
         """
-        处理接收到的消息
+        处理接收到的消息: 按消息类型查分发表, 取出声明的参数 (按类型检查, 无效时回复 ERROR)
+        后调用处理函数, 并记录耗时与收发字节数
         
         Args:
             message: 消息字典
         """
         msg_type = message['type']
-        data = message['data']
+        handler = get_handler(msg_type)
         
-        print(f"{Colors.MAGENTA}◄ 收到请求: {msg_type}{Colors.RESET}")
+        if handler is None:
+            print(f"{Colors.MAGENTA}◄ 收到请求: {msg_type}{Colors.RESET}")
+            error_msg = create_error_message(f"未知的消息类型: {msg_type}")
+            self.conn.send(error_msg)
+            return
         
-        # 根据消息类型调用相应的处理函数
-        if msg_type == MessageType.SCREENSHOT:
-            self.handle_screenshot()
+        if handler.log:
+            print(f"{Colors.MAGENTA}◄ 收到请求: {msg_type}{Colors.RESET}")
         
-        elif msg_type == MessageType.CAMERA:
-            self.handle_camera()
+        try:
+            kwargs = handler.build_arguments(message)
+        except ValueError as e:
+            # 参数不符合声明的类型: 不调用处理函数, 统一回复错误 (与请求在同一通道)
+            print(f"  {Colors.RED}✗ 请求参数无效 ({msg_type}): {e}{Colors.RESET}")
+            self.conn.send(create_error_message(f"参数无效: {e}", channel=get_message_channel(message)))
+            return
         
-        elif msg_type == MessageType.VIDEO_START:
-            width = data.get('width', 640)
-            height = data.get('height', 480)
-            fps = data.get('fps', 30)
-            quality = data.get('quality', 85)
-            self.handle_video_start(width, height, fps, quality)
-
-        elif msg_type == MessageType.SCREEN_START:
-            region = data.get('region', None)
-            fps = data.get('fps', 10)
-            quality = data.get('quality', 70)
-            self.handle_screen_start(region, fps, quality)
-
-        elif msg_type == MessageType.SCREEN_STOP:
-            self.handle_screen_stop()
-        
-        elif msg_type == MessageType.VIDEO_STOP:
-            self.handle_video_stop()
-        
-        elif msg_type == MessageType.RECORD_START:
-            filename = data.get('filename', None)
-            self.handle_record_start(filename)
-        
-        elif msg_type == MessageType.RECORD_STOP:
-            self.handle_record_stop()
-        
-        elif msg_type == MessageType.FILE_DOWNLOAD:
-            filepath = data.get('filepath', '')
-            self.handle_file_download(filepath)
-        
-        elif msg_type == MessageType.FILE_UPLOAD:
-            filepath = data.get('filepath', '')
-            filename = data.get('filename', '')
-            self.handle_file_upload(filepath, filename)
-        
-        elif msg_type == MessageType.FILE_EXECUTE:
-            filepath = data.get('filepath', '')
-            args = data.get('args', '')
-            self.handle_file_execute(filepath, args)
-        
-        elif msg_type == MessageType.MIC_RECORD:
-            # 录制来自服务器主机的麦克风并返回 WAV 音频数据
-            duration = data.get('duration', 5)
-            samplerate = data.get('samplerate', 44100)
-            channels = data.get('channels', 1)
-            self.handle_mic_record(duration, samplerate, channels)
-        
-        elif msg_type == MessageType.REGISTRY_QUERY:
-            hive = data.get('hive', '')
-            key_path = data.get('key_path', '')
-            name = data.get('name', None)
-            self.handle_registry_query(hive, key_path, name)
-        
-        elif msg_type == MessageType.REGISTRY_SET:
-            hive = data.get('hive', '')
-            key_path = data.get('key_path', '')
-            name = data.get('name', '')
-            value = data.get('value', '')
-            value_type = data.get('value_type', 'REG_SZ')
-            self.handle_registry_set(hive, key_path, name, value, value_type)
-        
-        elif msg_type == MessageType.REGISTRY_DELETE:
-            hive = data.get('hive', '')
-            key_path = data.get('key_path', '')
-            name = data.get('name', None)
-            self.handle_registry_delete(hive, key_path, name)
-        
-        elif msg_type == MessageType.SYSTEM_INFO:
-            self.handle_system_info()
-        
-        elif msg_type == MessageType.SHELL:
-            command = data.get('command', '')
-            working_dir = data.get('working_dir', None)
-            self.handle_shell(command, working_dir)
-
-        elif msg_type == MessageType.MOUSE_EVENT:
-            # 处理鼠标事件
-            event = data.get('event')
-            x = data.get('x')
-            y = data.get('y')
-            button = data.get('button', 'left')
-            clicks = data.get('clicks', 1)
-            dx = data.get('dx', 0)
-            dy = data.get('dy', 0)
-            self.handle_mouse_event(event, x, y, button, clicks, dx, dy)
-        
-        elif msg_type == MessageType.KEYBOARD_MONITOR_START:
-            # 开始键盘监控
-            self.handle_keyboard_monitor_start()
-        
-        elif msg_type == MessageType.KEYBOARD_MONITOR_STOP:
-            # 停止键盘监控
-            self.handle_keyboard_monitor_stop()
-        
-        elif msg_type == MessageType.SHELL_EXIT:
-            print(f"{Colors.YELLOW}► 客户端退出Shell模式{Colors.RESET}")
-            self.shell_mode = False
-            self.shell_working_dir = self.shell_root_dir  # 重置到根目录
-        
-        elif msg_type == MessageType.DISCONNECT:
-            print(f"{Colors.YELLOW}► 客户端请求断开连接{Colors.RESET}")
-            self.is_authenticated = False
+        func = getattr(self, handler.name)
+        bytes_in = message.get('wire_size', 0)
         
+        if handler.blocking:
+            # 阻塞操作放到后台线程, 响应完成后再发回; 同一会话同一通道的请求仍按顺序执行
+            self.server.handler_pool.submit((self, get_message_channel(message)),
+                                            self.server.metrics.track, handler.name, func,
+                                            bytes_in=bytes_in, **kwargs)
         else:
-            error_msg = create_error_message(f"未知的消息类型: {msg_type}")
-            send_message(self.client_socket, error_msg)
+            self.server.metrics.track(handler.name, func, bytes_in=bytes_in, **kwargs)
+    
+    @message_handler(MessageType.SHELL_EXIT, blocking=True)
+    def handle_shell_exit(self):
+        """处理退出Shell模式"""
+        print(f"{Colors.YELLOW}► 客户端退出Shell模式{Colors.RESET}")
+        self.shell_mode = False
+        self.shell_working_dir = self.shell_root_dir  # 重置到根目录
+    
+    @message_handler(MessageType.DISCONNECT)
+    def handle_disconnect(self):
+        """处理断开连接请求"""
+        print(f"{Colors.YELLOW}► 客户端请求断开连接{Colors.RESET}")
+        self.is_authenticated = False
     
-    def handle_screenshot(self):
+    @message_handler(MessageType.HEARTBEAT, log=False, seq=(int, 0), sent_at=(float, 0.0))
+    def handle_heartbeat(self, seq, sent_at):
+        """回复客户端的心跳"""
+        self.heartbeat.acknowledge(seq, sent_at)
+    
+    @message_handler(MessageType.HEARTBEAT_ACK, log=False, seq=(int, 0), sent_at=(float, None))
+    def handle_heartbeat_ack(self, seq, sent_at):
+        """客户端回复了服务器的心跳: 更新往返时延"""
+        self.heartbeat.on_ack(seq, sent_at)
+    
+    @message_handler(MessageType.METRICS, log=False, dump=(bool, False))
+    def handle_metrics(self, dump=False):
+        """
+        处理性能统计请求
+        
+        Args:
+            dump: 是否同时写入统计文件 (METRICS_FILE)
+        """
+        try:
+            data = self.server.metrics.snapshot()
+            data['sessions'] = self.server.get_session_stats()
+            data['screen_captures'] = get_hub_stats()
+            data['image_encoder'] = get_encoder_info()
+            
+            if dump:
+                success, result = self.server.dump_metrics()
+                if not success:
+                    raise Exception(result)
+                data['file'] = result
+            
+            response = create_message(MessageType.METRICS_RESPONSE, dict(data, success=True))
+            self.conn.send(response)
+        
+        except Exception as e:
+            response = create_message(MessageType.METRICS_RESPONSE, {
+                'success': False,
+                'error': str(e)
+            })
+            self.conn.send(response)
+    
+    @message_handler(MessageType.SCREENSHOT, blocking=True, monitor=(int, 1))
+    def handle_screenshot(self, monitor=1):
         """处理截图请求"""
         try:
             print(f"  {Colors.CYAN}正在截取屏幕... {Colors.RESET}")
             
             # 使用 mss 截取屏幕
             with mss.mss() as sct:
-                # 截取主显示器
-                monitor = sct.monitors[1]
-                screenshot = sct.grab(monitor)
-                
-                # 转换为 PIL Image
-                img = Image.frombytes('RGB', screenshot.size, screenshot. rgb)
+                # 截取指定的显示器 (默认主显示器)
+                monitor = int(monitor)
+                if not 0 <= monitor < len(sct.monitors):
+                    raise Exception(f"显示器不存在: {monitor}")
+                screenshot = sct.grab(capture_area(sct.monitors, monitor))
                 
-                # 压缩图片
-                output = io.BytesIO()
-                img.save(output, format='JPEG', quality=85, optimize=True)
-                img_data = output.getvalue()
+                # 直接编码 BGRA 原始数据
+                img_data = encode_jpeg(bgra_view(screenshot), 85, PIXEL_BGRA)
             
             print(f"  {Colors.GREEN}✓ 截图成功 (大小: {format_file_size(len(img_data))}){Colors.RESET}")
             
@@ -341,8 +465,7 @@ class RemoteControlServer:
                 'success': True,
                 'size': len(img_data)
             })
-            send_message(self.client_socket, response)
-            send_binary_data(self.client_socket, img_data)
+            self.conn.send(response, payload=img_data)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 截图失败: {e}{Colors.RESET}")
@@ -350,8 +473,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.CAMERA, blocking=True)
     def handle_camera(self):
         """处理摄像头拍照请求"""
         try:
@@ -393,11 +517,7 @@ class RemoteControlServer:
             cv2.imwrite(filepath, frame)
             
             # 转换为JPEG格式的字节流
-            success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            if not success:
-                raise Exception("图像编码失败")
-            
-            img_data = buffer.tobytes()
+            img_data = encode_jpeg(frame, 85, PIXEL_BGR)
             
             print(f"  {Colors.GREEN}✓ 摄像头拍照成功 (大小: {format_file_size(len(img_data))}, 已保存: {filename}){Colors.RESET}")
             
@@ -407,8 +527,7 @@ class RemoteControlServer:
                 'size': len(img_data),
                 'filename': filename
             })
-            send_message(self.client_socket, response)
-            send_binary_data(self.client_socket, img_data)
+            self.conn.send(response, payload=img_data)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 摄像头拍照失败: {e}{Colors.RESET}")
@@ -416,9 +535,11 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
-    def handle_video_start(self, width, height, fps, quality):
+    @message_handler(MessageType.VIDEO_START, blocking=True, width=(int, 640), height=(int, 480), fps=(int, 30),
+                     quality=(int, 85), adaptive=(bool, False), trace=(bool, False))
+    def handle_video_start(self, width, height, fps, quality, adaptive=False, trace=False):
         """处理开始视频流请求"""
         try:
             # 检查视频支持
@@ -431,7 +552,7 @@ class RemoteControlServer:
             print(f"  {Colors.CYAN}正在启动视频流 ({width}x{height} @ {fps}fps)...{Colors.RESET}")
             
             # 创建视频流
-            self.video_stream = VideoStream(camera_index=0, width=width, height=height, fps=fps)
+            self.video_stream = VideoStream(camera_index=0, width=width, height=height, fps=fps, quality=quality)
             success, msg = self.video_stream.start()
             
             if not success:
@@ -442,24 +563,27 @@ class RemoteControlServer:
             print(f"  {Colors.GREEN}✓ 视频流启动成功{Colors.RESET}")
             
             # 发送成功响应
+            stream = self.video_stream
+            if adaptive and RATE_CONTROL_ENABLED:
+                stream.rate = RateController(stream, quality, fps, max_fps=min(RATE_MAX_FPS, fps))
+            
             response = create_message(MessageType.VIDEO_START, {
                 'success': True,
-                'message': '视频流已启动'
+                'message': '视频流已启动',
+                'adaptive': stream.rate is not None
             })
-            send_message(self.client_socket, response)
-            
-            # 等待一下确保响应已被客户端接收
-            import time
-            time.sleep(0.2)
-            
-            # 开始发送视频帧
-            import threading
-            self._video_thread = threading.Thread(
-                target=self._video_stream_loop,
-                args=(quality,),
-                daemon=True
+            self.conn.send(response)
+            
+            # 开始发送视频帧 (与响应同属摄像头通道, 客户端按顺序先收到响应)
+            self._video_thread = self.start_frame_pump(
+                FrameOpcode.VIDEO_FRAME, Channel.CAMERA,
+                stream.get_timed_frame_jpeg,
+                lambda: self.video_streaming and self.is_authenticated,
+                rate=stream.rate,
+                stats=stream.send_stats,
+                trace=bool(trace),
+                source=stream.frames
             )
-            self._video_thread.start()
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 视频流启动失败: {e}{Colors.RESET}")
@@ -467,59 +591,98 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
-    def _video_stream_loop(self, quality):
-        """视频流发送循环"""
-        import time
+    def start_frame_pump(self, opcode, channel, next_frame, is_active, on_end=None, rate=None, trace=False,
+                         stats=None, source=None):
+        """
+        启动推流循环: 不断取出采集好的帧并作为二进制帧发送
         
-        frame_count = 0
-        error_count = 0
-        max_errors = 10  # 最多容忍10次连续错误
+        Args:
+            opcode: 帧操作码 (FrameOpcode)
+            channel: 发送的通道
+            next_frame: next_frame(timeout) -> (success, (capture_time, data, times)),
+                        times 为 (截屏耗时, 编码耗时) 或 None
+            is_active: is_active() -> bool, 返回 False 时循环结束
+            on_end: 循环结束后的回调 (如发送停止通知)
+            rate: 自适应码率控制器 (RateController), 每发出一帧报告一次发送情况
+            trace: 是否随帧发送各阶段耗时 (观看者请求时延追踪时)
+            stats: 发送段的统计 (StageStats), 每发出一帧记录一次发送耗时
+            source: next_frame 取帧的交接队列 (HandoffQueue / LatestFrame), 异步模式下
+                    有新帧时唤醒推流协程; 为 None 时按 STREAM_POLL_INTERVAL 轮询 next_frame
         
-        while self.video_streaming and self.is_authenticated:
-            try:
-                # 获取JPEG编码的帧
-                success, jpeg_data = self.video_stream.get_frame_jpeg(quality)
-                
+        Returns:
+            推流句柄, 交给 wait_frame_pump 等待其结束
+        """
+        thread = threading.Thread(
+            target=self._frame_pump_loop,
+            args=(opcode, channel, next_frame, is_active, on_end, rate, trace, stats),
+            daemon=True
+        )
+        thread.start()
+        return thread
+    
+    def wait_frame_pump(self, pump, timeout):
+        """
+        等待推流循环结束
+        
+        Args:
+            pump: start_frame_pump 返回的句柄
+            timeout: 最长等待时间(秒)
+        """
+        if pump is not None and pump.is_alive():
+            pump.join(timeout)
+    
+    def report_frame_sent(self, rate, size, send_time, stats=None):
+        """
+        向码率控制器报告一帧的发送情况 (附带当前往返时延)
+        
+        Args:
+            rate: RateController, 为 None 时忽略
+            size: 帧数据字节数
+            send_time: 发送耗时(秒)
+            stats: 发送段的统计 (StageStats), 为 None 时忽略
+        """
+        if stats is not None:
+            stats.record(send_time)
+        if rate is None:
+            return
+        estimator = self.heartbeat.estimator
+        rate.on_frame_sent(size, send_time, estimator.srtt, estimator.min)
+    
+    def _frame_pump_loop(self, opcode, channel, next_frame, is_active, on_end, rate, trace, stats):
+        """推流发送循环 (在独立线程中运行)"""
+        seq = 0
+        try:
+            while is_active():
+                success, result = next_frame(1.0)
                 if not success:
-                    time.sleep(0.01)
                     continue
                 
-                frame_count += 1
+                # 连接中断、等待客户端恢复会话期间丢弃帧 (采集保持运行)
+                if self.conn.closed:
+                    continue
                 
-                # 发送视频帧
-                try:
-                    response = create_message(MessageType.VIDEO_FRAME, {
-                        'size': len(jpeg_data),
-                        'timestamp': datetime.now().isoformat()
-                    })
-                    
-                    if not send_message(self.client_socket, response):
-                        raise Exception("发送消息头失败")
-                    
-                    if not send_binary_data(self.client_socket, jpeg_data):
-                        raise Exception("发送帧数据失败")
-                    
-                    # 发送成功,重置错误计数
-                    error_count = 0
-                    
-                    # 添加小延迟,避免过快发送
-                    time.sleep(0.001)
-                    
-                except Exception as send_error:
-                    error_count += 1
-                    
-                    if error_count >= max_errors:
-                        print(f"  {Colors.RED}✗ 连续错误过多,停止发送{Colors.RESET}")
-                        break
-                    
-                    time.sleep(0.1)  # 出错时等待更长时间
-            
-            except Exception as e:
-                print(f"  {Colors.RED}✗ 视频帧处理失败: {e}{Colors.RESET}")
-                break
+                capture_time, data, times = result
+                seq += 1
+                
+                # 帧头 + 数据一次写出
+                send_start = time.monotonic()
+                if not self.conn.send_frame(opcode, channel, seq, data, capture_time, times if trace else None):
+                    if self.resume_token:
+                        continue  # 连接刚中断, 会话会被保留
+                    print(f"  {Colors.RED}✗ 发送帧数据失败, 停止推流{Colors.RESET}")
+                    break
+                self.report_frame_sent(rate, len(data), time.monotonic() - send_start, stats)
+        
+        except Exception as e:
+            print(f"  {Colors.RED}✗ 推流失败: {e}{Colors.RESET}")
+        
+        finally:
+            if on_end:
+                on_end()
     
+    @message_handler(MessageType.VIDEO_STOP, blocking=True)
     def handle_video_stop(self):
         """处理停止视频流请求"""
         try:
@@ -530,13 +693,7 @@ class RemoteControlServer:
             self.video_streaming = False
             
             # 等待发送线程结束(最多等待2秒)
-            import time
-            wait_time = 0
-            while hasattr(self, '_video_thread') and self._video_thread and self._video_thread.is_alive():
-                time.sleep(0.1)
-                wait_time += 0.1
-                if wait_time > 2.0:
-                    break
+            self.wait_frame_pump(getattr(self, '_video_thread', None), 2.0)
             
             # 停止视频流
             if self.video_stream:
@@ -553,7 +710,7 @@ class RemoteControlServer:
                 'success': True,
                 'message': '视频流已停止'
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 停止视频流失败: {e}{Colors.RESET}")
@@ -561,8 +718,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.RECORD_START, blocking=True, filename=(str, None))
     def handle_record_start(self, filename):
         """处理开始录像请求(自动启动视频流)"""
         try:
@@ -574,8 +732,8 @@ class RemoteControlServer:
                 if not VIDEO_SUPPORT:
                     raise Exception("服务器不支持视频功能")
                 
-                # 创建并启动视频流(使用默认参数)
-                self.video_stream = VideoStream(camera_index=0, width=640, height=480, fps=30)
+                # 创建并启动视频流(使用默认参数, 只录像不推流)
+                self.video_stream = VideoStream(camera_index=0, width=640, height=480, fps=30, send_frames=False)
                 success, msg = self.video_stream.start()
                 
                 if not success:
@@ -609,7 +767,7 @@ class RemoteControlServer:
                 'filepath': msg,
                 'auto_started': True  # 标记视频流是自动启动的
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 开始录像失败: {e}{Colors.RESET}")
@@ -617,8 +775,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.RECORD_STOP, blocking=True)
     def handle_record_stop(self):
         """处理停止录像请求(自动关闭视频流)"""
         try:
@@ -649,7 +808,7 @@ class RemoteControlServer:
                 'message': msg,
                 'auto_stopped': True  # 标记视频流已自动关闭
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 停止录像失败: {e}{Colors.RESET}")
@@ -657,66 +816,224 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
     # ===== 屏幕实时查看 =====
-    def handle_screen_start(self, region=None, fps=10, quality=70):
+    @message_handler(MessageType.MONITOR_LIST, blocking=True)
+    def handle_monitor_list(self):
+        """枚举显示器 (观看者据此选择查看哪个显示器)"""
         try:
-            print(f"  {Colors.CYAN}正在启动屏幕实时查看...{Colors.RESET}")
-            # 创建屏幕流
-            self.screen_stream = ScreenStream(region=region, fps=fps, quality=quality)
-            success, msg = self.screen_stream.start()
+            monitors = list_monitors()
+            response = create_message(MessageType.MONITOR_LIST, {'success': True, 'monitors': monitors})
+            self.conn.send(response)
+        
+        except Exception as e:
+            response = create_message(MessageType.MONITOR_LIST, {'success': False, 'error': str(e)})
+            self.conn.send(response)
+
+    @staticmethod
+    def _screen_channel(stream):
+        """屏幕流编号对应的通道 (编号无效时为默认的屏幕通道, 用于回复错误)"""
+        try:
+            return screen_channel(int(stream or 0))
+        except (TypeError, ValueError):
+            return Channel.SCREEN
+
+    def _screen_stream_index(self, stream):
+        """检查屏幕流编号, 返回整数编号"""
+        stream = int(stream or 0)
+        if not 0 <= stream < SCREEN_MAX_STREAMS:
+            raise Exception(f"屏幕流编号无效: {stream} (最多同时 {SCREEN_MAX_STREAMS} 路)")
+        return stream
+
+    @message_handler(MessageType.SCREEN_START, blocking=True, region=(dict, None), fps=(int, 10), quality=(int, 70),
+                     monitor=(int, 1), delta=(bool, False), cache_size=(int, 0), adaptive=(bool, False),
+                     viewport=(list, None), stream=(int, 0), cursor=(bool, False), codec=(str, 'jpeg'),
+                     trace=(bool, False))
+    def handle_screen_start(self, region=None, fps=10, quality=70, monitor=1, delta=False, cache_size=0,
+                            adaptive=False, viewport=None, stream=0, cursor=False, codec='jpeg', trace=False):
+        channel = self._screen_channel(stream)
+        try:
+            # 编码格式: 本机不支持请求的格式时改用相近的格式
+            codec = negotiate_codec(codec)
+            print(f"  {Colors.CYAN}正在启动屏幕实时查看{' (分块差量)' if delta else ''} [{codec}]...{Colors.RESET}")
+            index = self._screen_stream_index(stream)
+            # 同一编号的屏幕流已在运行时先停止 (每路一个通道, 不能有两个推流循环)
+            self._stop_screen_stream(index)
+            # 块缓存容量: 不超过服务器允许的最大值, 仅差量模式使用
+            cache_size = min(max(int(cache_size or 0), 0), SCREEN_TILE_CACHE_MAX) if delta else 0
+            # 创建屏幕流 (相同显示器/区域/质量的观看者共享同一份采集与编码)
+            screen = ScreenStream(region=region, fps=fps, quality=quality, monitor=monitor,
+                                  delta=bool(delta), cache_size=cache_size, viewport=viewport, codec=codec)
+            success, msg = screen.start()
             if not success:
                 raise Exception(msg)
+            self.screen_streams[index] = screen
+            if adaptive and RATE_CONTROL_ENABLED:
+                screen.rate = RateController(screen, quality, fps)
+            # 光标单独发送 (能读取光标时)
+            cursor = bool(cursor) and read_cursor() is not None
 
             # 发送开始响应
-            response = create_message(MessageType.SCREEN_START, {'success': True, 'message': msg})
-            send_message(self.client_socket, response)
+            response = create_message(MessageType.SCREEN_START, {'success': True, 'message': msg,
+                                                                 'cache_size': cache_size,
+                                                                 'adaptive': screen.rate is not None,
+                                                                 'scale': screen.scale,
+                                                                 'monitor': screen.monitor,
+                                                                 'region': screen.get_region(),
+                                                                 'cursor': cursor,
+                                                                 'codec': screen.codec,
+                                                                 'stream': index}, channel=channel)
+            self.conn.send(response)
 
-            # 发送帧循环（在此线程中）
-            def _send_loop():
-                while getattr(self, 'screen_stream', None) and self.screen_stream.is_streaming and self.is_authenticated:
-                    success, frame = self.screen_stream.get_frame(timeout=1.0)
-                    if not success:
-                        continue
-                    # 发送帧元信息
-                    header = create_message(MessageType.SCREEN_FRAME, {'size': len(frame)})
-                    if not send_message(self.client_socket, header):
-                        break
-                    if not send_binary_data(self.client_socket, frame):
-                        break
-                # 当循环结束, 发送停止通知
+            # 发送帧循环, 自行结束时 (而不是被停止或替换时) 发送停止通知
+            def _send_stop():
+                if self.screen_streams.get(index) is not screen:
+                    return  # 已被 SCREEN_STOP 停止或被新的屏幕流替换, 由对应的响应通知观看者
                 try:
-                    stop_msg = create_message(MessageType.SCREEN_STOP, {'success': True, 'message': '屏幕流已停止'})
-                    send_message(self.client_socket, stop_msg)
+                    stop_msg = create_message(MessageType.SCREEN_STOP, {'success': True, 'message': '屏幕流已停止',
+                                                                        'stream': index}, channel=channel)
+                    self.conn.send(stop_msg)
                 except Exception:
                     pass
 
-            import threading
-            self._screen_thread = threading.Thread(target=_send_loop, daemon=True)
-            self._screen_thread.start()
+            frame_pump = self.start_frame_pump(
+                FrameOpcode.SCREEN_TILES if screen.delta else FrameOpcode.SCREEN_FRAME, channel,
+                screen.get_timed_frame,
+                lambda: screen.is_streaming and self.is_authenticated,
+                _send_stop,
+                rate=screen.rate,
+                trace=bool(trace),
+                stats=screen.send_stats,
+                source=screen.frames
+            )
+            cursor_pump = None
+            if cursor:
+                # 光标按输入频率单独推送, 与画面在同一通道 (观看者按顺序画在对应的画面上)
+                cursor_pump = self.start_frame_pump(FrameOpcode.CURSOR, channel, screen.get_timed_cursor,
+                                                    lambda: screen.is_streaming and self.is_authenticated)
+            self._screen_threads[index] = (frame_pump, cursor_pump)
 
         except Exception as e:
             print(f"  {Colors.RED}✗ 启动屏幕实时查看失败: {e}{Colors.RESET}")
-            response = create_message(MessageType.SCREEN_START, {'success': False, 'error': str(e)})
-            send_message(self.client_socket, response)
+            response = create_message(MessageType.SCREEN_START, {'success': False, 'error': str(e)}, channel=channel)
+            self.conn.send(response)
 
-    def handle_screen_stop(self):
+    def _stop_screen_stream(self, index):
+        """
+        停止一路屏幕流并等待其推流循环结束
+        
+        等推流循环结束后再回复观看者 (或在同一编号启动新的屏幕流), 通道中不会再出现旧屏幕流的帧
+        
+        Args:
+            index: 屏幕流编号
+        """
+        screen = self.screen_streams.pop(index, None)
+        if screen:
+            screen.stop()
+        for pump in self._screen_threads.pop(index, ()):
+            self.wait_frame_pump(pump, 2.0)
+
+    def _get_screen_stream(self, stream):
+        """按编号取运行中的屏幕流, 不存在则抛出异常"""
+        screen = self.screen_streams.get(self._screen_stream_index(stream))
+        if screen is None:
+            raise Exception("屏幕流未在运行")
+        return screen
+
+    @message_handler(MessageType.SCREEN_VIEWPORT, blocking=True, width=(int, None), height=(int, None), stream=(int, 0))
+    def handle_screen_viewport(self, width, height, stream=0):
+        """观看者显示区域大小变化: 按新的大小缩放画面"""
         try:
-            if getattr(self, 'screen_stream', None):
-                self.screen_stream.stop()
-                self.screen_stream = None
-            # 清理线程引用
-            if hasattr(self, '_screen_thread'):
-                self._screen_thread = None
+            screen = self._get_screen_stream(stream)
+            if not width or not height or int(width) <= 0 or int(height) <= 0:
+                raise Exception("显示区域大小无效")
+            
+            scale = screen.set_viewport(width, height)
+            response = create_message(MessageType.SCREEN_VIEWPORT, {'success': True, 'scale': scale})
+            self.conn.send(response)
+        
+        except Exception as e:
+            response = create_message(MessageType.SCREEN_VIEWPORT, {'success': False, 'error': str(e)})
+            self.conn.send(response)
+
+    @message_handler(MessageType.SCREEN_MONITOR, blocking=True, monitor=(int, 1), stream=(int, 0))
+    def handle_screen_monitor(self, monitor=1, stream=0):
+        """屏幕流切换显示器: 改为订阅新显示器的采集器, 推流循环与通道不变"""
+        channel = self._screen_channel(stream)
+        try:
+            screen = self._get_screen_stream(stream)
+            success, msg = screen.set_monitor(monitor)
+            if not success:
+                raise Exception(msg)
+            print(f"  {Colors.GREEN}✓ {msg}{Colors.RESET}")
+            
+            response = create_message(MessageType.SCREEN_MONITOR, {'success': True, 'message': msg,
+                                                                   'monitor': screen.monitor,
+                                                                   'region': screen.get_region(),
+                                                                   'scale': screen.scale}, channel=channel)
+            self.conn.send(response)
+        
+        except Exception as e:
+            print(f"  {Colors.RED}✗ 切换显示器失败: {e}{Colors.RESET}")
+            response = create_message(MessageType.SCREEN_MONITOR, {'success': False, 'error': str(e)},
+                                      channel=channel)
+            self.conn.send(response)
+
+    @message_handler(MessageType.SCREEN_UPDATE, blocking=True, region=(dict, None), fps=(int, None),
+                     quality=(int, None), scale=(float, None), stream=(int, 0), codec=(str, None))
+    def handle_screen_update(self, region=None, fps=None, quality=None, scale=None, stream=0, codec=None):
+        """修改运行中的屏幕流的区域/缩放比例/帧率/质量/编码格式 (不重启屏幕流)"""
+        channel = self._screen_channel(stream)
+        try:
+            screen = self._get_screen_stream(stream)
+            if region is not None and not isinstance(region, dict):
+                raise Exception("区域格式无效")
+            if codec is not None:
+                codec = negotiate_codec(codec)
+            success, msg = screen.update(region, fps, quality, scale, codec)
+            if not success:
+                raise Exception(msg)
+            
+            response = create_message(MessageType.SCREEN_UPDATE, {'success': True, 'message': msg,
+                                                                  'region': screen.get_region(),
+                                                                  'scale': screen.scale,
+                                                                  'fps': screen.fps,
+                                                                  'quality': screen.quality,
+                                                                  'codec': screen.codec}, channel=channel)
+            self.conn.send(response)
+        
+        except Exception as e:
+            print(f"  {Colors.RED}✗ 修改屏幕流参数失败: {e}{Colors.RESET}")
+            response = create_message(MessageType.SCREEN_UPDATE, {'success': False, 'error': str(e)},
+                                      channel=channel)
+            self.conn.send(response)
 
-            response = create_message(MessageType.SCREEN_STOP, {'success': True, 'message': '屏幕流已停止'})
-            send_message(self.client_socket, response)
+    @message_handler(MessageType.SCREEN_KEYFRAME, log=False, stream=(int, 0))
+    def handle_screen_keyframe(self, stream=0):
+        """观看者的块缓存与服务器不一致: 重置块缓存并在下一帧发送关键帧 (不发送响应)"""
+        try:
+            self._get_screen_stream(stream).request_keyframe()
         except Exception as e:
-            response = create_message(MessageType.SCREEN_STOP, {'success': False, 'error': str(e)})
-            send_message(self.client_socket, response)
+            print(f"  {Colors.RED}✗ 重新发送关键帧失败: {e}{Colors.RESET}")
 
-    def handle_mouse_event(self, event, x, y, button='left', clicks=1, dx=0, dy=0):
+    @message_handler(MessageType.SCREEN_STOP, blocking=True, stream=(int, 0))
+    def handle_screen_stop(self, stream=0):
+        channel = self._screen_channel(stream)
+        try:
+            index = self._screen_stream_index(stream)
+            self._stop_screen_stream(index)
+
+            response = create_message(MessageType.SCREEN_STOP, {'success': True, 'message': '屏幕流已停止',
+                                                                'stream': index}, channel=channel)
+            self.conn.send(response)
+        except Exception as e:
+            response = create_message(MessageType.SCREEN_STOP, {'success': False, 'error': str(e)}, channel=channel)
+            self.conn.send(response)
+
+    @message_handler(MessageType.MOUSE_EVENT, log=False, event=(str, None), x=(float, None), y=(float, None),
+                         button=(str, 'left'), clicks=(int, 1), dx=(int, 0), dy=(int, 0), stream=(int, 0))
+    def handle_mouse_event(self, event, x, y, button='left', clicks=1, dx=0, dy=0, stream=0):
         try:
             # 延迟导入 pyautogui，避免未安装时报错在模块导入阶段
             try:
@@ -724,6 +1041,11 @@ class RemoteControlServer:
             except Exception:
                 raise Exception('缺少依赖: 请安装 pyautogui')
 
+            # 坐标以该路屏幕流的画面为准: 按缩放比例和所在显示器的位置换算回桌面坐标
+            screen = self.screen_streams.get(stream)
+            if screen is not None and x is not None and y is not None:
+                x, y = screen.to_screen(x, y)
+
             if event == 'move':
                 if x is not None and y is not None:
                     pyautogui.moveTo(x, y)
@@ -740,12 +1062,13 @@ class RemoteControlServer:
                 raise ValueError('未知鼠标事件')
 
             response = create_message(MessageType.MOUSE_EVENT_RESPONSE, {'success': True})
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
         except Exception as e:
             response = create_message(MessageType.MOUSE_EVENT_RESPONSE, {'success': False, 'error': str(e)})
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
+    @message_handler(MessageType.KEYBOARD_MONITOR_START)
     def handle_keyboard_monitor_start(self):
         """开始键盘监控"""
         try:
@@ -777,7 +1100,7 @@ class RemoteControlServer:
                         event_type='press',
                         timestamp=datetime.now().isoformat()
                     )
-                    send_message(self.client_socket, msg)
+                    self.conn.send(msg)
                 except Exception as e:
                     print(f"  {Colors.RED}✗ 键盘事件处理失败: {e}{Colors.RESET}")
             
@@ -790,6 +1113,7 @@ class RemoteControlServer:
         except Exception as e:
             print(f"  {Colors.RED}✗ 启动键盘监控失败: {e}{Colors.RESET}")
     
+    @message_handler(MessageType.KEYBOARD_MONITOR_STOP)
     def handle_keyboard_monitor_stop(self):
         """停止键盘监控"""
         try:
@@ -805,6 +1129,7 @@ class RemoteControlServer:
         except Exception as e:
             print(f"  {Colors.RED}✗ 停止键盘监控失败: {e}{Colors.RESET}")
     
+    @message_handler(MessageType.FILE_DOWNLOAD, blocking=True, filepath=(str, ''))
     def handle_file_download(self, filepath):
         """
         处理文件下载请求
@@ -844,8 +1169,7 @@ class RemoteControlServer:
                 'filename': os.path.basename(filepath),
                 'size': len(file_data)
             })
-            send_message(self.client_socket, response)
-            send_binary_data(self.client_socket, file_data)
+            self.conn.send(response, payload=file_data)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 文件下载失败: {e}{Colors.RESET}")
@@ -853,15 +1177,17 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
-    def handle_file_upload(self, filepath, filename):
+    @message_handler(MessageType.FILE_UPLOAD, blocking=True, filepath=(str, ''), filename=(str, ''), file_data=PAYLOAD)
+    def handle_file_upload(self, filepath, filename, file_data):
         """
         处理文件上传请求
         
         Args:
             filepath: 远程保存路径
             filename: 文件名
+            file_data: 随消息到达的文件数据
         """
         try:
             print(f"\n{Colors.CYAN}{'='*60}{Colors.RESET}")
@@ -870,8 +1196,7 @@ class RemoteControlServer:
             print(f"  远程路径: {filepath}")
             print(f"  文件名: {filename}")
             
-            # 接收文件数据
-            file_data = receive_binary_data(self.client_socket)
+            # 文件数据随上传消息一并到达
             if file_data is None:
                 raise Exception("接收文件数据失败")
             
@@ -897,7 +1222,7 @@ class RemoteControlServer:
                 'filepath': filepath,
                 'size': len(file_data)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 文件上传失败: {e}{Colors.RESET}")
@@ -905,8 +1230,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.FILE_EXECUTE, blocking=True, filepath=(str, ''), args=(str, ''))
     def handle_file_execute(self, filepath, args=''):
         """
         处理文件执行请求
@@ -1001,7 +1327,7 @@ class RemoteControlServer:
                 'pid': pid,
                 'output': output
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 文件执行失败: {e}{Colors.RESET}")
@@ -1009,8 +1335,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.REGISTRY_QUERY, hive=(str, ''), key_path=(str, ''), name=(str, None))
     def handle_registry_query(self, hive, key_path, name=None):
         """处理注册表查询请求 (Windows only)"""
         try:
@@ -1059,7 +1386,7 @@ class RemoteControlServer:
                 'success': True,
                 'values': values
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
         except Exception as e:
             print(f"  {Colors.RED}✗ 注册表查询失败: {e}{Colors.RESET}")
@@ -1067,8 +1394,10 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
+    @message_handler(MessageType.REGISTRY_SET, hive=(str, ''), key_path=(str, ''), name=(str, ''),
+                         value=(object, ''), value_type=(str, 'REG_SZ'))
     def handle_registry_set(self, hive, key_path, name, value, value_type='REG_SZ'):
         """处理设置注册表值请求"""
         try:
@@ -1109,7 +1438,7 @@ class RemoteControlServer:
             response = create_message(MessageType.REGISTRY_RESPONSE, {
                 'success': True
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
         except Exception as e:
             print(f"  {Colors.RED}✗ 注册表设置失败: {e}{Colors.RESET}")
@@ -1117,8 +1446,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
+    @message_handler(MessageType.REGISTRY_DELETE, hive=(str, ''), key_path=(str, ''), name=(str, None))
     def handle_registry_delete(self, hive, key_path, name=None):
         """处理删除注册表值或键请求"""
         try:
@@ -1152,7 +1482,7 @@ class RemoteControlServer:
             response = create_message(MessageType.REGISTRY_RESPONSE, {
                 'success': True
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
         except Exception as e:
             print(f"  {Colors.RED}✗ 注册表删除失败: {e}{Colors.RESET}")
@@ -1160,8 +1490,10 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
 
+    @message_handler(MessageType.MIC_RECORD, blocking=True, duration=(float, 5), samplerate=(int, 44100),
+                     channels=(int, 1))
     def handle_mic_record(self, duration=5, samplerate=44100, channels=1):
         """处理麦克风录音请求: 在服务器端录音并通过二进制数据发送回客户端 (WAV)"""
         try:
@@ -1179,17 +1511,14 @@ class RemoteControlServer:
             audio_bytes = record_audio(duration=duration, samplerate=samplerate, channels=channels)
             ext = 'wav'
 
-            # 发送响应元信息
+            # 发送响应元信息及 WAV 数据
             response = create_message(MessageType.MIC_RECORD_RESPONSE, {
                 'success': True,
                 'filename': f'mic_{int(time.time())}.{ext}',
                 'size': len(audio_bytes),
                 'format': ext
             })
-            send_message(self.client_socket, response)
-
-            # 发送二进制音频数据
-            send_binary_data(self.client_socket, audio_bytes)
+            self.conn.send(response, payload=audio_bytes)
 
         except Exception as e:
             print(f"  {Colors.RED}✗ 麦克风录音失败: {e}{Colors.RESET}")
@@ -1197,8 +1526,9 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
+    @message_handler(MessageType.SHELL, blocking=True, command=(str, ''), working_dir=(str, None))
     def handle_shell(self, command, working_dir=None):
         """
         处理Shell命令请求（带白名单验证）
@@ -1222,7 +1552,7 @@ class RemoteControlServer:
                     'working_dir': self.shell_working_dir,
                     'returncode': 0
                 })
-                send_message(self.client_socket, response)
+                self.conn.send(response)
                 return
             
             # 处理cd命令（切换目录）
@@ -1268,7 +1598,7 @@ class RemoteControlServer:
                         'working_dir': self.shell_working_dir,
                         'returncode': returncode
                     })
-                    send_message(self.client_socket, response)
+                    self.conn.send(response)
                     return
                 except Exception as e:
                     output = f"cd命令失败: {e}"
@@ -1279,7 +1609,7 @@ class RemoteControlServer:
                         'working_dir': self.shell_working_dir,
                         'returncode': returncode
                     })
-                    send_message(self.client_socket, response)
+                    self.conn.send(response)
                     return
             
             # 验证命令安全性
@@ -1310,7 +1640,7 @@ class RemoteControlServer:
                 'working_dir': self.shell_working_dir,
                 'returncode': result.returncode
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except subprocess.TimeoutExpired:
             print(f"  {Colors.RED}✗ Shell命令执行超时{Colors.RESET}")
@@ -1319,7 +1649,7 @@ class RemoteControlServer:
                 'error': f'命令执行超时 (>{COMMAND_TIMEOUT}秒)',
                 'working_dir': self.shell_working_dir
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ Shell命令执行失败: {e}{Colors.RESET}")
@@ -1328,7 +1658,7 @@ class RemoteControlServer:
                 'error': str(e),
                 'working_dir': self.shell_working_dir
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
     def is_safe_shell_path(self, path):
         """
@@ -1385,6 +1715,7 @@ class RemoteControlServer:
         
         return True
     
+    @message_handler(MessageType.SYSTEM_INFO)
     def handle_system_info(self):
         """处理系统信息请求"""
         try:
@@ -1399,7 +1730,7 @@ class RemoteControlServer:
                 'success': True,
                 'info': info
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
         
         except Exception as e:
             print(f"  {Colors.RED}✗ 获取系统信息失败: {e}{Colors.RESET}")
@@ -1407,7 +1738,7 @@ class RemoteControlServer:
                 'success': False,
                 'error': str(e)
             })
-            send_message(self.client_socket, response)
+            self.conn.send(response)
     
     def display_controlled_status(self, is_controlled):
         """
@@ -1429,10 +1760,201 @@ class RemoteControlServer:
             print(f"{Colors. GREEN}{'='*60}{Colors.RESET}\n")
 
 
+class RemoteControlServer:
+    """远程控制服务器类 (负责监听连接, 每个连接交给一个 ClientSession 处理)"""
+    
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+        """
+        初始化服务器
+        
+        Args:
+            host: 服务器监听地址
+            port: 服务器监听端口
+        """
+        self.host = host
+        self.port = port
+        self.server_socket = None
+        self. is_running = False
+        self.executor = None  # 处理会话的线程池 (大小为 MAX_CONNECTIONS)
+        self.sessions = set()  # 当前活动的会话
+        self._sessions_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.metrics = MetricsRegistry()  # 各处理函数的性能统计 (所有会话共享)
+        self.handler_pool = HandlerPool(BLOCKING_HANDLER_WORKERS)  # 阻塞请求的后台线程池
+        self.resume_registry = ResumeRegistry()  # 可恢复的会话 (连接中断后保留一段时间)
+    
+    def print_banner(self):
+        """显示程序横幅"""
+        print(f"{Colors.CYAN}{Colors.BOLD}{'='*60}{Colors.RESET}")
+        print(f"{Colors.CYAN}{Colors.BOLD}{'  远程控制系统 - 服务器端 (被控主机B)':^60}{Colors.RESET}")
+        print(f"{Colors. CYAN}{Colors.BOLD}{'='*60}{Colors.RESET}")
+        print(f"{Colors.YELLOW}⚠️  注意: 本程序仅用于教育学习目的{Colors.RESET}")
+        print(f"{Colors.YELLOW}⚠️  仅在本地网络或虚拟机环境中运行{Colors.RESET}")
+        print(f"{Colors. CYAN}{'='*60}{Colors. RESET}\n")
+    
+    def print_server_info(self):
+        """显示服务器监听信息"""
+        local_ip = get_local_ip()
+        print(f"{Colors.GREEN}✓ 服务器启动成功! {Colors.RESET}")
+        print(f"  监听地址: {Colors.BOLD}{local_ip}:{self.port}{Colors.RESET}")
+        print(f"  安全目录: {Colors.BOLD}{SAFE_DIRECTORY}{Colors.RESET}")
+        print(f"  Shell类型: {Colors.BOLD}{SHELL_TYPE}{Colors.RESET} ({CURRENT_OS})")
+        print(f"  允许命令: {Colors.BOLD}{len(ALLOWED_COMMANDS)}个{Colors.RESET}")
+        print(f"\n{Colors.CYAN}等待客户端连接...{Colors.RESET}\n")
+    
+    def start(self):
+        """启动服务器"""
+        self.print_banner()
+        try:
+            # 创建服务器套接字
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket. setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((self.host, self.port))
+            self. server_socket.listen(MAX_CONNECTIONS)
+            
+            self.is_running = True
+            self.executor = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS,
+                                               thread_name_prefix='session')
+            
+            # 显示服务器信息
+            self.print_server_info()
+            
+            # 接受连接循环
+            while self.is_running:
+                try:
+                    client_socket, client_address = self.server_socket.accept()
+                    print(f"\n{Colors. BLUE}► 收到连接请求: {client_address[0]}:{client_address[1]}{Colors.RESET}")
+                    
+                    # 连接数已满则拒绝, 否则交给线程池处理
+                    if not self._slots.acquire(blocking=False):
+                        print(f"{Colors.YELLOW}✗ 连接数已达上限 ({MAX_CONNECTIONS}), 拒绝: {client_address[0]}{Colors.RESET}")
+                        threading.Thread(target=self.reject_client, args=(client_socket,),
+                                         daemon=True).start()
+                        continue
+                    
+                    self.executor.submit(self._serve_client, client_socket, client_address)
+                    
+                except KeyboardInterrupt:
+                    print(f"\n{Colors. YELLOW}接收到中断信号, 正在关闭服务器...{Colors.RESET}")
+                    break
+                except Exception as e:
+                    print(f"{Colors.RED}✗ 接受连接失败: {e}{Colors. RESET}")
+        
+        except Exception as e:
+            print(f"{Colors.RED}✗ 服务器启动失败: {e}{Colors.RESET}")
+        
+        finally:
+            self.stop()
+    
+    def stop(self):
+        """停止服务器"""
+        self.is_running = False
+        if self.server_socket:
+            self.server_socket.close()
+        
+        # 关闭仍在进行的会话, 让线程池中的会话线程退出
+        with self._sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.conn.close()
+        self.resume_registry.close()
+        
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.handler_pool.shutdown()
+        if self.metrics.snapshot()['handlers']:
+            success, result = self.dump_metrics()
+            if success:
+                print(f"  性能统计已保存: {result}")
+        print(f"\n{Colors.GREEN}✓ 服务器已关闭{Colors.RESET}")
+    
+    def _serve_client(self, client_socket, client_address):
+        """线程池任务: 处理一个连接并归还连接名额"""
+        try:
+            self.handle_client(client_socket, client_address)
+        finally:
+            self._slots.release()
+    
+    def reject_client(self, client_socket):
+        """
+        拒绝超出连接上限的客户端 (回复其身份验证请求后断开)
+        
+        Args:
+            client_socket: 客户端套接字
+        """
+        conn = MuxConnection(client_socket)
+        try:
+            client_socket.settimeout(5)
+            message = conn.read_message()
+            with replying_to(message or {}):
+                conn.send(create_auth_response(False, f"服务器连接数已达上限 ({MAX_CONNECTIONS})"))
+        except Exception:
+            pass
+        finally:
+            conn.close()
+    
+    def create_session(self, conn, client_address):
+        """
+        为新连接创建会话对象
+        
+        Args:
+            conn: 多路复用连接
+            client_address: 客户端地址
+        
+        Returns:
+            ClientSession: 会话对象
+        """
+        return ClientSession(self, conn, client_address)
+    
+    def handle_client(self, client_socket, client_address):
+        """
+        处理客户端连接
+        
+        Args:
+            client_socket: 客户端套接字
+            client_address: 客户端地址
+        """
+        session = self.create_session(MuxConnection(client_socket), client_address)
+        with self._sessions_lock:
+            self.sessions.add(session)
+        try:
+            session.run()
+        finally:
+            with self._sessions_lock:
+                self.sessions.discard(session)
+    
+    def dump_metrics(self, filepath=METRICS_FILE):
+        """
+        把性能统计 (含各会话吞吐) 写入文件
+        
+        Args:
+            filepath: 输出文件路径
+        
+        Returns:
+            tuple: (success, filepath 或 错误信息)
+        """
+        return self.metrics.dump(filepath, {'sessions': self.get_session_stats()})
+    
+    def get_session_stats(self):
+        """
+        获取所有活动会话的吞吐统计
+        
+        Returns:
+            list: 每个会话一个统计字典 (见 ClientSession.get_stats)
+        """
+        with self._sessions_lock:
+            sessions = list(self.sessions)
+        return [session.get_stats() for session in sessions]
+
+
 def main():
     """主函数"""
-    # 创建并启动服务器
-    server = RemoteControlServer()
+    # 创建并启动服务器 (--async 使用基于 asyncio 的服务器)
+    if '--async' in sys.argv[1:]:
+        from async_server import AsyncRemoteControlServer
+        server = AsyncRemoteControlServer()
+    else:
+        server = RemoteControlServer()
     
     try:
         server.start()
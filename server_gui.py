@@ -152,9 +152,6 @@ class GuiRemoteServer(RemoteControlServer):
 
     def handle_client(self, client_socket, client_address):
         """重写处理客户端连接的方法，加入GUI交互"""
-        self.client_socket = client_socket
-        self.client_address = client_address
-
         # 1. 在主线程中请求权限
         allow = self.ui.request_permission(client_address)
 
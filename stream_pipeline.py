@@ -0,0 +1,464 @@
+"""
+流水线模块 - 远程控制系统
+屏幕流与摄像头流共用的 "采集 → 编码 → 发送" 三段流水线
+
+各段在各自的线程中运行, 段与段之间用单槽的最新帧交换 (LatestFrame, 新帧覆盖未取走的旧帧)
+或有界的交接队列 (HandoffQueue, 满了丢弃 / 合并最旧的项) 相连, 上游从不等待下游:
+哪一段是瓶颈, 哪一段就满负荷运行, 其余各段跳帧而不是停下来等它。
+    采集  按帧率截屏 / 读取摄像头 → 原始帧 (只保留最新的一帧)
+    编码  编码 (大画面在 image_encoder 的编码池中并行) → 交给各观看者的发送队列
+    发送  推流循环 (ClientSession.start_frame_pump) 从发送队列取帧写出
+每段有利用率统计 (StageStats): 处理的帧数、丢弃的帧数、平均耗时与忙碌时间占比。
+摄像头帧读入预分配的缓冲区 (FrameRing), 不为每帧分配新数组, 内存占用恒定。
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+# 交接队列满时的处理方式
+DROP_OLDEST = 'drop_oldest'    # 丢弃最旧的一项
+MERGE_OLDEST = 'merge_oldest'  # 把最旧的两项合并为一项 (差量帧不能丢, 只能合并)
+
+
+class StageStats:
+    """一段流水线的统计 (线程安全)"""
+
+    def __init__(self, name):
+        """
+        Args:
+            name: 段名 (capture / encode / send)
+        """
+        self.name = name
+        self.items = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        """
+        记录处理了一项
+
+        Args:
+            elapsed: 处理耗时(秒)
+        """
+        with self._lock:
+            self.items += 1
+            self.busy += elapsed
+
+    def drop(self):
+        """记录丢弃 (或合并掉) 了一项"""
+        with self._lock:
+            self.dropped += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {items, dropped, avg_ms, utilization (忙碌时间占比 0-1)}
+        """
+        with self._lock:
+            items, dropped, busy = self.items, self.dropped, self.busy
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            'items': items,
+            'dropped': dropped,
+            'avg_ms': round(busy / items * 1000, 2) if items else 0.0,
+            'utilization': round(min(busy / elapsed, 1.0), 3)
+        }
+
+
+class _Listeners:
+    """
+    有新项 (或关闭) 时通知的回调, 供不能在条件变量上等待的消费者 (如事件循环中的推流协程) 使用
+
+    回调在放入方的线程中、锁外调用, 必须很快返回 (如 loop.call_soon_threadsafe)。
+    """
+
+    def __init__(self):
+        self._listeners = ()
+
+    def listen(self, callback):
+        """注册回调 callback(), 之后每次放入新项或关闭时调用"""
+        self._listeners = self._listeners + (callback,)
+
+    def unlisten(self, callback):
+        """注销 listen() 注册的回调"""
+        self._listeners = tuple(c for c in self._listeners if c is not callback)
+
+    def _notify_listeners(self):
+        for callback in self._listeners:
+            callback()
+
+
+class HandoffQueue(_Listeners):
+    """
+    有界交接队列: 放入从不阻塞, 满了按丢弃策略腾出位置; 取出可等待
+
+    丢弃的项计入 stats (下游段) 的 dropped。
+    设置 min_interval 时两次取出至少间隔这么久 (按下游的帧率发送), 期间到达的项可用
+    put_merged() 合并到待取出的最新一项中。
+    """
+
+    def __init__(self, maxsize, policy=DROP_OLDEST, merge=None, stats=None, min_interval=None):
+        """
+        Args:
+            maxsize: 队列长度 (MERGE_OLDEST 至少为 2)
+            policy: 队列满时的处理方式 (DROP_OLDEST / MERGE_OLDEST)
+            merge: merge(older, newer) -> 合并后的一项 (MERGE_OLDEST 与 put_merged 使用)
+            stats: 记录丢弃数的 StageStats, 可为 None
+            min_interval: min_interval() -> 两次取出的最短间隔(秒), None 表示不限制
+        """
+        super().__init__()
+        self.maxsize = max(maxsize, 2) if policy == MERGE_OLDEST else max(maxsize, 1)
+        self.policy = policy
+        self.merge = merge
+        self.stats = stats
+        self.min_interval = min_interval
+        self.dropped = 0
+        self._last_get = 0.0  # 上次取出的时间 (time.monotonic())
+        self._items = collections.deque()
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """放入一项, 队列满时先按丢弃策略腾出位置"""
+        with self._ready:
+            if len(self._items) >= self.maxsize:
+                oldest = self._items.popleft()
+                if self.policy == MERGE_OLDEST:
+                    self._items.appendleft(self.merge(oldest, self._items.popleft()))
+                self.dropped += 1
+                if self.stats is not None:
+                    self.stats.drop()
+            self._items.append(item)
+            self._ready.notify()
+        self._notify_listeners()
+
+    def put_merged(self, item):
+        """放入一项, 与待取出的最新一项合并 (不计为丢弃); 队列为空时直接放入"""
+        with self._ready:
+            if self._items:
+                self._items[-1] = self.merge(self._items[-1], item)
+            else:
+                self._items.append(item)
+                self._ready.notify()
+        self._notify_listeners()
+
+    def ready_in(self):
+        """
+        Returns:
+            float: 还要多久才能取出下一项 (秒, 0 表示现在就可以); 队列为空时返回 None
+        """
+        with self._ready:
+            return self._ready_in(time.monotonic())
+
+    def _ready_in(self, now):
+        if not self._items:
+            return None
+        if self.min_interval is None:
+            return 0.0
+        return max(self._last_get + self.min_interval() - now, 0.0)
+
+    def get(self, timeout=1.0):
+        """
+        取出最旧的一项 (设置了 min_interval 时等到距上次取出足够久)
+
+        Args:
+            timeout: 最长等待时间(秒), 0 表示不等待
+
+        Returns:
+            队列中的一项; 超时或队列已关闭时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while True:
+                now = time.monotonic()
+                wait = self._ready_in(now)
+                if wait == 0.0 or self._closed or now >= deadline:
+                    break
+                self._ready.wait(deadline - now if wait is None else min(wait, deadline - now))
+            if self._ready_in(time.monotonic()) != 0.0:
+                return None
+            self._last_get = time.monotonic()
+            return self._items.popleft()
+
+    def clear(self):
+        """清空队列 (不计为丢弃)"""
+        with self._ready:
+            self._items.clear()
+
+    def close(self):
+        """清空队列并唤醒等待中的 get(), 之后 get() 不再等待"""
+        with self._ready:
+            self._closed = True
+            self._items.clear()
+            self._ready.notify_all()
+        self._notify_listeners()
+
+    def open(self):
+        """重新启用已关闭的队列"""
+        with self._ready:
+            self._closed = False
+
+
+class LatestFrame(_Listeners):
+    """
+    单槽的最新帧交换: 放入的帧覆盖旧帧并递增序号, 读取方总是拿到最新的一帧
+
+    取帧方 (get, 单个消费者) 没来得及取走就被覆盖的帧计入 stats (下游段) 的 dropped;
+    其他读取方 (wait, 如实时预览) 按序号等待比自己看过的更新的帧, 不影响取帧方。
+    接口与 HandoffQueue 相同, 可互换使用。
+    """
+
+    def __init__(self, stats=None):
+        """
+        Args:
+            stats: 记录丢弃数的 StageStats, 可为 None
+        """
+        super().__init__()
+        self.stats = stats
+        self.seq = 0  # 最新一帧的序号 (放入的帧数)
+        self.dropped = 0
+        self._item = None
+        self._taken_seq = 0  # 取帧方取走的最后一帧的序号
+        self._taken = None  # 取帧方取走的最后一帧 (下次取帧前可能仍在使用)
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return 1 if self._item is not None and self.seq > self._taken_seq else 0
+
+    def put(self, item):
+        """放入一帧, 覆盖未被取走的旧帧"""
+        with self._ready:
+            if self._item is not None and self.seq > self._taken_seq:
+                self.dropped += 1
+                if self.stats is not None:
+                    self.stats.drop()
+            self._item = item
+            self.seq += 1
+            self._ready.notify_all()
+        self._notify_listeners()
+
+    def ready_in(self):
+        """
+        Returns:
+            float: 有还没取走的帧时返回 0 (现在就可以取); 没有时返回 None
+        """
+        return 0.0 if len(self) else None
+
+    def get(self, timeout=1.0):
+        """
+        取走最新的一帧 (单个消费者)
+
+        Args:
+            timeout: 最长等待时间(秒), 0 表示不等待
+
+        Returns:
+            还没取过的最新一帧; 超时或已关闭时返回 None
+        """
+        with self._ready:
+            if self.seq <= self._taken_seq and not self._closed and timeout > 0:
+                self._ready.wait(timeout)
+            if self._item is None or self.seq <= self._taken_seq:
+                return None
+            self._taken_seq, self._taken = self.seq, self._item
+            return self._item
+
+    def wait(self, after, timeout=1.0, read=None):
+        """
+        等待比序号 after 更新的帧 (不取走, 可有多个读取方)
+
+        Args:
+            after: 读取方看过的最后一帧的序号
+            timeout: 最长等待时间(秒)
+            read: read(帧) -> 结果, 在锁内调用 (如复制缓冲区, 期间不会被新帧覆盖)
+
+        Returns:
+            tuple: (序号, 帧 或 read 的结果); 超时或已关闭时返回 None
+        """
+        with self._ready:
+            self._ready.wait_for(lambda: self.seq > after or self._closed, timeout)
+            if self._item is None or self.seq <= after:
+                return None
+            return self.seq, (read(self._item) if read else self._item)
+
+    def held(self):
+        """
+        Returns:
+            list: 仍可能被读取的帧: 最新一帧与取帧方正在处理的一帧 (其缓冲区不能被覆盖)
+        """
+        with self._ready:
+            return [item for item in (self._item, self._taken) if item is not None]
+
+    def clear(self):
+        """丢弃未取走的帧 (不计为丢弃)"""
+        with self._ready:
+            self._item = self._taken = None
+            self._taken_seq = self.seq
+
+    def close(self):
+        """清空并唤醒等待中的读取方, 之后 get() 不再等待"""
+        with self._ready:
+            self._closed = True
+            self._item = self._taken = None
+            self._taken_seq = self.seq
+            self._ready.notify_all()
+        self._notify_listeners()
+
+    def open(self):
+        """重新启用已关闭的交换"""
+        with self._ready:
+            self._closed = False
+
+
+class FrameRing:
+    """
+    预分配的一组帧缓冲区, 轮流交给采集段原地写入 (如 cv2.VideoCapture.read(image)),
+    不为每帧分配新数组; 仍被下游引用的缓冲区 (见 LatestFrame.held) 会被跳过
+    """
+
+    def __init__(self, count, shape, dtype=np.uint8):
+        """
+        Args:
+            count: 缓冲区个数, 须多于同时被引用的帧数
+            shape: 帧的形状 (高, 宽, 通道)
+            dtype: 像素类型
+        """
+        self.shape = tuple(shape)
+        self.buffers = [np.empty(self.shape, dtype) for _ in range(count)]
+        self._next = 0
+
+    def next(self, held=()):
+        """
+        取下一个可写入的缓冲区
+
+        Args:
+            held: 仍在使用的帧, 其缓冲区不能被覆盖
+
+        Returns:
+            numpy.ndarray: 缓冲区; 都在使用时返回 None (调用方自行分配)
+        """
+        for _ in range(len(self.buffers)):
+            buffer = self.buffers[self._next]
+            self._next = (self._next + 1) % len(self.buffers)
+            if not any(frame is buffer for frame in held):
+                return buffer
+        return None
+
+
+class CapturePipeline:
+    """
+    采集与编码两段流水线 (发送段由订阅者的推流循环负责)
+
+    采集线程按 frame_interval() 调用 grab(), 原始帧放入最新帧交换 (未编码的旧帧被覆盖);
+    编码线程取出最新的帧调用 encode(), 把 (采集时间, 编码结果, (采集耗时, 编码耗时))
+    交给 deliver() (放入各订阅者的发送队列)。采集不等编码, 编码不等发送。
+    """
+
+    def __init__(self, open_source, encode, deliver, frame_interval, name='stream'):
+        """
+        Args:
+            open_source: 在采集线程中调用, 返回上下文管理器, 其值为 grab() -> 原始帧 (None 表示本次跳过);
+                         截屏等资源须在使用它的线程中创建
+            encode: encode(原始帧) -> 编码结果 (None 表示没有需要发送的内容, 如画面没有变化)
+            deliver: deliver((采集时间, 编码结果, (采集耗时, 编码耗时))) 交给发送段
+            frame_interval: frame_interval() -> 采集间隔(秒), 随订阅者的帧率变化
+            name: 线程名前缀
+        """
+        self.open_source = open_source
+        self.encode = encode
+        self.deliver = deliver
+        self.frame_interval = frame_interval
+        self.name = name
+        self.capture_stats = StageStats('capture')
+        self.encode_stats = StageStats('encode')
+        self.raw_frames = LatestFrame(stats=self.encode_stats)  # (采集时间, 原始帧, 采集耗时)
+        self.running = False
+        self._threads = []
+
+    def start(self):
+        """启动采集与编码线程"""
+        if self.running:
+            return
+        self.running = True
+        self.raw_frames.open()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name=f'{self.name}-capture', daemon=True),
+            threading.Thread(target=self._encode_loop, name=f'{self.name}-encode', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """通知两个线程退出 (不等待, 见 join)"""
+        self.running = False
+        self.raw_frames.close()
+
+    def join(self, timeout=None):
+        """等待线程退出"""
+        for thread in self._threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: {capture, encode}: 各段的 StageStats 摘要, 另有待编码的原始帧数 (0 或 1)
+        """
+        return {
+            'capture': self.capture_stats.snapshot(),
+            'encode': self.encode_stats.snapshot(),
+            'raw_queue': len(self.raw_frames)
+        }
+
+    def _capture_loop(self):
+        try:
+            with self.open_source() as grab:
+                while self.running:
+                    start = time.time()
+                    try:
+                        raw = grab()
+                        grab_time = time.time() - start
+                        self.capture_stats.record(grab_time)  # 抽掉的帧也计入采集段
+                        if raw is not None:
+                            self.raw_frames.put((start, raw, grab_time))
+                    except Exception as e:
+                        # 单帧失败不影响后续采集
+                        print(f"[{self.name}] 采集失败: {e}")
+                        time.sleep(0.1)
+
+                    to_sleep = self.frame_interval() - (time.time() - start)
+                    if to_sleep > 0:
+                        time.sleep(to_sleep)
+        except Exception as e:
+            print(f"[{self.name}] 无法开始采集: {e}")
+        finally:
+            self.running = False
+            self.raw_frames.close()
+
+    def _encode_loop(self):
+        while self.running:
+            item = self.raw_frames.get(1.0)
+            if item is None:
+                continue
+            capture_time, raw, grab_time = item
+            encode_start = time.time()
+            try:
+                data = self.encode(raw)
+            except Exception as e:
+                print(f"[{self.name}] 编码失败: {e}")
+                continue
+            encode_time = time.time() - encode_start
+            self.encode_stats.record(encode_time)
+            if data is not None:
+                self.deliver((capture_time, data, (grab_time, encode_time)))
@@ -1,21 +1,26 @@
 """
 视频流模块 - 远程控制系统
 支持实时视频传输和录像功能
+推流按 "读取摄像头 → 编码 → 发送" 三段流水线运行 (见 stream_pipeline),
+摄像头帧读入预分配的缓冲区, 段间只交接最新的一帧
 """
 
 import cv2
-import threading
+import contextlib
 import time
-import queue
 import base64
 from datetime import datetime
 import os
 
+from config import VIDEO_FRAME_BUFFERS
+from image_encoder import encode_jpeg, PIXEL_BGR
+from stream_pipeline import CapturePipeline, LatestFrame, FrameRing, StageStats
+
 
 class VideoStream:
     """视频流处理类"""
     
-    def __init__(self, camera_index=0, width=640, height=480, fps=30):
+    def __init__(self, camera_index=0, width=640, height=480, fps=30, quality=85, send_frames=True):
         """
         初始化视频流
         
@@ -24,15 +29,26 @@ class VideoStream:
             width: 视频宽度
             height: 视频高度
             fps: 帧率
+            quality: 推流的JPEG质量
+            send_frames: 是否编码推流帧 (只录像时为 False, 不占用编码段)
         """
         self.camera_index = camera_index
         self.width = width
         self.height = height
-        self.fps = fps
+        self.capture_fps = fps  # 摄像头采集帧率 (录像使用), 启动后不变
+        self.fps = fps  # 推流帧率, 可由自适应码率调整
+        self.quality = quality
+        self.scale = 1.0  # 推流分辨率缩放比例
+        self.rate = None  # 自适应码率控制器 (RateController), 由推流方设置
+        self.send_frames = send_frames
         self.cap = None
         self.is_streaming = False
-        self.frame_queue = queue.Queue(maxsize=10)
-        self.stream_thread = None
+        self.pipeline = None
+        self.send_stats = StageStats('send')
+        self.frames = LatestFrame(stats=self.send_stats)  # 编码好的推流帧
+        self.live = LatestFrame()  # 最近读取的原始帧 (capture_time, frame), 供实时预览
+        self.ring = None  # 摄像头帧缓冲区, 预热后按帧大小分配
+        self._last_queued = 0.0
         self.recording = False
         self.video_writer = None
         self.record_filepath = None
@@ -52,7 +68,7 @@ class VideoStream:
             # 设置摄像头参数
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
-            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+            self.cap.set(cv2.CAP_PROP_FPS, self.capture_fps)
             
             # 预热摄像头
             for i in range(5):
@@ -60,11 +76,21 @@ class VideoStream:
                 if not ret:
                     return False, f"预热失败: 无法读取帧 {i+1}/5"
             
+            # 之后的帧原地读入这组缓冲区
+            self.ring = FrameRing(VIDEO_FRAME_BUFFERS, frame.shape, frame.dtype)
             self.is_streaming = True
             
-            # 启动捕获线程
-            self.stream_thread = threading.Thread(target=self._capture_loop, daemon=True)
-            self.stream_thread.start()
+            # 启动读取与编码线程
+            self.frames.open()
+            self.live.open()
+            self.pipeline = CapturePipeline(
+                lambda: contextlib.nullcontext(self._grab),
+                self._encode,
+                self.frames.put,
+                lambda: 1.0 / self.capture_fps,
+                name=f'camera{self.camera_index}'
+            )
+            self.pipeline.start()
             
             # 等待一下确保线程启动
             time.sleep(0.1)
@@ -85,70 +111,85 @@ class VideoStream:
             self.stop_recording()
         
         # 等待线程结束
-        if self.stream_thread and self.stream_thread.is_alive():
-            self.stream_thread.join(timeout=2)
+        if self.pipeline:
+            self.pipeline.stop()
+            self.pipeline.join(timeout=2)
         
         # 释放摄像头
         if self.cap:
             self.cap.release()
             self.cap = None
         
-        # 清空队列
-        while not self.frame_queue.empty():
-            try:
-                self.frame_queue.get_nowait()
-            except queue.Empty:
-                break
+        # 清空队列, 唤醒等待帧的推流循环与预览
+        self.frames.close()
+        self.live.close()
+        self.ring = None
         
         return True, "视频流已停止"
     
-    def _capture_loop(self):
-        """视频捕获循环 (在独立线程中运行)"""
-        print(f"[VideoStream] 捕获线程已启动")
-        frame_interval = 1.0 / self.fps
-        captured_count = 0
+    @property
+    def frames_dropped(self):
+        """读取后来不及编码、编码后来不及发送而丢弃的帧数"""
+        dropped = self.frames.dropped
+        if self.pipeline:
+            dropped += self.pipeline.raw_frames.dropped
+        return dropped
+    
+    def get_pipeline_stats(self):
+        """
+        获取流水线各段的统计
         
-        while self.is_streaming:
-            start_time = time.time()
-            
+        Returns:
+            dict: {capture, encode, send}: StageStats 摘要, 另有 raw_queue / send_queue 当前长度
+        """
+        stats = self.pipeline.get_stats() if self.pipeline else {}
+        stats['send'] = self.send_stats.snapshot()
+        stats['send_queue'] = len(self.frames)
+        return stats
+    
+    def _grab(self):
+        """
+        流水线的采集段: 读取一帧 (原地读入空闲的缓冲区), 写入录像
+        
+        Returns:
+            需要推流的帧; 抽帧或不推流时返回 None
+        """
+        # 预览、待编码、正在编码的帧仍在使用, 不能覆盖
+        held = [item[1] for item in self.live.held() + self.pipeline.raw_frames.held()]
+        ret, frame = self.cap.read(self.ring.next(held))
+        if not ret or frame is None:
+            return None
+        capture_time = time.time()
+        
+        # 如果正在录像,写入文件
+        if self.recording and self.video_writer:
             try:
-                ret, frame = self.cap.read()
-                
-                if not ret or frame is None:
-                    continue
-                
-                captured_count += 1
-                
-                # 如果正在录像,写入文件
-                if self.recording and self.video_writer:
-                    try:
-                        self.video_writer.write(frame)
-                    except Exception as e:
-                        print(f"写入视频帧失败: {e}")
-                        self.recording = False  # 停止录像标记
-                
-                # 将帧放入队列
-                if self.frame_queue.full():
-                    try:
-                        self.frame_queue.get_nowait()  # 丢弃旧帧
-                    except queue.Empty:
-                        pass
-                
-                self.frame_queue.put(frame)
-                
-                # 控制帧率
-                elapsed = time.time() - start_time
-                sleep_time = max(0, frame_interval - elapsed)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-            
+                self.video_writer.write(frame)
             except Exception as e:
-                print(f"捕获帧时出错: {e}")
-                time.sleep(0.1)
+                print(f"写入视频帧失败: {e}")
+                self.recording = False  # 停止录像标记
+        
+        self.live.put((capture_time, frame))
+        
+        # 推流帧率低于采集帧率时抽帧
+        if not self.send_frames or capture_time - self._last_queued < 0.9 / max(1, self.fps):
+            return None
+        self._last_queued = capture_time
+        return frame
+    
+    def _encode(self, frame):
+        """流水线的编码段: 按推流分辨率缩放后编码为JPEG"""
+        if self.scale != 1.0:
+            height, width = frame.shape[:2]
+            frame = cv2.resize(frame, (max(1, int(width * self.scale)), max(1, int(height * self.scale))),
+                               interpolation=cv2.INTER_AREA)
+        
+        # 编码为JPEG (与屏幕流共用本机最快的编码器)
+        return encode_jpeg(frame, self.quality, PIXEL_BGR)
     
     def get_frame(self, timeout=1.0):
         """
-        获取最新的视频帧
+        获取最新的视频帧 (副本)
         
         Args:
             timeout: 超时时间(秒)
@@ -156,14 +197,42 @@ class VideoStream:
         Returns:
             tuple: (success, frame) 或 (success, error_message)
         """
+        success, result = self.get_timed_frame(timeout)
+        if not success:
+            return False, result
+        return True, result[1]
+    
+    def get_timed_frame(self, timeout=1.0):
+        """
+        等待下一帧并获取其副本及采集时间 (总是最新的一帧)
+        
+        Args:
+            timeout: 超时时间(秒)
+        
+        Returns:
+            tuple: (success, (capture_time, frame)) 或 (success, error_message)
+        """
         if not self.is_streaming:
             return False, "视频流未启动"
         
-        try:
-            frame = self.frame_queue.get(timeout=timeout)
-            return True, frame
-        except queue.Empty:
-            return False, "获取帧超时"
+        # 缓冲区之后会被复用, 在锁内复制 (复制期间不会读入新帧覆盖它)
+        result = self.live.wait(self.live.seq, timeout, lambda item: (item[0], item[1].copy()))
+        if result is None:
+            return False, "获取帧超时" if self.is_streaming else "视频流未启动"
+        return True, result[1]
+    
+    def set_rate(self, quality, fps, scale=1.0):
+        """
+        调整推流参数 (自适应码率), 录像不受影响
+        
+        Args:
+            quality: JPEG质量
+            fps: 推流帧率 (不超过采集帧率)
+            scale: 分辨率缩放比例
+        """
+        self.quality = quality
+        self.fps = min(fps, self.capture_fps)
+        self.scale = scale
     
     def get_frame_jpeg(self, quality=85):
         """
@@ -175,24 +244,33 @@ class VideoStream:
         Returns:
             tuple: (success, jpeg_data) 或 (success, error_message)
         """
-        success, result = self.get_frame()
-        
+        success, frame = self.get_frame()
         if not success:
-            return False, result
+            return False, frame
         
         try:
-            # 编码为JPEG
-            encode_param = [cv2.IMWRITE_JPEG_QUALITY, quality]
-            success, buffer = cv2.imencode('.jpg', result, encode_param)
-            
-            if not success:
-                return False, "JPEG编码失败"
-            
-            return True, buffer.tobytes()
-        
+            return True, encode_jpeg(frame, quality, PIXEL_BGR)
         except Exception as e:
             return False, f"编码失败: {e}"
     
+    def get_timed_frame_jpeg(self, timeout=1.0):
+        """
+        取出流水线编码好的下一帧推流帧 (按 quality / scale / fps 编码)
+        
+        Args:
+            timeout: 等待帧的超时时间(秒)
+        
+        Returns:
+            tuple: (success, (capture_time, jpeg_data, (读取耗时, 编码耗时))) 或 (success, error_message)
+        """
+        if not self.is_streaming:
+            return False, "视频流未启动"
+        
+        item = self.frames.get(timeout)
+        if item is None:
+            return False, "获取帧超时"
+        return True, item
+    
     def get_frame_base64(self, quality=85):
         """
         获取Base64编码的JPEG帧
@@ -263,7 +341,7 @@ class VideoStream:
                     writer = cv2.VideoWriter(
                         self.record_filepath,
                         fourcc,
-                        self.fps,
+                        self.capture_fps,
                         (self.width, self.height)
                     )
                     
@@ -333,7 +411,7 @@ class VideoStream:
             'fps': self.fps,
             'is_streaming': self.is_streaming,
             'is_recording': self.recording,
-            'queue_size': self.frame_queue.qsize()
+            'queue_size': len(self.frames)
         }
         
         if self.recording and self.record_filepath: